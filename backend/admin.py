@@ -2,6 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from .models import *
 from django.contrib.auth.models import Group
+from .sequence import allocate_seq_numbers, delete_and_compact
 
 
 admin.site.unregister(Group)
@@ -61,8 +62,66 @@ class SurgeryAdmin(admin.ModelAdmin):
         'surgery_name'
     ]
 
+    def get_readonly_fields(self, request, obj=None):
+        # Numbers come from SurgerySequence; reordering and moving have their own views.
+        if obj is None:
+            return ['seq_number']
+        return ['seq_number', 'branch', 'date_of_surgery']
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            obj.seq_number = allocate_seq_numbers(obj.branch_id, obj.date_of_surgery_id)
+        super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        delete_and_compact(obj)
+
+    def delete_queryset(self, request, queryset):
+        for surgery in queryset:
+            delete_and_compact(surgery)
+
 
 @admin.register(SurgeryDay)
 class SurgeryDayAdmin(admin.ModelAdmin):
     fields = ['date']
 
+
+@admin.register(Holiday)
+class HolidayAdmin(admin.ModelAdmin):
+    list_display = [
+        'date',
+        'name',
+    ]
+
+
+@admin.register(TheatreClosure)
+class TheatreClosureAdmin(admin.ModelAdmin):
+    list_display = [
+        'branch',
+        'start_date',
+        'end_date',
+        'reason',
+    ]
+
+
+@admin.register(BranchCapacity)
+class BranchCapacityAdmin(admin.ModelAdmin):
+    list_display = [
+        'branch',
+        'daily_limit',
+    ]
+
+
+@admin.register(DayLockRun)
+class DayLockRunAdmin(admin.ModelAdmin):
+    list_display = [
+        'run_at',
+        'locked_through',
+        'days_locked',
+    ]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,41 @@
+from .models import SurgeryDay
+
+# Surgery fields a client may ask for with ?fields=; surgeons are ids only.
+DAY_API_FIELDS = (
+    'id', 'seq_number', 'full_name', 'age', 'diagnost', 'own_branch_name',
+    'surgery_name', 'surgery_type', 'surgeons',
+)
+
+
+def parse_fields(value: str):
+    """Requested surgery fields in DAY_API_FIELDS order, or None if one is unknown."""
+    if not value:
+        return DAY_API_FIELDS
+    requested = {field.strip() for field in value.split(',') if field.strip()}
+    if not requested or requested - set(DAY_API_FIELDS):
+        return None
+    return tuple(field for field in DAY_API_FIELDS if field in requested)
+
+
+def build_day_payload(day: SurgeryDay, branches: list, fields=DAY_API_FIELDS) -> dict:
+    # Projection of the cached day snapshot, so no extra queries.
+    surgeon_ids = 'surgeons' in fields
+    return {
+        'date': day.date.isoformat(),
+        'editable': day.editable,
+        'branches': [
+            {
+                'id': branch['id'],
+                'name': branch['name'],
+                'branch_number': branch['branch_number'],
+                'surgeries': [
+                    {
+                        **{field: surgery[field] for field in fields if field != 'surgeons'},
+                        **({'surgeons': [surgeon['id'] for surgeon in surgery['surgeons']]} if surgeon_ids else {}),
+                    }
+                    for surgery in branch['surgeries']
+                ],
+            }
+            for branch in branches
+        ],
+    }
@@ -6,5 +6,10 @@ class BackendConfig(AppConfig):
     name = 'backend'
 
     def ready(self):
-        from .schedulers import start_scheduler
-        start_scheduler()
+        from . import signals
+        from django.conf import settings
+        if settings.CATALOG_SEARCH_MODE == 'memory':
+            import threading
+            from .search import warm_search_indexes
+            threading.Thread(target=warm_search_indexes, daemon=True).start()
+        # Background jobs run in their own process: manage.py run_scheduler.
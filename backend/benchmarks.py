@@ -0,0 +1,125 @@
+import json
+import shutil
+import statistics
+import tempfile
+from datetime import date, timedelta
+from time import perf_counter
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from .loadgen import seed_load
+from .models import CustomUser, Surgery, SurgeryDay
+
+
+def measure(client: Client, method: str, path: str, iterations: int, data=None, before=None, **kwargs) -> dict:
+    timings, queries, statuses = [], [], set()
+    for _ in range(iterations):
+        if before:
+            before()
+        payload = data() if callable(data) else data
+        with CaptureQueriesContext(connection) as ctx:
+            started = perf_counter()
+            response = getattr(client, method)(path, payload, **kwargs)
+            timings.append((perf_counter() - started) * 1000)
+        queries.append(len(ctx.captured_queries))
+        statuses.add(response.status_code)
+    timings.sort()
+    return {
+        'iterations': iterations,
+        'min_ms': round(timings[0], 3),
+        'p50_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        'max_ms': round(timings[-1], 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'queries': max(queries),
+        'statuses': sorted(statuses),
+    }
+
+
+def run_scenarios(client: Client, day: SurgeryDay, iterations: int, media_root: str) -> dict:
+    params = {'date': day.date.isoformat()}
+    busiest = Surgery.objects.filter(date_of_surgery=day).values('branch_id', 'branch__branch_number').annotate(
+        rows=Count('id')).order_by('-rows').first()
+
+    def clear_pdfs():
+        cache.clear()
+        shutil.rmtree(media_root, ignore_errors=True)
+
+    def reversed_order():
+        rows = list(Surgery.objects.filter(date_of_surgery=day, branch_id=busiest['branch_id']).order_by(
+            'seq_number').values_list('id', flat=True))
+        return json.dumps([{'id': pk, 'seq_number': len(rows) - i} for i, pk in enumerate(rows)])
+
+    def move_last_to_top():
+        surgery = Surgery.objects.filter(date_of_surgery=day, branch_id=busiest['branch_id']).order_by(
+            '-seq_number').first()
+        return json.dumps({'surgery_id': surgery.id, 'new_seq_number': 1,
+                           'new_branch_number': busiest['branch__branch_number']})
+
+    return {
+        'home_cold': measure(client, 'get', '/', iterations, params, before=cache.clear),
+        'home_warm': measure(client, 'get', '/', iterations, params),
+        'pdf_cold': measure(client, 'get', '/download-pdf/', iterations, params, before=clear_pdfs),
+        'pdf_warm': measure(client, 'get', '/download-pdf/', iterations, params),
+        'search_surgery_name': measure(client, 'get', '/search_surgery_name/', iterations, {'query': 'резекц'}),
+        'search_surgery_type': measure(client, 'get', '/search_surgery_type/', iterations, {'query': 'вм'}),
+        'update_seq_number': measure(client, 'post', '/update_seq_number/', iterations, reversed_order,
+                                     content_type='application/json'),
+        'update_surgery_seq': measure(client, 'post', '/update_surgery_seq/', iterations, move_last_to_top,
+                                      content_type='application/json'),
+    }
+
+
+def run_benchmarks(sizes: list, surgeries_per_day: int, iterations: int, seed: int = 0, log=print) -> dict:
+    # Expects to run inside a throwaway test database; sizes are cumulative
+    # days of history, the measured day is always the newest one.
+    end_date = date.today() + timedelta(days=1)
+    while end_date.isoweekday() in (6, 7):
+        end_date += timedelta(days=1)
+
+    user = CustomUser.objects.create_superuser('benchmark', 'benchmark', first_name='Bench', last_name='Mark')
+    client = Client()
+    client.force_login(user)
+
+    results = []
+    seeded = 0
+    media_root = tempfile.mkdtemp()
+    try:
+        with override_settings(MEDIA_ROOT=media_root):
+            for size in sorted(sizes):
+                seed_load(days=size - seeded, surgeries_per_day=surgeries_per_day,
+                          end_date=end_date - timedelta(days=seeded), seed=seed + size)
+                seeded = size
+                day = SurgeryDay.objects.get(date=end_date)
+                log(f'Measuring with {size} days of history ({Surgery.objects.count()} surgeries)')
+                results.append({
+                    'days': size,
+                    'surgeries': Surgery.objects.count(),
+                    'surgeries_on_day': Surgery.objects.filter(date_of_surgery=day).count(),
+                    'endpoints': run_scenarios(client, day, iterations, media_root),
+                })
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+    return {
+        'database': connection.vendor,
+        'surgeries_per_day': surgeries_per_day,
+        'iterations': iterations,
+        'results': results,
+    }
+
+
+def compare_results(current: dict, baseline: dict, threshold: float) -> list:
+    baseline_sizes = {result['days']: result['endpoints'] for result in baseline.get('results', [])}
+    regressions = []
+    for result in current['results']:
+        for name, stats in result['endpoints'].items():
+            before = baseline_sizes.get(result['days'], {}).get(name)
+            if not before:
+                continue
+            if stats['queries'] > before['queries']:
+                regressions.append(f"{name} @ {result['days']} days: queries {before['queries']} -> {stats['queries']}")
+            if before['p50_ms'] and stats['p50_ms'] / before['p50_ms'] > threshold:
+                regressions.append(f"{name} @ {result['days']} days: p50 {before['p50_ms']}ms -> {stats['p50_ms']}ms")
+    return regressions
@@ -0,0 +1,87 @@
+from django.db import transaction
+from .models import Branch, Surgery, SurgeryDay, SurgeryName, SurgeryType
+from .calendar import hospital_calendar
+from .events import publish_day_event
+from .search import surgery_name_index, surgery_type_index
+from .sequence import allocate_seq_numbers, lock_sequence
+from .signals import notify_day_changed
+
+
+class BookingError(Exception):
+    pass
+
+
+def check_capacity(branch_id: int, day_pk: int, count: int = 1):
+    # Exact only under lock_sequence(branch_id, day_pk): concurrent bookings
+    # of the same (branch, day) wait for the lock, so the COUNT cannot go stale.
+    limit = hospital_calendar.get_capacity(branch_id)
+    if limit is not None and Surgery.objects.filter(
+            branch_id=branch_id, date_of_surgery_id=day_pk).count() + count > limit:
+        raise BookingError('Лимит операций отдела на этот день исчерпан.')
+
+
+def resolve_catalog(model, field: str, index, names) -> dict:
+    """Map each name to its catalog pk, creating the missing ones: two or three queries for any number."""
+    names = set(names)
+    if not names:
+        return {}
+    found = dict(model.objects.filter(**{f'{field}__in': names}).values_list(field, 'pk'))
+    missing = names - set(found)
+    if missing:
+        # ignore_conflicts: a concurrent booking may create the same name.
+        model.objects.bulk_create([model(**{field: name}) for name in missing], ignore_conflicts=True)
+        created = dict(model.objects.filter(**{f'{field}__in': missing}).values_list(field, 'pk'))
+        # bulk_create skips the signals that keep the search index current.
+        for name, pk in created.items():
+            transaction.on_commit(lambda pk=pk, name=name: index.upsert(pk, name))
+        found.update(created)
+    return found
+
+
+def book_surgeries(day: SurgeryDay, branch: Branch, entries: list) -> list:
+    """
+    Insert a list of cleaned SurgeryBatchEntryForm data for one (branch, day)
+    in one transaction, numbered after the branch's last surgery that day.
+    Returns the new surgery ids in entry order.
+    """
+    if hospital_calendar.is_closed(branch.pk, day.date):
+        raise BookingError('Операционная отдела закрыта в этот день.')
+
+    with transaction.atomic():
+        names = resolve_catalog(SurgeryName, 'surgery_name', surgery_name_index,
+                                (entry['surgery_name'] for entry in entries))
+        types = resolve_catalog(SurgeryType, 'type_name', surgery_type_index,
+                                (entry['surgery_type'] for entry in entries if entry['surgery_type']))
+
+        counter = lock_sequence(branch.pk, day.pk)
+        check_capacity(branch.pk, day.pk, len(entries))
+
+        first_seq_number = allocate_seq_numbers(branch.pk, day.pk, len(entries), counter=counter)
+        surgeries = Surgery.objects.bulk_create([
+            Surgery(
+                seq_number=first_seq_number + index,
+                branch=branch,
+                own_branch=branch,
+                full_name=entry['full_name'],
+                age=entry['age'],
+                diagnost=entry['diagnost'],
+                surgery_name_id=names[entry['surgery_name']],
+                surgery_type_id=types.get(entry['surgery_type']),
+                date_of_surgery=day,
+            )
+            for index, entry in enumerate(entries)
+        ])
+        Through = Surgery.surgeons.through
+        Through.objects.bulk_create([
+            Through(surgery_id=surgery.pk, surgeon_id=surgeon_id)
+            for surgery, entry in zip(surgeries, entries)
+            for surgeon_id in entry['surgeons']
+        ])
+
+        # bulk_create bypasses the Surgery signals: invalidate once, then tell
+        # live day views about each new row.
+        transaction.on_commit(lambda: notify_day_changed(day.pk))
+        for surgery in surgeries:
+            publish_day_event(day.pk, {'type': 'row', 'action': 'added', 'id': surgery.pk})
+
+    return [surgery.pk for surgery in surgeries]
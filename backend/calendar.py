@@ -0,0 +1,128 @@
+import threading
+from datetime import date, timedelta
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from .models import SurgeryDay, Holiday, TheatreClosure, BranchCapacity
+from .schedule import get_version, bump_version
+
+CALENDAR_VERSION_KEY = 'calendar:days'
+RULES_VERSION_KEY = 'calendar:rules'
+
+
+class HospitalCalendar:
+    # Holidays, theatre closures and branch capacities compiled into sets and
+    # dicts, so booking checks are lookups instead of queries.
+
+    def __init__(self):
+        self.version = None
+        self._holidays = frozenset()
+        self._closed = frozenset()
+        self._capacity = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        version = get_version(RULES_VERSION_KEY)
+        holidays = frozenset(Holiday.objects.values_list('date', flat=True))
+        # (branch_id, date) per closed day; branch_id None closes every theatre.
+        closed = frozenset(
+            (branch_id, start + timedelta(days=offset))
+            for branch_id, start, end in TheatreClosure.objects.values_list('branch_id', 'start_date', 'end_date')
+            for offset in range((end - start).days + 1)
+        )
+        capacity = dict(BranchCapacity.objects.values_list('branch_id', 'daily_limit'))
+        with self._lock:
+            self._holidays = holidays
+            self._closed = closed
+            self._capacity = capacity
+            self.version = version
+
+    def ensure_current(self):
+        if self.version != get_version(RULES_VERSION_KEY):
+            self.load()
+
+    def is_holiday(self, day: date) -> bool:
+        self.ensure_current()
+        return day in self._holidays
+
+    def is_closed(self, branch_id: int, day: date) -> bool:
+        self.ensure_current()
+        return (None, day) in self._closed or (branch_id, day) in self._closed
+
+    def get_capacity(self, branch_id: int):
+        self.ensure_current()
+        return self._capacity.get(branch_id)
+
+
+hospital_calendar = HospitalCalendar()
+
+
+def invalidate_rules():
+    bump_version(RULES_VERSION_KEY)
+
+
+class CalendarNotMaterialized(Exception):
+    pass
+
+
+def is_surgery_date(day: date) -> bool:
+    return day.isoweekday() != 7 and not hospital_calendar.is_holiday(day)
+
+
+def is_editable_by_default(day: date) -> bool:
+    # Saturdays are only planned by superusers.
+    return day.isoweekday() != 6
+
+
+class DayCalendar:
+    # date -> (id, date, editable) for every SurgeryDay; lookups on the request
+    # path are dict hits plus one cache read of the shared version.
+
+    def __init__(self):
+        self.version = None
+        self._days = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        version = get_version(CALENDAR_VERSION_KEY)
+        days = {row[1]: row for row in SurgeryDay.objects.values_list('id', 'date', 'editable')}
+        with self._lock:
+            self._days = days
+            self.version = version
+
+    def ensure_current(self):
+        # Other processes bump the shared version when they change a day.
+        if self.version != get_version(CALENDAR_VERSION_KEY):
+            self.load()
+
+    def get(self, day: date):
+        self.ensure_current()
+        row = self._days.get(day)
+        if row is None:
+            return None
+        # A fresh instance per lookup, so callers can't alter the shared map.
+        return SurgeryDay.from_db(DEFAULT_DB_ALIAS, ['id', 'date', 'editable'], row)
+
+
+day_calendar = DayCalendar()
+
+
+def invalidate_calendar():
+    bump_version(CALENDAR_VERSION_KEY)
+
+
+def materialize_days(start: date = None, horizon: int = None) -> int:
+    """Create the missing SurgeryDay rows from `start` (today) over the horizon; returns how many."""
+    start = start or date.today()
+    horizon = settings.CALENDAR_HORIZON_DAYS if horizon is None else horizon
+    dates = [start + timedelta(days=i) for i in range(horizon + 1)]
+    existing = set(SurgeryDay.objects.filter(date__range=(dates[0], dates[-1])).values_list('date', flat=True))
+    missing = [
+        SurgeryDay(date=day, editable=is_editable_by_default(day))
+        for day in dates
+        if is_surgery_date(day) and day not in existing
+    ]
+    if missing:
+        # ignore_conflicts: another process may be filling the same range.
+        SurgeryDay.objects.bulk_create(missing, ignore_conflicts=True)
+        invalidate_calendar()
+    return len(missing)
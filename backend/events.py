@@ -0,0 +1,225 @@
+import asyncio
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import ScheduleEvent
+
+# Sent instead of the overflowing events when a client falls this far behind.
+RESYNC_EVENT = {'type': 'resync'}
+
+
+class LocalSubscription:
+    def __init__(self, broker, day_pk: int):
+        self.broker = broker
+        self.day_pk = day_pk
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=settings.SCHEDULE_EVENTS_QUEUE_SIZE)
+
+    def offer(self, event: dict):
+        # Runs on the subscriber's loop.
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC_EVENT)
+
+    async def get(self, timeout: float):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """In-process pub/sub: enough for a single uvicorn worker."""
+
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, day_pk: int) -> LocalSubscription:
+        subscription = LocalSubscription(self, day_pk)
+        with self._lock:
+            self._subscriptions[day_pk].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: LocalSubscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.day_pk)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.day_pk]
+
+    def publish(self, day_pk: int, event: dict):
+        # Called from sync code in any thread; hand over to each subscriber's loop.
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(day_pk, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:
+                self.unsubscribe(subscription)
+
+
+class CacheSubscription:
+    def __init__(self, broker, day_pk: int):
+        self.broker = broker
+        self.key = broker.log_key(day_pk)
+        self.last = None
+        self.pending = deque()
+
+    async def get(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        while not self.pending:
+            head = await cache.aget(self.key, 0)
+            if self.last is None:
+                self.last = head
+            elif head < self.last:
+                # The counter was evicted or restarted; what came in between is lost.
+                self.pending.append(RESYNC_EVENT)
+                self.last = head
+            elif head > self.last:
+                keys = [f'{self.key}:{seq}' for seq in range(self.last + 1, head + 1)]
+                events = await cache.aget_many(keys)
+                if len(events) < len(keys) or head - self.last > settings.SCHEDULE_EVENTS_QUEUE_SIZE:
+                    self.pending.append(RESYNC_EVENT)
+                else:
+                    self.pending.extend(events[key] for key in keys)
+                self.last = head
+            if self.pending:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            await asyncio.sleep(min(self.broker.poll_interval, remaining))
+        return self.pending.popleft()
+
+    def close(self):
+        pass
+
+
+class CacheBroker:
+    """
+    Cross-process pub/sub over the shared cache: publishers append to a short
+    per-day log, subscribers poll its head. Needs a cache whose incr() is
+    atomic across processes (Redis, Memcached); with FileBasedCache two
+    publishers can take the same slot, so use DatabaseBroker there.
+    """
+    timeout = 120
+
+    def __init__(self):
+        self.poll_interval = settings.SCHEDULE_EVENTS_POLL_INTERVAL
+
+    def log_key(self, day_pk: int) -> str:
+        return f'events:day:{day_pk}'
+
+    def subscribe(self, day_pk: int) -> CacheSubscription:
+        return CacheSubscription(self, day_pk)
+
+    def publish(self, day_pk: int, event: dict):
+        key = self.log_key(day_pk)
+        cache.add(key, 0, None)
+        try:
+            seq = cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+            seq = 1
+        cache.set(f'{key}:{seq}', event, self.timeout)
+
+
+class DatabaseBroker(LocalBroker):
+    """
+    Cross-process pub/sub over the ScheduleEvent table: the database hands
+    out the ids, so concurrent publishers never collide. One poller task per
+    process reads the new events for every watched day and hands them to the
+    local subscriptions, so open day views cost no connections of their own.
+    Rows are pruned by the scheduler.
+    """
+    retention = timedelta(minutes=5)
+    batch_size = 500
+
+    def __init__(self):
+        super().__init__()
+        self.poll_interval = settings.SCHEDULE_EVENTS_POLL_INTERVAL
+        self.last = None
+        self._poller = None
+
+    def subscribe(self, day_pk: int) -> LocalSubscription:
+        subscription = super().subscribe(day_pk)
+        poller = self._poller
+        if poller is None or poller.done() or poller.get_loop() is not subscription.loop:
+            self.last = None
+            self._poller = subscription.loop.create_task(self.run_poller())
+        return subscription
+
+    def publish(self, day_pk: int, event: dict):
+        # Local subscribers get it from the poller like everyone else.
+        ScheduleEvent.objects.create(day_id=day_pk, payload=event)
+
+    def poll(self):
+        with self._lock:
+            day_pks = list(self._subscriptions)
+        try:
+            if self.last is None:
+                # Start from now: clients load the current schedule when they connect.
+                self.last = ScheduleEvent.objects.aggregate(last=Max('id'))['last'] or 0
+                return
+            rows = list(ScheduleEvent.objects.filter(id__gt=self.last, day_id__in=day_pks).order_by(
+                'id').values_list('id', 'day_id', 'payload')[:self.batch_size])
+        finally:
+            # Hand the connection back between polls rather than hold one per process.
+            if not connection.in_atomic_block:
+                close_old_connections()
+        for _, day_pk, payload in rows:
+            super().publish(day_pk, payload)
+        if rows:
+            self.last = rows[-1][0]
+
+    async def run_poller(self):
+        # Ends with the last subscription; the next subscribe starts a new one.
+        while self._subscriptions:
+            await sync_to_async(self.poll)()
+            await asyncio.sleep(self.poll_interval)
+
+
+def prune_schedule_events() -> int:
+    # Subscribers poll every second or so; older events were read long ago.
+    removed, _ = ScheduleEvent.objects.filter(
+        created_at__lt=timezone.now() - DatabaseBroker.retention).delete()
+    return removed
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None or type(_broker) is not import_string(settings.SCHEDULE_EVENTS_BACKEND):
+            _broker = import_string(settings.SCHEDULE_EVENTS_BACKEND)()
+        return _broker
+
+
+def publish_day_event(day_pk: int, event: dict):
+    # Subscribers only hear about committed changes.
+    if day_pk is not None:
+        transaction.on_commit(lambda: get_broker().publish(day_pk, event))
+
+
+def format_sse(event: dict) -> str:
+    return f'data: {json.dumps(event, ensure_ascii=False)}\n\n'
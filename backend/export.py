@@ -0,0 +1,178 @@
+import csv
+import io
+import zipfile
+from datetime import date
+from xml.sax.saxutils import escape
+from asgiref.sync import sync_to_async
+from django.db.models import Aggregate, CharField
+from .models import Surgery
+
+EXPORT_COLUMNS = [
+    'Дата', 'Номер', 'Отдел', 'Ф.И.О пациента', 'Возраст', 'Диагноз',
+    'Название операции', 'Тип операции', 'Отдел пациента', 'Хирурги',
+]
+# Rows fetched per server-side cursor round trip, and rows per streamed block.
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_BLOCK_ROWS = 500
+
+
+class SurgeonNames(Aggregate):
+    # Comma-joined surgeon names per surgery: GROUP_CONCAT on SQLite,
+    # STRING_AGG on PostgreSQL.
+    function = 'GROUP_CONCAT'
+    template = "%(function)s(%(expressions)s, ', ')"
+    output_field = CharField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, function='STRING_AGG',
+                           template="%(function)s(%(expressions)s, ', ' ORDER BY %(expressions)s)",
+                           **extra_context)
+
+
+def get_export_rows(start: date, end: date, branch_ids=None, chunk_size: int = EXPORT_CHUNK_SIZE):
+    surgeries = Surgery.objects.filter(date_of_surgery__date__range=(start, end))
+    if branch_ids is not None:
+        surgeries = surgeries.filter(branch_id__in=branch_ids)
+
+    # Names, branches and surgeons are joined in the one query; iterator()
+    # reads it through a server-side cursor, chunk_size rows at a time.
+    rows = surgeries.values_list(
+        'id', 'date_of_surgery__date', 'branch__branch_number', 'seq_number', 'branch__name', 'full_name', 'age',
+        'diagnost', 'surgery_name__surgery_name', 'surgery_type__type_name', 'own_branch__name',
+    ).annotate(
+        surgeon_names=SurgeonNames('surgeons__full_name'),
+    ).order_by('date_of_surgery__date', 'branch__branch_number', 'seq_number', 'id')
+
+    for (_, day, branch_number, seq_number, branch_name, full_name, age, diagnost, surgery_name, surgery_type,
+         own_branch_name, surgeon_names) in rows.iterator(chunk_size=chunk_size):
+        yield [
+            day.strftime('%d.%m.%Y'), f'{branch_number}.{seq_number}', branch_name, full_name,
+            age if age is not None else '', diagnost, surgery_name, surgery_type or '', own_branch_name,
+            surgeon_names or '',
+        ]
+
+
+def iter_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so Excel opens the Cyrillic columns as UTF-8.
+    buffer.write('\ufeff')
+    writer.writerow(EXPORT_COLUMNS)
+    for index, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if index % EXPORT_BLOCK_ROWS == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+class StreamBuffer(io.RawIOBase):
+    # Write-only, non-seekable target: zipfile falls back to data descriptors
+    # and we hand out whatever was written after each block.
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+XLSX_MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+XLSX_REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        f'<Relationship Id="rId1" Type="{XLSX_REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        f'<workbook xmlns="{XLSX_MAIN_NS}" xmlns:r="{XLSX_REL_NS}">'
+        '<sheets><sheet name="Операции" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        f'<Relationship Id="rId1" Type="{XLSX_REL_NS}/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def xlsx_row(values) -> bytes:
+    cells = []
+    for value in values:
+        if isinstance(value, int):
+            cells.append(f'<c><v>{value}</v></c>')
+        else:
+            cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">{escape(str(value))}</t></is></c>')
+    return f'<row>{"".join(cells)}</row>'.encode()
+
+
+def iter_xlsx(rows):
+    stream = StreamBuffer()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_PARTS.items():
+            archive.writestr(name, content)
+        with archive.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write(f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        f'<worksheet xmlns="{XLSX_MAIN_NS}"><sheetData>'.encode())
+            sheet.write(xlsx_row(EXPORT_COLUMNS))
+            for index, row in enumerate(rows, start=1):
+                sheet.write(xlsx_row(row))
+                if index % EXPORT_BLOCK_ROWS == 0:
+                    yield stream.drain()
+            sheet.write(b'</sheetData></worksheet>')
+    yield stream.drain()
+
+
+EXPORT_FORMATS = {
+    'csv': (iter_csv, 'text/csv; charset=utf-8'),
+    'xlsx': (iter_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+
+def stream_export(export_format: str, start: date, end: date, branch_ids=None):
+    writer, _ = EXPORT_FORMATS[export_format]
+    return writer(get_export_rows(start, end, branch_ids))
+
+
+async def aiter_blocks(blocks):
+    # Under ASGI a sync iterator would be collected into a list first; pull
+    # one block at a time on the sync thread instead, so the cursor stays on
+    # its connection.
+    done = object()
+    while True:
+        block = await sync_to_async(next)(blocks, done)
+        if block is done:
+            break
+        if block:
+            yield block
@@ -1,7 +1,8 @@
 from django import forms
 from .functions import get_next_surgery_day
-from .models import Surgery, SurgeryName, SurgeryType, Surgeon
-from datetime import date
+from .calendar import hospital_calendar
+from .models import Surgery, Surgeon
+from .search import surgery_name_index, surgery_type_index
 
 
 class SurgeryForm(forms.Form):
@@ -16,23 +17,36 @@ class SurgeryForm(forms.Form):
         required=True,
     )
 
+    def __init__(self, *args, day=None, branch=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.day = day
+        self.branch = branch
+        if branch is not None:
+            # Only the branch's own surgeons can be picked, and validating
+            # them is one query on the branch's rows.
+            self.fields['surgeons'].queryset = Surgeon.objects.filter(branch=branch)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.day and self.branch:
+            if hospital_calendar.is_closed(self.branch.pk, self.day.date):
+                raise forms.ValidationError('Операционная отдела закрыта в этот день.')
+        return cleaned_data
+
     def save(self, commit=True):
-        full_name = self.cleaned_data.get('full_name')
-        age = self.cleaned_data.get('age')
-        diagnost = self.cleaned_data.get('diagnost')
-        surgery_name, _ = SurgeryName.objects.get_or_create(surgery_name=self.cleaned_data.get('surgery_name'))
-        surgery_type, _ = SurgeryType.objects.get_or_create(type_name=self.cleaned_data.get('surgery_type'))
+        surgery_type = self.cleaned_data.get('surgery_type')
         surgeons = self.cleaned_data.get('surgeons')
-        date_of_surgery = get_next_surgery_day()
 
         surgery = Surgery(
-            full_name=full_name,
-            age=age,
-            diagnost=diagnost,
-            surgery_name=surgery_name,
-            surgery_type=surgery_type,
-            date_of_surgery=date_of_surgery,
+            full_name=self.cleaned_data.get('full_name'),
+            age=self.cleaned_data.get('age'),
+            diagnost=self.cleaned_data.get('diagnost'),
+            surgery_name_id=surgery_name_index.resolve(self.cleaned_data.get('surgery_name')),
+            surgery_type_id=surgery_type_index.resolve(surgery_type) if surgery_type else None,
+            date_of_surgery=self.day or get_next_surgery_day(),
         )
+        if self.branch is not None:
+            surgery.branch = surgery.own_branch = self.branch
 
         if commit:
             surgery.save()
@@ -42,6 +56,21 @@ class SurgeryForm(forms.Form):
         return surgery, surgeons
 
 
+class SurgeryBatchEntryForm(forms.Form):
+    # One patient of a batch booking. Surgeon choices are the branch's
+    # surgeons, loaded once for the whole batch by the caller.
+    full_name = forms.CharField(max_length=255, strip=True)
+    age = forms.IntegerField(required=False, min_value=0)
+    diagnost = forms.CharField(max_length=255, strip=True)
+    surgery_name = forms.CharField(max_length=255, strip=True)
+    surgery_type = forms.CharField(max_length=255, required=False, strip=True)
+    surgeons = forms.TypedMultipleChoiceField(coerce=int, required=True)
+
+    def __init__(self, *args, surgeon_choices=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['surgeons'].choices = surgeon_choices
+
+
 class SurgeryEditForm(forms.Form):
     full_name = forms.CharField(max_length=255, required=True)
     age = forms.IntegerField(required=False)
@@ -58,11 +87,12 @@ class SurgeryEditForm(forms.Form):
         super().__init__(*args, **kwargs)
         self.instance = instance
         if instance and isinstance(instance, Surgery):
+            self.fields['surgeons'].queryset = Surgeon.objects.filter(branch_id=instance.branch_id)
             self.fields['full_name'].initial = instance.full_name
             self.fields['age'].initial = instance.age
             self.fields['diagnost'].initial = instance.diagnost
             self.fields['surgery_name'].initial = instance.surgery_name.surgery_name
-            self.fields['surgery_type'].initial = instance.surgery_type.type_name
+            self.fields['surgery_type'].initial = instance.surgery_type.type_name if instance.surgery_type else ''
             self.fields['surgeons'].initial = instance.surgeons.all()
 
     def save(self):
@@ -70,10 +100,9 @@ class SurgeryEditForm(forms.Form):
             self.instance.full_name = self.cleaned_data['full_name']
             self.instance.age = self.cleaned_data['age']
             self.instance.diagnost = self.cleaned_data['diagnost']
-            surgery_name, _ = SurgeryName.objects.get_or_create(surgery_name=self.cleaned_data['surgery_name'])
-            surgery_type, _ = SurgeryType.objects.get_or_create(type_name=self.cleaned_data['surgery_type'])
-            self.instance.surgery_name = surgery_name
-            self.instance.surgery_type = surgery_type
+            surgery_type = self.cleaned_data['surgery_type']
+            self.instance.surgery_name_id = surgery_name_index.resolve(self.cleaned_data['surgery_name'])
+            self.instance.surgery_type_id = surgery_type_index.resolve(surgery_type) if surgery_type else None
             self.instance.save()
             self.instance.surgeons.set(self.cleaned_data['surgeons'])
         return self.instance
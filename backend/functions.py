@@ -1,46 +1,61 @@
-from datetime import date, timedelta
-from .models import SurgeryDay
-
-
-def get_or_create_surgery_day(date: date, editable: bool = True):
-    try:
-        day = SurgeryDay.objects.get(date=date)
-    except SurgeryDay.DoesNotExist:
-        if date.isoweekday() == 6:
-            editable = False
-        elif date.isoweekday() == 7:
-            return False
-        day = SurgeryDay(date=date, editable=editable)
-        day.save()
-    except Exception as err:
-        print(err)
-        day, _ = SurgeryDay.objects.get_or_create(date=date)
-    return day
-
+from datetime import date, time, timedelta
+from zoneinfo import ZoneInfo
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import SurgeryDay, DayLockRun
+from .schedule import invalidate_all_days
+from .events import publish_day_event
+from .calendar import CalendarNotMaterialized, day_calendar, invalidate_calendar, is_surgery_date
 
-def get_next_surgery_day():
-    tomorrow = date.today() + timedelta(days=1)
-    if tomorrow.isoweekday() == 7:
-        tomorrow += timedelta(days=1)
-    tw_day = get_or_create_surgery_day(date=tomorrow)
 
-    return tw_day
+def get_next_surgery_date():
+    # Skips Sundays and holidays.
+    next_date = date.today() + timedelta(days=1)
+    while not is_surgery_date(next_date):
+        next_date += timedelta(days=1)
+    return next_date
 
 
-def get_day(date: date):
-    if date.isoweekday() == 7:
-        return False
-    day = get_or_create_surgery_day(date=date)
+def get_next_surgery_day():
+    next_date = get_next_surgery_date()
+    day = day_calendar.get(next_date)
+    if day is None:
+        # Requests never create days; run_scheduler materializes the horizon on start.
+        raise CalendarNotMaterialized(
+            f'No SurgeryDay for {next_date}: start manage.py run_scheduler to build the calendar.')
     return day
 
 
-def get_next_30_days():
-    days = []
-    for i in range(1, 31):
-        that_day = date.today() + timedelta(days=i)
-        if that_day.isoweekday() == 7:
-            continue
-        day = get_or_create_surgery_day(date=that_day)
-        days.append(day)
-    
-    return days
+def get_day(date: date):
+    # None for dates outside the materialized calendar; requests never create days.
+    if not is_surgery_date(date):
+        return False
+    return day_calendar.get(date)
+
+
+def get_lock_cutoff_date(now=None) -> date:
+    """Last date that should be locked: a day locks at DAY_LOCK_TIME on the next day."""
+    now = timezone.localtime(now, ZoneInfo(settings.DAY_LOCK_TIMEZONE))
+    days_back = 1 if now.time() >= time.fromisoformat(settings.DAY_LOCK_TIME) else 2
+    return now.date() - timedelta(days=days_back)
+
+
+def lock_past_days(now=None):
+    # One UPDATE over every overdue day, so a run after downtime catches up
+    # and running it twice changes nothing.
+    locked_through = get_lock_cutoff_date(now)
+    with transaction.atomic():
+        days = list(SurgeryDay.objects.select_for_update().filter(
+            editable=True, date__lte=locked_through).values_list('pk', 'date'))
+        days_locked = SurgeryDay.objects.filter(pk__in=[pk for pk, _ in days]).update(editable=False)
+        DayLockRun.objects.create(locked_through=locked_through, days_locked=days_locked)
+        # update() skips the SurgeryDay signals. Only the last two days can
+        # still be open in a browser; older ones from a catch-up get no event.
+        for day_pk, day_date in days:
+            if day_date >= locked_through - timedelta(days=1):
+                publish_day_event(day_pk, {'type': 'day', 'editable': False})
+    if days_locked:
+        invalidate_all_days()
+        invalidate_calendar()
+    return locked_through, days_locked
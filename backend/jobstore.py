@@ -0,0 +1,99 @@
+import logging
+import pickle
+from apscheduler.job import Job
+from apscheduler.jobstores.base import BaseJobStore, ConflictingIdError, JobLookupError
+from apscheduler.util import datetime_to_utc_timestamp, utc_timestamp_to_datetime
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from .models import SchedulerJob
+
+
+class DjangoJobStore(BaseJobStore):
+    """
+    APScheduler job store on the project database, so next run times survive
+    restarts and missed runs are caught up (same layout as SQLAlchemyJobStore).
+    """
+
+    def __init__(self, pickle_protocol=pickle.HIGHEST_PROTOCOL):
+        super().__init__()
+        self.pickle_protocol = pickle_protocol
+        self._logger = logging.getLogger('apscheduler.jobstores.django')
+
+    def lookup_job(self, job_id):
+        state = SchedulerJob.objects.filter(id=job_id).values_list('job_state', flat=True).first()
+        return self._reconstitute_job(state) if state is not None else None
+
+    def get_due_jobs(self, now):
+        return self._get_jobs(next_run_time__lte=datetime_to_utc_timestamp(now))
+
+    def get_next_run_time(self):
+        timestamp = (
+            SchedulerJob.objects.exclude(next_run_time=None)
+            .order_by('next_run_time')
+            .values_list('next_run_time', flat=True)
+            .first()
+        )
+        return utc_timestamp_to_datetime(timestamp)
+
+    def get_all_jobs(self):
+        jobs = self._get_jobs()
+        self._fix_paused_jobs_sorting(jobs)
+        return jobs
+
+    def add_job(self, job):
+        try:
+            # Savepoint: replace_existing retries as update_job on conflict.
+            with transaction.atomic():
+                SchedulerJob.objects.create(id=job.id, **self._job_row(job))
+        except IntegrityError:
+            raise ConflictingIdError(job.id)
+
+    def update_job(self, job):
+        if not SchedulerJob.objects.filter(id=job.id).update(**self._job_row(job)):
+            raise JobLookupError(job.id)
+
+    def remove_job(self, job_id):
+        deleted, _ = SchedulerJob.objects.filter(id=job_id).delete()
+        if not deleted:
+            raise JobLookupError(job_id)
+
+    def remove_all_jobs(self):
+        SchedulerJob.objects.all().delete()
+
+    def _job_row(self, job):
+        return {
+            'next_run_time': datetime_to_utc_timestamp(job.next_run_time),
+            'job_state': pickle.dumps(job.__getstate__(), self.pickle_protocol),
+        }
+
+    def _reconstitute_job(self, job_state):
+        job_state = pickle.loads(job_state)
+        job_state['jobstore'] = self
+        job = Job.__new__(Job)
+        job.__setstate__(job_state)
+        job._scheduler = self._scheduler
+        job._jobstore_alias = self._alias
+        return job
+
+    def _get_jobs(self, **filters):
+        jobs = []
+        failed_job_ids = []
+        rows = (
+            SchedulerJob.objects.filter(**filters)
+            .order_by(F('next_run_time').asc(nulls_last=True))
+            .values_list('id', 'job_state')
+        )
+        for job_id, job_state in rows:
+            try:
+                jobs.append(self._reconstitute_job(job_state))
+            except BaseException:
+                self._logger.exception('Unable to restore job "%s" -- removing it', job_id)
+                failed_job_ids.append(job_id)
+
+        # Jobs whose function was renamed or removed would fail on every wakeup.
+        if failed_job_ids:
+            SchedulerJob.objects.filter(id__in=failed_job_ids).delete()
+        return jobs
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}>'
@@ -0,0 +1,155 @@
+import random
+from datetime import date, timedelta
+from django.db import transaction
+from django.db.models import Max
+from .models import Branch, Surgeon, Surgery, SurgeryDay, SurgeryName, SurgeryType, SurgerySequence
+from .schedule import invalidate_all_days, bump_version
+from .search import surgery_name_index, surgery_type_index
+from .calendar import invalidate_calendar
+
+
+LAST_NAMES = [
+    'Иванов', 'Петров', 'Сидоров', 'Кузнецов', 'Смирнов', 'Попов', 'Васильев', 'Соколов', 'Михайлов',
+    'Новиков', 'Фёдоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семёнов', 'Егоров', 'Павлов',
+    'Каримов', 'Рахимов', 'Юсупов', 'Ахмедов', 'Усманов', 'Назаров', 'Турсунов', 'Исмоилов',
+]
+FIRST_NAMES = [
+    'Александр', 'Дмитрий', 'Сергей', 'Андрей', 'Алексей', 'Иван', 'Рустам', 'Тимур', 'Бахтиёр',
+    'Анна', 'Мария', 'Елена', 'Ольга', 'Наталья', 'Дилноза', 'Гульнара', 'Зарина', 'Нигора',
+]
+DIAGNOSES = [
+    'Острый аппендицит', 'Желчнокаменная болезнь', 'Паховая грыжа', 'Варикозная болезнь',
+    'Узловой зоб', 'Киста яичника', 'Миома матки', 'Аденома простаты', 'Перелом бедра',
+    'Катаракта', 'Хронический тонзиллит', 'Облитерирующий атеросклероз', 'Рак желудка',
+]
+OPERATIONS = [
+    'Резекция', 'Лапароскопическая резекция', 'Экстирпация', 'Пластика', 'Протезирование',
+    'Эндоскопическое удаление', 'Шунтирование', 'Дренирование', 'Ампутация', 'Остеосинтез',
+]
+ORGANS = [
+    'желудка', 'желчного пузыря', 'щитовидной железы', 'тазобедренного сустава', 'аорты',
+    'предстательной железы', 'матки', 'яичника', 'миндалин', 'хрусталика', 'бедренной кости',
+    'толстой кишки', 'пищевода', 'почки', 'грыжевых ворот',
+]
+SURGERY_TYPES = ['ВМП', 'Платная', 'ВИЧ', 'Экстренная', 'HBsAg', 'Повторная']
+
+
+def ensure_branches(count: int) -> list:
+    existing = {branch.branch_number for branch in Branch.objects.all()}
+    Branch.objects.bulk_create([
+        Branch(name=f'Отделение {number}', branch_number=number)
+        for number in range(1, count + 1) if number not in existing
+    ])
+    return list(Branch.objects.filter(branch_number__lte=count).order_by('branch_number'))
+
+
+def ensure_surgeons(branches: list, per_branch: int, rng: random.Random) -> dict:
+    existing = set(Surgeon.objects.values_list('full_name', flat=True))
+    new_surgeons = []
+    for branch in branches:
+        for index in range(1, per_branch + 1):
+            full_name = f'{rng.choice(LAST_NAMES)} {rng.choice(FIRST_NAMES)[0]}. №{branch.branch_number}-{index}'
+            while full_name in existing:
+                full_name += "'"
+            existing.add(full_name)
+            new_surgeons.append(Surgeon(full_name=full_name, branch=branch))
+    Surgeon.objects.bulk_create(new_surgeons)
+
+    surgeons = {}
+    for surgeon_id, branch_id in Surgeon.objects.filter(branch__in=branches).values_list('id', 'branch_id'):
+        surgeons.setdefault(branch_id, []).append(surgeon_id)
+    return surgeons
+
+
+def ensure_catalog(size: int) -> tuple:
+    base = [f'{operation} {organ}' for operation in OPERATIONS for organ in ORGANS]
+    names = [
+        base[i % len(base)] + (f' (вариант {i // len(base) + 1})' if i >= len(base) else '')
+        for i in range(size)
+    ]
+    SurgeryName.objects.bulk_create([SurgeryName(surgery_name=name) for name in names], ignore_conflicts=True)
+    SurgeryType.objects.bulk_create([SurgeryType(type_name=name) for name in SURGERY_TYPES], ignore_conflicts=True)
+    return list(SurgeryName.objects.values_list('id', flat=True)), list(SurgeryType.objects.values_list('id', flat=True))
+
+
+def get_seed_dates(days: int, end_date: date) -> list:
+    dates = [end_date - timedelta(days=offset) for offset in range(days)]
+    return sorted(day for day in dates if day.isoweekday() != 7)
+
+
+def seed_load(days: int, surgeries_per_day: int, end_date: date = None, branches: int = 19,
+              surgeons_per_branch: int = 12, catalog_size: int = 2000, seed: int = None,
+              batch_size: int = 5000, log=None) -> dict:
+    rng = random.Random(seed)
+    end_date = end_date or date.today() + timedelta(days=1)
+    branch_list = ensure_branches(branches)
+    surgeons = ensure_surgeons(branch_list, surgeons_per_branch, rng)
+    name_ids, type_ids = ensure_catalog(catalog_size)
+
+    dates = get_seed_dates(days, end_date)
+    SurgeryDay.objects.bulk_create(
+        [SurgeryDay(date=day, editable=day > date.today() and day.isoweekday() != 6) for day in dates],
+        ignore_conflicts=True,
+    )
+    day_ids = dict(SurgeryDay.objects.filter(date__in=dates).values_list('date', 'id'))
+
+    # Continue after whatever positions these days already hold.
+    next_seq = {
+        (row['date_of_surgery'], row['branch']): row['last']
+        for row in Surgery.objects.filter(date_of_surgery__in=day_ids.values()).values(
+            'date_of_surgery', 'branch').annotate(last=Max('seq_number'))
+    }
+
+    total = 0
+    pending, pending_surgeons = [], []
+
+    def flush():
+        nonlocal total
+        with transaction.atomic():
+            created = Surgery.objects.bulk_create(pending)
+            Surgery.surgeons.through.objects.bulk_create([
+                Surgery.surgeons.through(surgery_id=surgery.pk, surgeon_id=surgeon_id)
+                for surgery, surgeon_ids in zip(created, pending_surgeons) for surgeon_id in surgeon_ids
+            ])
+        total += len(pending)
+        pending.clear()
+        pending_surgeons.clear()
+        if log:
+            log(f'{total} surgeries created')
+
+    for day in dates:
+        day_id = day_ids[day]
+        count = surgeries_per_day // 4 if day.isoweekday() == 6 else surgeries_per_day
+        for _ in range(count):
+            branch = rng.choice(branch_list)
+            own_branch = branch if rng.random() < 0.9 else rng.choice(branch_list)
+            key = (day_id, branch.id)
+            next_seq[key] = next_seq.get(key) or 0
+            next_seq[key] += 1
+            pending.append(Surgery(
+                seq_number=next_seq[key],
+                branch=branch,
+                own_branch=own_branch,
+                full_name=f'{rng.choice(LAST_NAMES)} {rng.choice(FIRST_NAMES)}',
+                age=rng.randint(18, 85) if rng.random() < 0.95 else None,
+                diagnost=rng.choice(DIAGNOSES),
+                surgery_name_id=rng.choice(name_ids),
+                surgery_type_id=rng.choice(type_ids) if rng.random() < 0.3 else None,
+                date_of_surgery_id=day_id,
+            ))
+            branch_surgeons = surgeons.get(branch.id, [])
+            pending_surgeons.append(rng.sample(branch_surgeons, min(len(branch_surgeons), rng.randint(1, 4))))
+            if len(pending) >= batch_size:
+                flush()
+    if pending:
+        flush()
+    # Counters of the seeded days are rebuilt from the new rows on next use.
+    SurgerySequence.objects.filter(day_id__in=day_ids.values()).delete()
+
+    # bulk_create skips model signals, so drop cached snapshots and indexes.
+    invalidate_all_days()
+    invalidate_calendar()
+    bump_version(surgery_name_index.version_key)
+    bump_version(surgery_type_index.version_key)
+    return {'days': len(dates), 'surgeries': total, 'first_date': dates[0] if dates else None,
+            'last_date': dates[-1] if dates else None}
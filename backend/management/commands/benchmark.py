@@ -0,0 +1,49 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment, teardown_test_environment
+from backend.benchmarks import run_benchmarks, compare_results
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway test database at several history sizes and record latency and query '
+            'counts of the day view, PDF, search and reorder endpoints as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='30,365',
+                            help='Comma separated days of history to measure at, e.g. 30,365,16667 (~1M rows).')
+        parser.add_argument('--surgeries-per-day', type=int, default=60)
+        parser.add_argument('--iterations', type=int, default=10)
+        parser.add_argument('--output', default='bench_results.json')
+        parser.add_argument('--compare', default=None, help='Baseline JSON from an earlier run.')
+        parser.add_argument('--threshold', type=float, default=1.25,
+                            help='Allowed p50 slowdown ratio against the baseline.')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',') if size]
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            report = run_benchmarks(sizes, options['surgeries_per_day'], options['iterations'],
+                                    log=self.stdout.write)
+        finally:
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2, ensure_ascii=False)
+
+        for result in report['results']:
+            self.stdout.write(f"\n{result['days']} days, {result['surgeries']} surgeries:")
+            for name, stats in result['endpoints'].items():
+                self.stdout.write(f"  {name:<22} p50 {stats['p50_ms']:>9.2f}ms  p95 {stats['p95_ms']:>9.2f}ms  "
+                                  f"queries {stats['queries']}")
+        self.stdout.write(self.style.SUCCESS(f"\nResults written to {options['output']}"))
+
+        if options['compare']:
+            with open(options['compare']) as baseline:
+                regressions = compare_results(report, json.load(baseline), options['threshold'])
+            if regressions:
+                raise CommandError('Regressions against baseline:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against baseline.'))
@@ -0,0 +1,37 @@
+import sys
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from backend.export import EXPORT_FORMATS, stream_export
+from backend.overview import get_period
+
+
+class Command(BaseCommand):
+    help = 'Export surgeries for a date range as CSV or XLSX, streamed row by row.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, default=None,
+                            help='First day (YYYY-MM-DD), defaults to the first of this month.')
+        parser.add_argument('--end', type=date.fromisoformat, default=None,
+                            help='Last day (YYYY-MM-DD), defaults to the end of the start month.')
+        parser.add_argument('--branch', type=int, action='append', dest='branches',
+                            help='Branch id; repeat for several, all branches by default.')
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--output', default='-', help='File to write, "-" for stdout.')
+
+    def handle(self, *args, **options):
+        start = options['start'] or date.today().replace(day=1)
+        end = options['end'] or get_period(start, 'month')[1]
+        if end < start:
+            raise CommandError('--end is before --start.')
+        branch_ids = set(options['branches']) if options['branches'] else None
+
+        blocks = stream_export(options['format'], start, end, branch_ids)
+        if options['output'] == '-':
+            for block in blocks:
+                sys.stdout.buffer.write(block)
+            sys.stdout.buffer.flush()
+            return
+        with open(options['output'], 'wb') as output:
+            for block in blocks:
+                output.write(block)
+        self.stdout.write(f"Exported {start} .. {end} to {options['output']}")
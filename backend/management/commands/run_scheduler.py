@@ -0,0 +1,47 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from core.metrics import serve_metrics
+from backend.schedulers import SchedulerLock, build_scheduler, materialize_calendar
+
+
+class Command(BaseCommand):
+    help = 'Run the background jobs. Only one instance per deployment gets the lock.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wait', action='store_true',
+                            help='Stay on standby until the running scheduler goes away.')
+        parser.add_argument('--heartbeat', type=int, default=30,
+                            help='Seconds between checks that the lock is still held.')
+        parser.add_argument('--metrics-port', type=int, default=settings.SCHEDULER_METRICS_PORT,
+                            help='Serve job and background render metrics on this port (0 disables).')
+
+    def handle(self, *args, **options):
+        lock = SchedulerLock()
+        while not lock.acquire():
+            if not options['wait']:
+                raise CommandError('Another scheduler is already running.')
+            time.sleep(options['heartbeat'])
+
+        # Requests only read days, so make sure the horizon exists before anything else.
+        materialize_calendar()
+        scheduler = build_scheduler()
+        if options['metrics_port']:
+            serve_metrics(options['metrics_port'])
+
+        def check_lock():
+            # Losing the lock (e.g. database restart) means a standby may take
+            # over; stop rather than run every job twice.
+            if not lock.is_held():
+                self.stderr.write('Scheduler lock lost, shutting down.')
+                scheduler.shutdown(wait=False)
+
+        scheduler.add_job(check_lock, 'interval', seconds=options['heartbeat'],
+                          id='check_lock', jobstore='volatile')
+        self.stdout.write('Scheduler started')
+        try:
+            scheduler.start()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            lock.release()
@@ -0,0 +1,35 @@
+from datetime import date
+from django.core.management.base import BaseCommand
+from backend.loadgen import seed_load
+
+
+class Command(BaseCommand):
+    help = 'Bulk-generate realistic surgery history for load testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--surgeries-per-day', type=int, default=60)
+        parser.add_argument('--end-date', type=date.fromisoformat, default=None,
+                            help='Last day to fill (YYYY-MM-DD), defaults to tomorrow.')
+        parser.add_argument('--branches', type=int, default=19)
+        parser.add_argument('--surgeons-per-branch', type=int, default=12)
+        parser.add_argument('--catalog-size', type=int, default=2000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        result = seed_load(
+            days=options['days'],
+            surgeries_per_day=options['surgeries_per_day'],
+            end_date=options['end_date'],
+            branches=options['branches'],
+            surgeons_per_branch=options['surgeons_per_branch'],
+            catalog_size=options['catalog_size'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            log=self.stdout.write if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {result['surgeries']} surgeries over {result['days']} days "
+            f"({result['first_date']} - {result['last_date']})."
+        ))
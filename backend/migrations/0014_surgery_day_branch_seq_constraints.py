@@ -0,0 +1,38 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:16
+
+import django.db.models.constraints
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def compact_duplicate_seq_numbers(apps, schema_editor):
+    # Older code could hand out the same position twice; renumber only the
+    # affected (day, branch) groups so the unique constraint can be added.
+    Surgery = apps.get_model('backend', 'Surgery')
+    groups = Surgery.objects.exclude(date_of_surgery=None).values(
+        'date_of_surgery', 'branch', 'seq_number'
+    ).annotate(rows=Count('id')).filter(rows__gt=1).values_list('date_of_surgery', 'branch').distinct()
+    for day_id, branch_id in set(groups):
+        surgeries = list(Surgery.objects.filter(date_of_surgery=day_id, branch=branch_id).order_by('seq_number', 'id'))
+        for index, surgery in enumerate(surgeries, start=1):
+            surgery.seq_number = index
+        Surgery.objects.bulk_update(surgeries, ['seq_number'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0013_trigram_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(compact_duplicate_seq_numbers, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='surgery',
+            index=models.Index(fields=['date_of_surgery', 'branch', 'seq_number'], include=('own_branch', 'surgery_name', 'surgery_type'), name='surgery_day_branch_seq_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='surgery',
+            constraint=models.UniqueConstraint(deferrable=django.db.models.constraints.Deferrable['DEFERRED'], fields=('date_of_surgery', 'branch', 'seq_number'), name='unique_surgery_day_branch_seq'),
+        ),
+    ]
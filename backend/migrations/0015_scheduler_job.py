@@ -0,0 +1,25 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0014_surgery_day_branch_seq_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchedulerJob',
+            fields=[
+                ('id', models.CharField(max_length=191, primary_key=True, serialize=False)),
+                ('next_run_time', models.FloatField(blank=True, db_index=True, null=True)),
+                ('job_state', models.BinaryField()),
+            ],
+            options={
+                'verbose_name': 'Задача планировщика',
+                'verbose_name_plural': 'Задачи планировщика',
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0015_scheduler_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DayLockRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('run_at', models.DateTimeField(auto_now_add=True, verbose_name='Время запуска')),
+                ('locked_through', models.DateField(verbose_name='Закрыто по')),
+                ('days_locked', models.PositiveIntegerField(verbose_name='Закрыто дней')),
+            ],
+            options={
+                'verbose_name': 'Закрытие дней',
+                'verbose_name_plural': 'Закрытие дней',
+                'ordering': ['-run_at'],
+            },
+        ),
+    ]
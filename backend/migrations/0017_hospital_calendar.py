@@ -0,0 +1,54 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0016_day_lock_run'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Holiday',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True, verbose_name='Дата')),
+                ('name', models.CharField(max_length=255, verbose_name='Название')),
+            ],
+            options={
+                'verbose_name': 'Праздничный день',
+                'verbose_name_plural': 'Праздничные дни',
+                'ordering': ['date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BranchCapacity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('daily_limit', models.PositiveIntegerField(verbose_name='Операций в день')),
+                ('branch', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='capacity', to='backend.branch', verbose_name='Отдел')),
+            ],
+            options={
+                'verbose_name': 'Лимит операций отдела',
+                'verbose_name_plural': 'Лимиты операций отделов',
+            },
+        ),
+        migrations.CreateModel(
+            name='TheatreClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_date', models.DateField(verbose_name='С')),
+                ('end_date', models.DateField(verbose_name='По')),
+                ('reason', models.CharField(blank=True, max_length=255, verbose_name='Причина')),
+                ('branch', models.ForeignKey(blank=True, help_text='Пусто - закрыты все отделы', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='closures', to='backend.branch', verbose_name='Отдел')),
+            ],
+            options={
+                'verbose_name': 'Закрытие операционной',
+                'verbose_name_plural': 'Закрытия операционных',
+                'ordering': ['start_date'],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0017_hospital_calendar'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SurgerySequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_seq_number', models.PositiveIntegerField(default=0)),
+                ('branch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sequences', to='backend.branch', verbose_name='Oтдел')),
+                ('day', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sequences', to='backend.surgeryday', verbose_name='Дата операции')),
+            ],
+            options={
+                'verbose_name': 'Нумерация операций',
+                'verbose_name_plural': 'Нумерация операций',
+                'constraints': [models.UniqueConstraint(fields=('branch', 'day'), name='unique_surgery_sequence_branch_day')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0018_surgery_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduleEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day_id', models.BigIntegerField()),
+                ('payload', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Событие расписания',
+                'verbose_name_plural': 'События расписания',
+                'indexes': [models.Index(fields=['day_id', 'id'], name='schedule_event_day_id_idx')],
+            },
+        ),
+    ]
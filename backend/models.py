@@ -1,4 +1,5 @@
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin, Group
+from django.core.exceptions import ValidationError
 from django.db import models
 
 
@@ -134,6 +135,31 @@ class Surgery(models.Model):
     class Meta:
         verbose_name = 'Операция'
         verbose_name_plural = 'Операции'
+        indexes = [
+            # Day view, PDF and export all read (day, branch) ordered by seq_number;
+            # the included FK columns let aggregate/export joins skip the heap.
+            models.Index(
+                fields=['date_of_surgery', 'branch', 'seq_number'],
+                include=['own_branch', 'surgery_name', 'surgery_type'],
+                name='surgery_day_branch_seq_idx',
+            ),
+        ]
+        constraints = [
+            # Deferred so bulk reorders can permute positions inside a transaction.
+            models.UniqueConstraint(
+                fields=['date_of_surgery', 'branch', 'seq_number'],
+                name='unique_surgery_day_branch_seq',
+                deferrable=models.Deferrable.DEFERRED,
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets the save signal invalidate the day a surgery is moved away from.
+        loaded = dict(zip(field_names, (value for value in values if value is not models.DEFERRED)))
+        instance._loaded_day_id = loaded.get('date_of_surgery_id')
+        return instance
 
     def __str__(self):
         return self.surgery_name.surgery_name
@@ -149,3 +175,112 @@ class SurgeryDay(models.Model):
     
     def __str__(self):
         return self.date.strftime('%d/%m/%Y')
+
+
+class SurgerySequence(models.Model):
+    """Last seq_number handed out per (branch, day); see backend.sequence."""
+    branch = models.ForeignKey(to=Branch, on_delete=models.CASCADE, related_name='sequences', verbose_name='Oтдел')
+    day = models.ForeignKey(to=SurgeryDay, on_delete=models.CASCADE, related_name='sequences', verbose_name='Дата операции')
+    last_seq_number = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Нумерация операций'
+        verbose_name_plural = 'Нумерация операций'
+        constraints = [
+            models.UniqueConstraint(fields=['branch', 'day'], name='unique_surgery_sequence_branch_day'),
+        ]
+
+    def __str__(self):
+        return f'{self.branch} {self.day}: {self.last_seq_number}'
+
+
+class Holiday(models.Model):
+    date = models.DateField(verbose_name='Дата', unique=True)
+    name = models.CharField(max_length=255, verbose_name='Название')
+
+    class Meta:
+        verbose_name = 'Праздничный день'
+        verbose_name_plural = 'Праздничные дни'
+        ordering = ['date']
+
+    def __str__(self):
+        return f'{self.date:%d/%m/%Y} {self.name}'
+
+
+class TheatreClosure(models.Model):
+    branch = models.ForeignKey(to=Branch, on_delete=models.CASCADE, related_name='closures', null=True, blank=True,
+                               verbose_name='Отдел', help_text='Пусто - закрыты все отделы')
+    start_date = models.DateField(verbose_name='С')
+    end_date = models.DateField(verbose_name='По')
+    reason = models.CharField(max_length=255, verbose_name='Причина', blank=True)
+
+    class Meta:
+        verbose_name = 'Закрытие операционной'
+        verbose_name_plural = 'Закрытия операционных'
+        ordering = ['start_date']
+
+    def clean(self):
+        if self.start_date and self.end_date and self.end_date < self.start_date:
+            raise ValidationError({'end_date': 'Дата окончания раньше даты начала.'})
+
+    def __str__(self):
+        return f'{self.branch or "Все отделы"}: {self.start_date:%d/%m/%Y} - {self.end_date:%d/%m/%Y}'
+
+
+class BranchCapacity(models.Model):
+    branch = models.OneToOneField(to=Branch, on_delete=models.CASCADE, related_name='capacity', verbose_name='Отдел')
+    daily_limit = models.PositiveIntegerField(verbose_name='Операций в день')
+
+    class Meta:
+        verbose_name = 'Лимит операций отдела'
+        verbose_name_plural = 'Лимиты операций отделов'
+
+    def __str__(self):
+        return f'{self.branch}: {self.daily_limit}'
+
+
+class DayLockRun(models.Model):
+    """Audit trail of the nightly day locking (see functions.lock_past_days)."""
+    run_at = models.DateTimeField(auto_now_add=True, verbose_name='Время запуска')
+    locked_through = models.DateField(verbose_name='Закрыто по')
+    days_locked = models.PositiveIntegerField(verbose_name='Закрыто дней')
+
+    class Meta:
+        verbose_name = 'Закрытие дней'
+        verbose_name_plural = 'Закрытие дней'
+        ordering = ['-run_at']
+
+    def __str__(self):
+        return f'{self.locked_through:%d/%m/%Y}: {self.days_locked}'
+
+
+class SchedulerJob(models.Model):
+    """APScheduler job state, shared by every scheduler start (see backend.jobstore)."""
+    id = models.CharField(max_length=191, primary_key=True)
+    next_run_time = models.FloatField(null=True, blank=True, db_index=True)
+    job_state = models.BinaryField()
+
+    class Meta:
+        verbose_name = 'Задача планировщика'
+        verbose_name_plural = 'Задачи планировщика'
+
+    def __str__(self):
+        return self.id
+
+
+class ScheduleEvent(models.Model):
+    """Live day-view event log behind backend.events.DatabaseBroker; ids order the events."""
+    # Not a foreign key: the event announcing a deleted day outlives its row.
+    day_id = models.BigIntegerField()
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'Событие расписания'
+        verbose_name_plural = 'События расписания'
+        indexes = [
+            models.Index(fields=['day_id', 'id'], name='schedule_event_day_id_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.day_id}: {self.payload}'
@@ -0,0 +1,62 @@
+from datetime import date, timedelta
+from django.db.models import Count
+from .models import Branch, Surgery
+from .calendar import day_calendar, is_surgery_date
+
+
+def get_period(anchor: date, period: str):
+    if period == 'week':
+        start = anchor - timedelta(days=anchor.weekday())
+        return start, start + timedelta(days=6)
+    start = anchor.replace(day=1)
+    next_month = (start + timedelta(days=32)).replace(day=1)
+    return start, next_month - timedelta(days=1)
+
+
+def build_overview(start: date, end: date, branch_ids=None) -> dict:
+    dates = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    branches = Branch.objects.order_by('branch_number')
+    surgeries = Surgery.objects.filter(date_of_surgery__date__range=(start, end))
+    if branch_ids is not None:
+        branches = branches.filter(id__in=branch_ids)
+        surgeries = surgeries.filter(branch_id__in=branch_ids)
+
+    # One GROUP BY for the whole period: the SurgeryDay date range picks the
+    # day ids, the (day, branch, seq) index does the rest, however long the history.
+    cells = {
+        (row['date_of_surgery__date'], row['branch_id']): row
+        for row in surgeries.values('date_of_surgery__date', 'branch_id').annotate(
+            surgeries=Count('id', distinct=True),
+            surgeon_count=Count('surgeons', distinct=True),
+            assignments=Count('surgeons'),
+        ).order_by()
+    }
+
+    empty = {'surgeries': 0, 'surgeon_count': 0, 'assignments': 0}
+    rows = []
+    for branch in branches.values('id', 'name', 'branch_number'):
+        branch_cells = [{'date': day, **empty, **cells.get((day, branch['id']), {})} for day in dates]
+        rows.append({
+            **branch,
+            'cells': branch_cells,
+            'total': sum(cell['surgeries'] for cell in branch_cells),
+        })
+
+    days = []
+    for index, day in enumerate(dates):
+        surgery_day = day_calendar.get(day)
+        days.append({
+            'date': day,
+            'surgery_date': is_surgery_date(day),
+            'editable': bool(surgery_day and surgery_day.editable),
+            'exists': surgery_day is not None,
+            'surgeries': sum(row['cells'][index]['surgeries'] for row in rows),
+        })
+
+    return {
+        'start': start,
+        'end': end,
+        'days': days,
+        'branches': rows,
+        'total': sum(row['total'] for row in rows),
+    }
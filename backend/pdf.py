@@ -0,0 +1,281 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import functools
+import shutil
+import tempfile
+import threading
+import multiprocessing
+from datetime import date
+from pathlib import Path
+from concurrent.futures import Future, ProcessPoolExecutor
+from django.conf import settings
+from django.core.cache import cache
+from core.middleware import record_timing
+from core.metrics import PDF_RENDER_DURATION, PDF_RENDER_QUEUE_DEPTH
+from django.template.loader import get_template, render_to_string
+from .models import CustomUser, Branch, SurgeryDay
+from .schedule import get_day_schedule
+from . import pdf_worker
+
+
+WEEKDAYS_RU = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
+
+
+def build_pdf_content(day: SurgeryDay, branches: list) -> dict:
+    branches_data = []
+    for branch in branches:
+        surgeries_data = []
+        for surgery in branch['surgeries']:
+            surgeries_data.append({
+                "number": f"{branch['branch_number']}.{surgery['seq_number']}",
+                "notes": surgery['surgery_type'] if surgery['surgery_type'] is not None else "-",
+                "department": surgery['own_branch_name'],
+                "patient_name": surgery['full_name'],
+                "age": str(surgery['age']) if surgery['age'] else "-",
+                "diagnosis": surgery['diagnost'],
+                "operation_name": surgery['surgery_name'],
+                "surgeons": [surgeon['full_name'] for surgeon in surgery['surgeons']],
+            })
+        branches_data.append({
+            "branch_number": branch['branch_number'],
+            "surgeries": surgeries_data,
+        })
+
+    return {
+        "date": day.date.strftime('%d.%m.%Y'),
+        "weekday": WEEKDAYS_RU[day.date.weekday()],
+        "branches": branches_data,
+    }
+
+
+@functools.cache
+def get_template_fingerprint() -> str:
+    source = get_template("pdf_template.html").template.source
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def get_pdf_digest(content: dict) -> str:
+    payload = json.dumps(content, sort_keys=True, ensure_ascii=False).encode()
+    return hashlib.sha256(get_template_fingerprint().encode() + payload).hexdigest()
+
+
+def get_branch_key(branch_ids) -> str:
+    return '-'.join(str(pk) for pk in sorted(branch_ids)) or 'none'
+
+
+def get_pdf_cache_dir(day: SurgeryDay) -> Path:
+    return Path(settings.MEDIA_ROOT) / settings.PDF_CACHE_DIR / day.date.isoformat()
+
+
+class RendererBusy(Exception):
+    pass
+
+
+class RenderTimeout(Exception):
+    pass
+
+
+class PdfRenderer:
+    def __init__(self, workers: int, queue_size: int, timeout: float):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        # One slot per queued or running job; a slot is only freed when the
+        # worker really finishes, so timed-out renders still count.
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self.in_flight = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            return self._executor
+
+    def _track(self, delta: int):
+        with self._lock:
+            self.in_flight += delta
+            PDF_RENDER_QUEUE_DEPTH.set(self.in_flight)
+
+    def _release(self, future=None):
+        self._track(-1)
+        self._slots.release()
+
+    def submit(self, html_content: str, base_url: str) -> Future:
+        if not self._slots.acquire(blocking=False):
+            raise RendererBusy
+        self._track(1)
+        try:
+            if self.workers:
+                future = self.get_executor().submit(pdf_worker.render_html_to_pdf, html_content, base_url)
+            else:
+                future = Future()
+                try:
+                    future.set_result(pdf_worker.render_html_to_pdf(html_content, base_url))
+                except Exception as err:
+                    future.set_exception(err)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def render(self, html_content: str, base_url: str) -> bytes:
+        future = self.submit(html_content, base_url)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise RenderTimeout
+
+    def render_sync(self, html_content: str, base_url: str) -> bytes:
+        future = self.submit(html_content, base_url)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise RenderTimeout
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_renderer() -> PdfRenderer:
+    global _renderer
+    config = (settings.PDF_RENDER_WORKERS, settings.PDF_RENDER_QUEUE_SIZE, settings.PDF_RENDER_TIMEOUT)
+    with _renderer_lock:
+        if _renderer is None or (_renderer.workers, _renderer.queue_size, _renderer.timeout) != config:
+            if _renderer is not None:
+                _renderer.shutdown()
+            _renderer = PdfRenderer(*config)
+        return _renderer
+
+
+def render_pdf_html(content: dict) -> str:
+    return render_to_string("pdf_template.html", content)
+
+
+def render_pdf(content: dict, base_url: str) -> bytes:
+    started = time.perf_counter()
+    try:
+        return get_renderer().render_sync(render_pdf_html(content), base_url)
+    finally:
+        PDF_RENDER_DURATION.observe(time.perf_counter() - started, source='background')
+
+
+async def arender_pdf(content: dict, base_url: str) -> bytes:
+    started = time.perf_counter()
+    try:
+        return await get_renderer().render(render_pdf_html(content), base_url)
+    finally:
+        elapsed = time.perf_counter() - started
+        record_timing('pdf', elapsed)
+        PDF_RENDER_DURATION.observe(elapsed, source='request')
+
+
+def write_cached_pdf(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as tmp:
+        tmp.write(data)
+    os.replace(tmp_path, path)
+
+    # Older renders of the same branch set are dead once the data changed.
+    branch_key = path.name.rsplit('_', 1)[0]
+    for stale in path.parent.glob(f'{branch_key}_*.pdf'):
+        if stale != path:
+            stale.unlink(missing_ok=True)
+
+
+def get_cached_pdf_path(day: SurgeryDay, branch_ids, digest: str) -> Path:
+    return get_pdf_cache_dir(day) / f'{get_branch_key(branch_ids)}_{digest[:32]}.pdf'
+
+
+def get_cached_pdf_mtime(path: Path):
+    # Whole seconds, as sent in Last-Modified; None while not rendered yet.
+    try:
+        return int(path.stat().st_mtime)
+    except FileNotFoundError:
+        return None
+
+
+def get_or_render_pdf(day: SurgeryDay, content: dict, branch_ids, digest: str, base_url: str) -> Path:
+    path = get_cached_pdf_path(day, branch_ids, digest)
+    if not path.exists():
+        write_cached_pdf(path, render_pdf(content, base_url))
+    return path
+
+
+PRERENDER_DAY_KEY = 'pdf:prerender:day'
+PRERENDER_CHANGED_KEY = 'pdf:prerender:changed'
+
+
+def get_visible_branch_sets() -> list:
+    branch_sets = set()
+    if CustomUser.objects.filter(is_active=True, is_superuser=True).exists():
+        branch_sets.add(frozenset(Branch.objects.values_list('id', flat=True)))
+
+    heads = {}
+    for user_id, branch_id in CustomUser.branches.through.objects.filter(
+        customuser__is_active=True, customuser__is_superuser=False
+    ).values_list('customuser_id', 'branch_id'):
+        heads.setdefault(user_id, set()).add(branch_id)
+    branch_sets.update(frozenset(branch_ids) for branch_ids in heads.values())
+    return list(branch_sets)
+
+
+def prerender_day_pdfs(day: SurgeryDay) -> int:
+    schedule = get_day_schedule(day)
+    rendered = 0
+    for branch_ids in get_visible_branch_sets():
+        branches = [branch for branch in schedule if branch['id'] in branch_ids]
+        content = build_pdf_content(day, branches)
+        path = get_cached_pdf_path(day, [branch['id'] for branch in branches], get_pdf_digest(content))
+        if not path.exists():
+            write_cached_pdf(path, render_pdf(content, settings.PDF_BASE_URL))
+            rendered += 1
+
+    # Edits to this day from now on schedule a debounced re-render.
+    cache.set(PRERENDER_DAY_KEY, day.pk, 60 * 60 * 48)
+    return rendered
+
+
+def mark_day_changed(day_pk=None):
+    prerender_day_pk = cache.get(PRERENDER_DAY_KEY)
+    if prerender_day_pk is not None and day_pk in (None, prerender_day_pk):
+        cache.set(PRERENDER_CHANGED_KEY, time.time(), 60 * 60 * 48)
+
+
+def get_pending_prerender_day():
+    changed_at = cache.get(PRERENDER_CHANGED_KEY)
+    if changed_at is None or time.time() - changed_at < settings.PDF_PRERENDER_DEBOUNCE:
+        return None
+    cache.delete(PRERENDER_CHANGED_KEY)
+    return SurgeryDay.objects.filter(pk=cache.get(PRERENDER_DAY_KEY)).first()
+
+
+def prune_pdf_cache(before: date) -> int:
+    """Remove cached plans for days before `before`; returns the number of day folders removed."""
+    root = Path(settings.MEDIA_ROOT) / settings.PDF_CACHE_DIR
+    removed = 0
+    for day_dir in root.glob('????-??-??'):
+        try:
+            day = date.fromisoformat(day_dir.name)
+        except ValueError:
+            continue
+        if day < before and day_dir.is_dir():
+            shutil.rmtree(day_dir, ignore_errors=True)
+            removed += 1
+    return removed
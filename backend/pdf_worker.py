@@ -0,0 +1,7 @@
+# Runs inside the PDF renderer processes; keep it free of Django imports so
+# spawned workers start quickly and never touch the database.
+from weasyprint import HTML
+
+
+def render_html_to_pdf(html_content: str, base_url: str) -> bytes:
+    return HTML(string=html_content, base_url=base_url).write_pdf()
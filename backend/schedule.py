@@ -0,0 +1,115 @@
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+from core.metrics import CACHE_REQUESTS
+from .models import Branch, Surgeon, Surgery, SurgeryDay
+
+
+# Bumped whenever a Branch or Surgeon changes, since those show up in every day.
+GLOBAL_VERSION_KEY = 'schedule:version:all'
+
+
+def get_day_surgeries(day: SurgeryDay):
+    # Only the columns the schedule shows, and only this day's rows, so the
+    # cost does not depend on how much history the tables hold.
+    return Surgery.objects.filter(date_of_surgery=day).select_related(
+        'own_branch', 'surgery_name', 'surgery_type'
+    ).only(
+        'seq_number', 'full_name', 'age', 'diagnost', 'branch',
+        'own_branch__name', 'surgery_name__surgery_name', 'surgery_type__type_name',
+    ).prefetch_related(
+        Prefetch('surgeons', queryset=Surgeon.objects.only('full_name'))
+    ).order_by('seq_number')
+
+
+def get_day_branches(day: SurgeryDay, branch_ids=None):
+    branches = Branch.objects.prefetch_related(
+        Prefetch('surgeries', queryset=get_day_surgeries(day))
+    ).order_by('branch_number')
+    if branch_ids is not None:
+        branches = branches.filter(id__in=branch_ids)
+    return branches
+
+
+def get_head_branch_ids(user) -> set:
+    if not user.is_authenticated:
+        return set()
+    return set(user.branches.values_list('id', flat=True))
+
+
+def build_day_schedule(day: SurgeryDay) -> list:
+    # Shared by the day view and the PDF: three queries (branches, surgeries
+    # with their FK rows, surgeons) regardless of rows per day or history size.
+    return [
+        {
+            'id': branch.id,
+            'name': branch.name,
+            'branch_number': branch.branch_number,
+            'surgeries': [
+                {
+                    'id': surgery.id,
+                    'seq_number': surgery.seq_number,
+                    'full_name': surgery.full_name,
+                    'age': surgery.age,
+                    'diagnost': surgery.diagnost,
+                    'own_branch_name': surgery.own_branch.name,
+                    'surgery_name': surgery.surgery_name.surgery_name,
+                    'surgery_type': surgery.surgery_type.type_name if surgery.surgery_type else None,
+                    'surgeons': [
+                        {'id': surgeon.id, 'full_name': surgeon.full_name}
+                        for surgeon in surgery.surgeons.all()
+                    ],
+                }
+                for surgery in branch.surgeries.all()
+            ],
+        }
+        for branch in get_day_branches(day).only('name', 'branch_number')
+    ]
+
+
+def day_version_key(day_pk: int) -> str:
+    return f'schedule:version:{day_pk}'
+
+
+def get_version(key: str) -> int:
+    version = cache.get(key)
+    if version is None:
+        # Seed missing or evicted counters with a fresh value so an old
+        # snapshot stored under a previous version can never be hit again.
+        version = time.time_ns()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def get_schedule_version(day_pk: int) -> str:
+    return f'{get_version(GLOBAL_VERSION_KEY)}.{get_version(day_version_key(day_pk))}'
+
+
+def bump_version(key: str):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def invalidate_day(day_pk: int):
+    if day_pk is not None:
+        bump_version(day_version_key(day_pk))
+
+
+def invalidate_all_days():
+    bump_version(GLOBAL_VERSION_KEY)
+
+
+def get_day_schedule(day: SurgeryDay, branch_ids=None) -> list:
+    key = f'schedule:day:{day.pk}:{get_schedule_version(day.pk)}'
+    schedule = cache.get(key)
+    CACHE_REQUESTS.inc(cache='schedule', result='miss' if schedule is None else 'hit')
+    if schedule is None:
+        schedule = build_day_schedule(day)
+        cache.set(key, schedule, settings.SCHEDULE_CACHE_TIMEOUT)
+    if branch_ids is not None:
+        schedule = [branch for branch in schedule if branch['id'] in branch_ids]
+    return schedule
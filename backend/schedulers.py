@@ -1,22 +1,180 @@
-from apscheduler.schedulers.background import BackgroundScheduler
-from datetime import date, timedelta
-from .models import SurgeryDay
+import fcntl
+import functools
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.schedulers.blocking import BlockingScheduler
+from apscheduler.util import utc_timestamp_to_datetime
+from datetime import date, time, timedelta
+from .models import SchedulerJob
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, close_old_connections, connection, connections
+from .functions import get_next_surgery_day, lock_past_days
+from .jobstore import DjangoJobStore
+from .calendar import materialize_days
+from .pdf import prerender_day_pdfs, get_pending_prerender_day, prune_pdf_cache
+from .events import prune_schedule_events
+from core.metrics import SCHEDULER_JOB_RUNS, SCHEDULER_JOB_FAILURES
 
+# Arbitrary key for pg_try_advisory_lock, shared by every run_scheduler process.
+SCHEDULER_LOCK_ID = 0x05C4ED
 
+
+def release_stale_connections():
+    # The scheduler process lives for weeks; don't reuse a connection the
+    # server has dropped meanwhile. Never close one mid-transaction.
+    if not connection.in_atomic_block:
+        close_old_connections()
+
+
+def tracked_job(job):
+    @functools.wraps(job)
+    def run():
+        SCHEDULER_JOB_RUNS.inc(job=job.__name__)
+        release_stale_connections()
+        try:
+            job()
+        except Exception as e:
+            SCHEDULER_JOB_FAILURES.inc(job=job.__name__)
+            print(f"Error in scheduler job {job.__name__}: {e}")
+        finally:
+            release_stale_connections()
+    return run
+
+
+@tracked_job
 def mark_surgery_days_uneditable():
-    today = date.today() - timedelta(days=1)
-    try:
-        surgery_days = SurgeryDay.objects.filter(date=today)
-        for day in surgery_days:
-            day.editable = False
-            day.save()
-        print(f"Updated SurgeryDay editable to False for {today}")
-    except Exception as e:
-        print(f"Error while updating SurgeryDay: {e}")
-
-
-def start_scheduler():
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(mark_surgery_days_uneditable, 'cron', hour=15, minute=0)
-    scheduler.start()
-    print("Scheduler started")
+    locked_through, days_locked = lock_past_days()
+    print(f"Updated SurgeryDay editable to False for {days_locked} day(s) through {locked_through}")
+
+
+@tracked_job
+def materialize_calendar():
+    created = materialize_days()
+    print(f"Created {created} SurgeryDay row(s) ahead")
+
+
+@tracked_job
+def prerender_next_day_pdfs():
+    day = get_next_surgery_day()
+    rendered = prerender_day_pdfs(day)
+    print(f"Pre-rendered {rendered} PDF(s) for {day}")
+
+
+@tracked_job
+def rerender_changed_day_pdfs():
+    day = get_pending_prerender_day()
+    if day:
+        rendered = prerender_day_pdfs(day)
+        print(f"Re-rendered {rendered} PDF(s) for {day}")
+
+
+@tracked_job
+def cleanup_pdf_cache():
+    removed = prune_pdf_cache(date.today() - timedelta(days=settings.PDF_CACHE_RETENTION_DAYS))
+    print(f"Removed cached PDFs for {removed} day(s)")
+
+
+@tracked_job
+def cleanup_schedule_events():
+    removed = prune_schedule_events()
+    print(f"Removed {removed} old schedule event(s)")
+
+
+class SchedulerLock:
+    """
+    Keeps a single scheduler per deployment: a session-level advisory lock on
+    PostgreSQL, held on a dedicated connection, or an flock()ed file elsewhere.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self._connection = None
+        self._file = None
+
+    def acquire(self) -> bool:
+        if connections[self.using].vendor == 'postgresql':
+            conn = connections.create_connection(self.using)
+            # The heartbeat checks the lock from a scheduler worker thread.
+            conn.inc_thread_sharing()
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT pg_try_advisory_lock(%s)', [SCHEDULER_LOCK_ID])
+                acquired = cursor.fetchone()[0]
+            if acquired:
+                self._connection = conn
+            else:
+                conn.close()
+            return acquired
+
+        lock_file = open(settings.SCHEDULER_LOCK_FILE, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        return True
+
+    def is_held(self) -> bool:
+        if self._connection is not None:
+            # A dropped connection releases the lock, so ask the server.
+            try:
+                with self._connection.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT EXISTS (SELECT 1 FROM pg_locks WHERE locktype = 'advisory' "
+                        "AND pid = pg_backend_pid() AND objid = %s AND granted)",
+                        [SCHEDULER_LOCK_ID],
+                    )
+                    return cursor.fetchone()[0]
+            except DatabaseError:
+                return False
+        return self._file is not None
+
+    def release(self):
+        if self._connection is not None:
+            try:
+                with self._connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_advisory_unlock(%s)', [SCHEDULER_LOCK_ID])
+            except DatabaseError:
+                pass
+            self._connection.close()
+            self._connection = None
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def build_scheduler(scheduler_class=BlockingScheduler):
+    """
+    Jobs live in the database: a restart keeps their next run times, and runs
+    missed while no scheduler was up fire once on start (coalesced, no grace limit).
+    """
+    scheduler = scheduler_class(
+        jobstores={'default': DjangoJobStore(), 'volatile': MemoryJobStore()},
+        job_defaults={'coalesce': True, 'misfire_grace_time': None, 'max_instances': 1},
+        timezone=settings.TIME_ZONE,
+    )
+    lock_time = time.fromisoformat(settings.DAY_LOCK_TIME)
+    jobs = [
+        (mark_surgery_days_uneditable, 'cron', {
+            'hour': lock_time.hour, 'minute': lock_time.minute, 'timezone': settings.DAY_LOCK_TIMEZONE,
+        }),
+        (materialize_calendar, 'cron', {'hour': 0, 'minute': 5}),
+        (prerender_next_day_pdfs, 'cron', settings.PDF_PRERENDER_CRON),
+        (rerender_changed_day_pdfs, 'interval', {'seconds': settings.PDF_PRERENDER_DEBOUNCE}),
+        (cleanup_pdf_cache, 'cron', {'hour': 3, 'minute': 0}),
+        (cleanup_schedule_events, 'interval', {'minutes': 10}),
+    ]
+    # replace_existing would otherwise recompute next_run_time from the trigger
+    # and drop a run that was missed while the scheduler was down.
+    stored = dict(SchedulerJob.objects.exclude(next_run_time=None).values_list('id', 'next_run_time'))
+    for func, trigger, trigger_args in jobs:
+        if func.__name__ in stored:
+            trigger_args = {**trigger_args, 'next_run_time': utc_timestamp_to_datetime(stored[func.__name__])}
+        scheduler.add_job(func, trigger, id=func.__name__, replace_existing=True, **trigger_args)
+    return scheduler
@@ -0,0 +1,234 @@
+import sys
+import heapq
+import bisect
+import logging
+import threading
+from array import array
+from time import perf_counter
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, IntegerField, Value, When
+from django.db.models.functions import Length, Lower
+from core.metrics import TYPEAHEAD_REQUESTS
+from .models import SurgeryName, SurgeryType
+from .schedule import get_version, bump_version
+
+
+logger = logging.getLogger(__name__)
+
+SEARCH_LIMIT = 10
+
+
+def search_catalog(model, field: str, query: str, limit: int = SEARCH_LIMIT) -> list:
+    # On PostgreSQL icontains/istartswith compile to UPPER(col) LIKE ..., which
+    # the gin_trgm_ops indexes from migration 0013 serve. SQLite (tests) falls
+    # back to a plain scan; its LIKE only case-folds ASCII.
+    results = model.objects.filter(**{f'{field}__icontains': query}).annotate(
+        rank=Case(
+            When(**{f'{field}__istartswith': query}, then=Value(0)),
+            default=Value(1),
+            output_field=IntegerField(),
+        )
+    )
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramSimilarity
+        results = results.annotate(similarity=TrigramSimilarity(field, query)).order_by(
+            'rank', '-similarity', Lower(field)
+        )
+    else:
+        results = results.order_by('rank', Length(field), Lower(field))
+    return list(results.values('id', field)[:limit])
+
+
+def fold(text: str) -> str:
+    return text.casefold().replace('ё', 'е')
+
+
+class CatalogIndex:
+    # Sorted case-folded keys give prefix lookups by bisection; substring
+    # lookups scan one NUL-joined string, rebuilt lazily after changes.
+    separator = '\x00'
+
+    def __init__(self, model, field: str):
+        self.model = model
+        self.field = field
+        self.version_key = f'search:catalog:{model._meta.label_lower}'
+        self.version = None
+        self._lock = threading.Lock()
+        self._keys = []
+        self._entries = []
+        self._keys_by_id = {}
+        self._blob = None
+        self._offsets = None
+        self.lookups = 0
+        self.lookup_seconds = 0.0
+        self.max_lookup_seconds = 0.0
+
+    def load(self):
+        version = get_version(self.version_key)
+        rows = sorted((fold(name), pk, name) for pk, name in self.model.objects.values_list('id', self.field))
+        with self._lock:
+            self._keys = [key for key, _, _ in rows]
+            self._entries = [(pk, name) for _, pk, name in rows]
+            self._keys_by_id = {pk: key for key, pk, _ in rows}
+            self._blob = None
+            self.version = version
+
+    def ensure_current(self):
+        # Other processes bump the shared version when they change the catalog.
+        if self.version != get_version(self.version_key):
+            self.load()
+
+    def _remove(self, pk: int):
+        key = self._keys_by_id.pop(pk, None)
+        if key is None:
+            return
+        index = bisect.bisect_left(self._keys, key)
+        while self._entries[index][0] != pk:
+            index += 1
+        del self._keys[index]
+        del self._entries[index]
+
+    def _changed(self):
+        self._blob = None
+        expected = self.version + 1 if isinstance(self.version, int) else None
+        bump_version(self.version_key)
+        if get_version(self.version_key) == expected:
+            self.version = expected
+        else:
+            self.version = None
+
+    def upsert(self, pk: int, name: str):
+        if self.version is None:
+            return bump_version(self.version_key)
+        key = fold(name)
+        with self._lock:
+            self._remove(pk)
+            index = bisect.bisect_right(self._keys, key)
+            self._keys.insert(index, key)
+            self._entries.insert(index, (pk, name))
+            self._keys_by_id[pk] = key
+            self._changed()
+
+    def remove(self, pk: int):
+        if self.version is None:
+            return bump_version(self.version_key)
+        with self._lock:
+            self._remove(pk)
+            self._changed()
+
+    def get_pk(self, name: str):
+        """Exact-name lookup from memory; None when the catalog has no such entry."""
+        self.ensure_current()
+        key = fold(name)
+        with self._lock:
+            index = bisect.bisect_left(self._keys, key)
+            while index < len(self._keys) and self._keys[index] == key:
+                pk, entry_name = self._entries[index]
+                if entry_name == name:
+                    return pk
+                index += 1
+        return None
+
+    def resolve(self, name: str) -> int:
+        # In memory mode only a name the catalog has never seen costs queries
+        # (the save signal then adds it to the index). Otherwise one unique
+        # index lookup beats loading the whole catalog into every worker.
+        pk = self.get_pk(name) if settings.CATALOG_SEARCH_MODE == 'memory' else None
+        if pk is None:
+            pk = self.model.objects.get_or_create(**{self.field: name})[0].pk
+        return pk
+
+    def _build_blob(self):
+        offsets = array('L')
+        position = 0
+        for key in self._keys:
+            offsets.append(position)
+            position += len(key) + 1
+        self._offsets = offsets
+        self._blob = self.separator.join(self._keys)
+
+    def search(self, query: str, limit: int = SEARCH_LIMIT) -> list:
+        started = perf_counter()
+        self.ensure_current()
+        query = fold(query)
+        with self._lock:
+            keys = self._keys
+            end = start = bisect.bisect_left(keys, query)
+            while end < len(keys) and keys[end].startswith(query):
+                end += 1
+            found = heapq.nsmallest(limit, range(start, end), key=lambda i: (len(keys[i]), keys[i]))
+
+            if len(found) < limit:
+                if self._blob is None:
+                    self._build_blob()
+                position = self._blob.find(query)
+                while position != -1 and len(found) < limit:
+                    index = bisect.bisect_right(self._offsets, position) - 1
+                    if not start <= index < end:
+                        found.append(index)
+                    if index + 1 >= len(self._offsets):
+                        break
+                    position = self._blob.find(query, self._offsets[index + 1])
+
+            results = [{'id': self._entries[i][0], self.field: self._entries[i][1]} for i in found]
+
+        elapsed = perf_counter() - started
+        self.lookups += 1
+        self.lookup_seconds += elapsed
+        self.max_lookup_seconds = max(self.max_lookup_seconds, elapsed)
+        return results
+
+    def memory_bytes(self) -> int:
+        with self._lock:
+            size = sys.getsizeof(self._keys) + sys.getsizeof(self._entries) + sys.getsizeof(self._keys_by_id)
+            size += sum(sys.getsizeof(key) for key in self._keys)
+            size += sum(sys.getsizeof(entry) + sys.getsizeof(entry[1]) for entry in self._entries)
+            if self._blob is not None:
+                size += sys.getsizeof(self._blob) + sys.getsizeof(self._offsets)
+            return size
+
+    def stats(self) -> dict:
+        return {
+            'loaded': self.version is not None,
+            'entries': len(self._keys),
+            'memory_bytes': self.memory_bytes(),
+            'lookups': self.lookups,
+            'avg_lookup_ms': self.lookup_seconds / self.lookups * 1000 if self.lookups else 0.0,
+            'max_lookup_ms': self.max_lookup_seconds * 1000,
+        }
+
+
+surgery_name_index = CatalogIndex(SurgeryName, 'surgery_name')
+surgery_type_index = CatalogIndex(SurgeryType, 'type_name')
+
+
+def search_surgery_names(query: str) -> list:
+    TYPEAHEAD_REQUESTS.inc(catalog='surgery_name', mode=settings.CATALOG_SEARCH_MODE)
+    if settings.CATALOG_SEARCH_MODE == 'memory':
+        return surgery_name_index.search(query)
+    return search_catalog(SurgeryName, 'surgery_name', query)
+
+
+def search_surgery_types(query: str) -> list:
+    TYPEAHEAD_REQUESTS.inc(catalog='surgery_type', mode=settings.CATALOG_SEARCH_MODE)
+    if settings.CATALOG_SEARCH_MODE == 'memory':
+        return surgery_type_index.search(query)
+    return search_catalog(SurgeryType, 'type_name', query)
+
+
+def get_search_stats() -> dict:
+    return {
+        'mode': settings.CATALOG_SEARCH_MODE,
+        'surgery_name': surgery_name_index.stats(),
+        'surgery_type': surgery_type_index.stats(),
+    }
+
+
+def warm_search_indexes():
+    try:
+        surgery_name_index.load()
+        surgery_type_index.load()
+    except Exception as err:
+        # Tables may not exist yet (first migrate); lookups load lazily instead.
+        logger.warning('Catalog search index not built at startup: %s', err)
@@ -0,0 +1,71 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max
+from .models import Surgery, SurgerySequence
+from .signals import notify_day_changed
+
+
+def lock_sequence(branch_id: int, day_pk: int) -> SurgerySequence:
+    """
+    Lock the (branch, day) counter row until the surrounding transaction ends,
+    creating it from the current highest seq_number the first time. Everything
+    that changes positions in a (branch, day) takes this lock first.
+    """
+    counters = SurgerySequence.objects.select_for_update()
+    try:
+        return counters.get(branch_id=branch_id, day_id=day_pk)
+    except SurgerySequence.DoesNotExist:
+        last = Surgery.objects.filter(branch_id=branch_id, date_of_surgery_id=day_pk).aggregate(
+            last=Max('seq_number'))['last']
+        try:
+            with transaction.atomic():
+                return SurgerySequence.objects.create(branch_id=branch_id, day_id=day_pk, last_seq_number=last or 0)
+        except IntegrityError:
+            # Created by a concurrent transaction; this waits for it to finish.
+            return counters.get(branch_id=branch_id, day_id=day_pk)
+
+
+def allocate_seq_numbers(branch_id: int, day_pk: int, count: int = 1, counter: SurgerySequence = None) -> int:
+    """
+    Reserve `count` consecutive seq_numbers and return the first one. Pass the
+    counter lock_sequence returned when the caller already holds the lock.
+    """
+    with transaction.atomic():
+        if counter is None:
+            counter = lock_sequence(branch_id, day_pk)
+        first = counter.last_seq_number + 1
+        SurgerySequence.objects.filter(pk=counter.pk).update(last_seq_number=F('last_seq_number') + count)
+        counter.last_seq_number += count
+    return first
+
+
+def set_last_seq_number(branch_id: int, day_pk: int, last: int):
+    # After a reorder or move; the caller already holds the lock.
+    SurgerySequence.objects.filter(branch_id=branch_id, day_id=day_pk).update(last_seq_number=last)
+
+
+def compact_seq_numbers(branch_id: int, day_pk: int) -> int:
+    """Renumber a (branch, day) to 1..n, closing gaps left by deletions. Returns rows renumbered."""
+    with transaction.atomic():
+        lock_sequence(branch_id, day_pk)
+        rows = list(Surgery.objects.filter(branch_id=branch_id, date_of_surgery_id=day_pk).order_by(
+            'seq_number', 'id').only('id', 'seq_number'))
+        changed = []
+        for index, row in enumerate(rows, start=1):
+            if row.seq_number != index:
+                row.seq_number = index
+                changed.append(row)
+        if changed:
+            Surgery.objects.bulk_update(changed, ['seq_number'])
+        set_last_seq_number(branch_id, day_pk, len(rows))
+    return len(changed)
+
+
+def delete_and_compact(surgery: Surgery):
+    """Delete a surgery and close the gap it leaves in its (branch, day)."""
+    branch_id, day_pk = surgery.branch_id, surgery.date_of_surgery_id
+    with transaction.atomic():
+        lock_sequence(branch_id, day_pk)
+        surgery.delete()
+        if compact_seq_numbers(branch_id, day_pk):
+            # bulk_update skips the Surgery signals.
+            transaction.on_commit(lambda: notify_day_changed(day_pk))
@@ -0,0 +1,139 @@
+from collections import defaultdict
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from .models import (Surgery, Surgeon, Branch, SurgeryDay, SurgeryName, SurgeryType, Holiday, TheatreClosure,
+                     BranchCapacity)
+from .schedule import invalidate_day, invalidate_all_days
+from .calendar import invalidate_calendar, invalidate_rules
+from .events import publish_day_event
+from .pdf import mark_day_changed
+from .search import surgery_name_index, surgery_type_index
+
+
+def get_day_ordering(day_pk: int) -> dict:
+    ordering = defaultdict(list)
+    for surgery_id, branch_id, seq_number in Surgery.objects.filter(date_of_surgery_id=day_pk).order_by(
+            'branch_id', 'seq_number', 'id').values_list('id', 'branch_id', 'seq_number'):
+        ordering[branch_id].append([surgery_id, seq_number])
+    return dict(ordering)
+
+
+def after_commit(func, *args):
+    # Versions are bumped only once the rows are visible. Bumped earlier, a
+    # concurrent reader could rebuild from the old rows and cache that under
+    # the new version. Outside a transaction this runs immediately.
+    transaction.on_commit(lambda: func(*args))
+
+
+def day_changed(day_pk: int):
+    invalidate_day(day_pk)
+    mark_day_changed(day_pk)
+
+
+def all_days_changed():
+    invalidate_all_days()
+    mark_day_changed()
+
+
+def notify_day_changed(day_pk: int):
+    # For bulk writes (bulk_update/bulk_create/queryset.update) that bypass
+    # model signals. Clients get the day's new ordering in one event.
+    after_commit(day_changed, day_pk)
+    after_commit(lambda: publish_day_event(day_pk, {'type': 'ordering', 'branches': get_day_ordering(day_pk)}))
+
+
+@receiver(post_save, sender=Surgery)
+@receiver(post_delete, sender=Surgery)
+def surgery_changed(sender, instance: Surgery, **kwargs):
+    after_commit(day_changed, instance.date_of_surgery_id)
+
+
+@receiver(post_save, sender=Surgery)
+def surgery_saved_event(sender, instance: Surgery, created, **kwargs):
+    previous_day_id = getattr(instance, '_loaded_day_id', None)
+    if previous_day_id is not None and previous_day_id != instance.date_of_surgery_id:
+        # Moved to another day: the old day loses the row.
+        after_commit(day_changed, previous_day_id)
+        publish_day_event(previous_day_id, {'type': 'deleted', 'id': instance.pk})
+    instance._loaded_day_id = instance.date_of_surgery_id
+    publish_day_event(instance.date_of_surgery_id, {
+        'type': 'row', 'action': 'added' if created else 'edited', 'id': instance.pk,
+    })
+
+
+@receiver(post_delete, sender=Surgery)
+def surgery_deleted_event(sender, instance: Surgery, **kwargs):
+    publish_day_event(instance.date_of_surgery_id, {'type': 'deleted', 'id': instance.pk})
+
+
+@receiver(m2m_changed, sender=Surgery.surgeons.through)
+def surgery_surgeons_changed(sender, instance, action, reverse, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        after_commit(all_days_changed)
+    else:
+        after_commit(day_changed, instance.date_of_surgery_id)
+        publish_day_event(instance.date_of_surgery_id, {'type': 'row', 'action': 'edited', 'id': instance.pk})
+
+
+@receiver(post_save, sender=Surgeon)
+@receiver(post_delete, sender=Surgeon)
+@receiver(post_save, sender=Branch)
+@receiver(post_delete, sender=Branch)
+def catalog_changed(sender, **kwargs):
+    after_commit(all_days_changed)
+
+
+@receiver(post_save, sender=SurgeryName)
+@receiver(post_save, sender=SurgeryType)
+def surgery_catalog_saved(sender, created=False, **kwargs):
+    # Day snapshots embed the names; a brand-new entry is in none of them yet.
+    if not created:
+        after_commit(all_days_changed)
+
+
+@receiver(post_delete, sender=SurgeryName)
+@receiver(post_delete, sender=SurgeryType)
+def surgery_catalog_deleted(sender, **kwargs):
+    after_commit(all_days_changed)
+
+
+@receiver(post_save, sender=SurgeryDay)
+@receiver(post_delete, sender=SurgeryDay)
+def surgery_day_changed(sender, instance: SurgeryDay, **kwargs):
+    after_commit(invalidate_day, instance.pk)
+    after_commit(invalidate_calendar)
+    publish_day_event(instance.pk, {'type': 'day', 'editable': instance.editable})
+
+
+@receiver(post_save, sender=Holiday)
+@receiver(post_delete, sender=Holiday)
+@receiver(post_save, sender=TheatreClosure)
+@receiver(post_delete, sender=TheatreClosure)
+@receiver(post_save, sender=BranchCapacity)
+@receiver(post_delete, sender=BranchCapacity)
+def calendar_rules_changed(sender, **kwargs):
+    after_commit(invalidate_rules)
+
+
+# The index bumps its version too, and a rolled-back row must not linger in it.
+@receiver(post_save, sender=SurgeryName)
+def surgery_name_saved(sender, instance: SurgeryName, **kwargs):
+    after_commit(surgery_name_index.upsert, instance.pk, instance.surgery_name)
+
+
+@receiver(post_delete, sender=SurgeryName)
+def surgery_name_deleted(sender, instance: SurgeryName, **kwargs):
+    after_commit(surgery_name_index.remove, instance.pk)
+
+
+@receiver(post_save, sender=SurgeryType)
+def surgery_type_saved(sender, instance: SurgeryType, **kwargs):
+    after_commit(surgery_type_index.upsert, instance.pk, instance.type_name)
+
+
+@receiver(post_delete, sender=SurgeryType)
+def surgery_type_deleted(sender, instance: SurgeryType, **kwargs):
+    after_commit(surgery_type_index.remove, instance.pk)
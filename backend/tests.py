@@ -1,3 +1,1550 @@
-from django.test import TestCase
+from datetime import date, timedelta
+import asyncio
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from unittest import skipUnless
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from .models import CustomUser, Branch, Surgeon, Surgery, SurgeryDay, SurgeryName, SurgeryType
+from .schedule import get_day_schedule, build_day_schedule
+from .search import surgery_name_index
+from .calendar import day_calendar, hospital_calendar
+from .pdf import PdfRenderer, RendererBusy, get_renderer, prerender_day_pdfs, get_pending_prerender_day
 
-# Create your tests here.
+
+class ScheduleDataMixin:
+    day_date = date(2025, 3, 4)
+
+    def setUp(self):
+        cache.clear()
+        self.day = SurgeryDay.objects.create(date=self.day_date)
+        self.branches = [
+            Branch.objects.create(name=f'Отдел {i}', branch_number=i) for i in range(1, 4)
+        ]
+        self.surgery_name = SurgeryName.objects.create(surgery_name='Аппендэктомия')
+        self.surgery_type = SurgeryType.objects.create(type_name='ВМП')
+
+    def add_surgeries(self, branch, count, surgeons_per_surgery=2, day=None):
+        day = day or self.day
+        start = Surgery.objects.filter(branch=branch, date_of_surgery=day).count()
+        # Run the on-commit invalidation as a real commit would.
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(count):
+                surgery = Surgery.objects.create(
+                    seq_number=start + i + 1,
+                    branch=branch,
+                    own_branch=branch,
+                    full_name=f'Пациент {branch.branch_number}.{start + i}',
+                    diagnost='Диагноз',
+                    surgery_name=self.surgery_name,
+                    surgery_type=self.surgery_type,
+                    date_of_surgery=day,
+                )
+                surgeons = [
+                    Surgeon.objects.get_or_create(
+                        full_name=f'Хирург {branch.branch_number}.{start + i}.{j}', branch=branch
+                    )[0]
+                    for j in range(surgeons_per_surgery)
+                ]
+                surgery.surgeons.set(surgeons)
+
+
+class HomeQueryCountTests(ScheduleDataMixin, TestCase):
+    def count_home_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/', {'date': self.day_date.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def assert_constant_queries(self):
+        for branch in self.branches:
+            self.add_surgeries(branch, 2)
+        # Load the process-level calendars up front; only the schedule counts.
+        day_calendar.ensure_current()
+        hospital_calendar.ensure_current()
+        baseline = self.count_home_queries()
+        for branch in self.branches:
+            self.add_surgeries(branch, 8, surgeons_per_surgery=4)
+        self.assertEqual(self.count_home_queries(), baseline)
+
+    def test_anonymous_queries_constant(self):
+        self.assert_constant_queries()
+
+    def test_head_queries_constant(self):
+        user = CustomUser.objects.create_user('head', 'pass', first_name='A', last_name='B')
+        user.branches.add(self.branches[0])
+        self.client.force_login(user)
+        self.assert_constant_queries()
+
+    def test_superuser_queries_constant(self):
+        user = CustomUser.objects.create_superuser('admin', 'pass', first_name='A', last_name='B')
+        self.client.force_login(user)
+        self.assert_constant_queries()
+
+    def test_head_sees_only_own_branches(self):
+        user = CustomUser.objects.create_user('head', 'pass', first_name='A', last_name='B')
+        user.branches.add(self.branches[1])
+        self.client.force_login(user)
+        response = self.client.get('/', {'date': self.day_date.isoformat()})
+        self.assertEqual([b['id'] for b in response.context['branches']], [self.branches[1].id])
+        self.assertEqual(response.context['editable_branch_ids'], {self.branches[1].id})
+
+
+class DayScheduleCacheTests(ScheduleDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_surgeries(self.branches[0], 2)
+
+    def test_second_read_hits_cache(self):
+        get_day_schedule(self.day)
+        with self.assertNumQueries(0):
+            schedule = get_day_schedule(self.day)
+        self.assertEqual(len(schedule[0]['surgeries']), 2)
+
+    def test_branch_filter_applied_after_cache(self):
+        get_day_schedule(self.day)
+        with self.assertNumQueries(0):
+            schedule = get_day_schedule(self.day, branch_ids={self.branches[1].id})
+        self.assertEqual([b['id'] for b in schedule], [self.branches[1].id])
+
+    def test_surgery_save_and_delete_invalidate(self):
+        get_day_schedule(self.day)
+        surgery = Surgery.objects.filter(branch=self.branches[0]).first()
+        surgery.full_name = 'Новое имя'
+        with self.captureOnCommitCallbacks(execute=True):
+            surgery.save()
+        self.assertIn('Новое имя', [s['full_name'] for s in get_day_schedule(self.day)[0]['surgeries']])
+        with self.captureOnCommitCallbacks(execute=True):
+            surgery.delete()
+        self.assertEqual(len(get_day_schedule(self.day)[0]['surgeries']), 1)
+
+    def test_invalidation_waits_for_commit(self):
+        get_day_schedule(self.day)
+        surgery = Surgery.objects.filter(branch=self.branches[0]).first()
+        surgery.full_name = 'Новое имя'
+        with self.captureOnCommitCallbacks(execute=True):
+            surgery.save()
+            # Still inside the transaction: other readers cannot see the row yet.
+            with self.assertNumQueries(0):
+                get_day_schedule(self.day)
+        self.assertIn('Новое имя', [s['full_name'] for s in get_day_schedule(self.day)[0]['surgeries']])
+
+    def test_moved_surgery_invalidates_both_days(self):
+        other_day = SurgeryDay.objects.create(date=date(2025, 3, 5))
+        get_day_schedule(self.day)
+        get_day_schedule(other_day)
+        surgery = Surgery.objects.filter(branch=self.branches[0]).first()
+        surgery.date_of_surgery = other_day
+        with self.captureOnCommitCallbacks(execute=True):
+            surgery.save()
+        self.assertEqual(len(get_day_schedule(self.day)[0]['surgeries']), 1)
+        self.assertEqual([s['id'] for s in get_day_schedule(other_day)[0]['surgeries']], [surgery.id])
+
+    def test_surgeons_change_invalidates(self):
+        get_day_schedule(self.day)
+        surgery = Surgery.objects.filter(branch=self.branches[0]).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            surgery.surgeons.clear()
+        surgeries = {s['id']: s for s in get_day_schedule(self.day)[0]['surgeries']}
+        self.assertEqual(surgeries[surgery.id]['surgeons'], [])
+
+        get_day_schedule(self.day)
+        surgeon = Surgeon.objects.filter(surgeries__isnull=False).first()
+        surgeon.full_name = 'Переименованный хирург'
+        with self.captureOnCommitCallbacks(execute=True):
+            surgeon.save()
+        names = [s['full_name'] for row in get_day_schedule(self.day)[0]['surgeries'] for s in row['surgeons']]
+        self.assertIn('Переименованный хирург', names)
+
+    def test_branch_change_invalidates(self):
+        get_day_schedule(self.day)
+        branch = self.branches[0]
+        branch.name = 'Сосудистая хирургия'
+        with self.captureOnCommitCallbacks(execute=True):
+            branch.save()
+        self.assertEqual(get_day_schedule(self.day)[0]['name'], 'Сосудистая хирургия')
+
+    def test_surgery_name_change_invalidates(self):
+        get_day_schedule(self.day)
+        self.surgery_name.surgery_name = 'Лапароскопическая аппендэктомия'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.surgery_name.save()
+        self.assertEqual(
+            {s['surgery_name'] for s in get_day_schedule(self.day)[0]['surgeries']},
+            {'Лапароскопическая аппендэктомия'},
+        )
+
+    def test_other_days_stay_cached(self):
+        other_day = SurgeryDay.objects.create(date=date(2025, 3, 5))
+        get_day_schedule(self.day)
+        self.add_surgeries(self.branches[0], 1, day=other_day)
+        with self.assertNumQueries(0):
+            get_day_schedule(self.day)
+
+
+class FileBasedDayScheduleCacheTests(DayScheduleCacheTests):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        settings_override = override_settings(CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': self.cache_dir.name,
+            }
+        })
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        super().setUp()
+
+
+class ScheduleLoaderTests(ScheduleDataMixin, TestCase):
+    def add_history(self, days):
+        for offset in range(days):
+            day = SurgeryDay.objects.create(date=date(2024, 1, 1 + offset))
+            for branch in self.branches:
+                self.add_surgeries(branch, 3, day=day)
+
+    def test_loader_queries_flat_as_history_grows(self):
+        self.add_surgeries(self.branches[0], 3)
+        with CaptureQueriesContext(connection) as small:
+            schedule = build_day_schedule(self.day)
+        self.add_history(10)
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(build_day_schedule(self.day), schedule)
+        self.assertEqual(len(large.captured_queries), 3)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+    def test_pdf_queries_flat_as_history_grows(self):
+        self.client.force_login(
+            CustomUser.objects.create_superuser('admin', 'pass', first_name='A', last_name='B')
+        )
+        self.add_surgeries(self.branches[0], 3)
+        media_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(media_dir.cleanup)
+        counts = []
+        for days in (0, 10):
+            self.add_history(days)
+            cache.clear()
+            with CaptureQueriesContext(connection) as ctx, \
+                    override_settings(PDF_RENDER_WORKERS=0, MEDIA_ROOT=media_dir.name), \
+                    mock.patch('backend.pdf_worker.HTML') as html:
+                html.return_value.write_pdf.return_value = b'%PDF-1.7 test'
+                response = self.client.get('/download-pdf/', {'date': self.day_date.isoformat()})
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class PdfCacheTests(ScheduleDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        media_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(media_dir.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.add_surgeries(self.branches[0], 2)
+        self.client.force_login(
+            CustomUser.objects.create_superuser('admin', 'pass', first_name='A', last_name='B')
+        )
+        settings_override = override_settings(PDF_RENDER_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        html_patch = mock.patch('backend.pdf_worker.HTML')
+        self.html = html_patch.start()
+        self.addCleanup(html_patch.stop)
+        self.html.return_value.write_pdf.return_value = b'%PDF-1.7 test'
+
+    def get_pdf(self, **headers):
+        return self.client.get('/download-pdf/', {'date': self.day_date.isoformat()}, headers=headers)
+
+    def test_pdf_rendered_once_and_served_from_disk(self):
+        first = self.get_pdf()
+        second = self.get_pdf()
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.content, b'%PDF-1.7 test')
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertIn('Last-Modified', first)
+        self.assertEqual(self.html.call_count, 1)
+
+    def test_if_none_match_returns_304(self):
+        etag = self.get_pdf()['ETag']
+        response = self.get_pdf(if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.html.call_count, 1)
+
+    def test_surgery_change_rebuilds_pdf(self):
+        etag = self.get_pdf()['ETag']
+        surgery = Surgery.objects.filter(branch=self.branches[0]).first()
+        surgery.diagnost = 'Другой диагноз'
+        with self.captureOnCommitCallbacks(execute=True):
+            surgery.save()
+        response = self.get_pdf(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.html.call_count, 2)
+
+    def test_full_render_queue_returns_503(self):
+        renderer = get_renderer()
+        for _ in range(renderer.queue_size):
+            renderer._slots.acquire()
+        try:
+            response = self.get_pdf()
+        finally:
+            for _ in range(renderer.queue_size):
+                renderer._slots.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(self.html.call_count, 0)
+
+    def test_prerendered_pdfs_served_without_rendering(self):
+        head = CustomUser.objects.create_user('head', 'pass', first_name='A', last_name='B')
+        head.branches.add(self.branches[0])
+        self.assertEqual(prerender_day_pdfs(self.day), 2)
+        self.assertEqual(prerender_day_pdfs(self.day), 0)
+
+        self.client.force_login(head)
+        self.assertEqual(self.get_pdf().status_code, 200)
+        self.assertEqual(self.html.call_count, 2)
+
+    @override_settings(PDF_PRERENDER_DEBOUNCE=0)
+    def test_edit_schedules_debounced_rerender(self):
+        self.assertIsNone(get_pending_prerender_day())
+        prerender_day_pdfs(self.day)
+        self.add_surgeries(self.branches[1], 1)
+        self.assertEqual(get_pending_prerender_day(), self.day)
+        self.assertIsNone(get_pending_prerender_day())
+
+    def test_edit_waits_for_debounce(self):
+        prerender_day_pdfs(self.day)
+        self.add_surgeries(self.branches[1], 1)
+        self.assertIsNone(get_pending_prerender_day())
+
+
+class PdfRendererTests(TestCase):
+    def test_slots_released_after_inline_render(self):
+        renderer = PdfRenderer(workers=0, queue_size=1, timeout=5)
+        with mock.patch('backend.pdf_worker.HTML') as html:
+            html.return_value.write_pdf.return_value = b'%PDF'
+            self.assertEqual(renderer.render_sync('<p></p>', '/'), b'%PDF')
+            self.assertEqual(renderer.render_sync('<p></p>', '/'), b'%PDF')
+
+    def test_submit_rejects_when_queue_full(self):
+        renderer = PdfRenderer(workers=0, queue_size=1, timeout=5)
+        renderer._slots.acquire()
+        with self.assertRaises(RendererBusy):
+            renderer.submit('<p></p>', '/')
+
+
+class CatalogSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for name in ['Холецистэктомия', 'Лапароскопическая холецистэктомия', 'Аппендэктомия', 'Грыжесечение']:
+            SurgeryName.objects.create(surgery_name=name)
+        for index in range(15):
+            SurgeryType.objects.create(type_name=f'ВМП {index}')
+
+    def test_prefix_matches_ranked_first(self):
+        response = self.client.get('/search_surgery_name/', {'query': 'Холец'})
+        names = [item['surgery_name'] for item in response.json()]
+        self.assertEqual(names[0], 'Холецистэктомия')
+        self.assertEqual(set(response.json()[0]), {'id', 'surgery_name'})
+
+    def test_substring_matches_included(self):
+        response = self.client.get('/search_surgery_name/', {'query': 'эктомия'})
+        self.assertEqual(len(response.json()), 3)
+
+    def test_results_limited_in_sql(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/search_surgery_type/', {'query': 'ВМП'})
+        self.assertEqual(len(response.json()), 10)
+
+    def test_empty_query(self):
+        self.assertEqual(self.client.get('/search_surgery_type/', {'query': ' '}).json(), [])
+
+
+@override_settings(CATALOG_SEARCH_MODE='memory')
+class InMemoryCatalogSearchTests(CatalogSearchTests):
+    def test_results_limited_in_sql(self):
+        self.client.get('/search_surgery_type/', {'query': 'ВМП'})
+        with self.assertNumQueries(0):
+            response = self.client.get('/search_surgery_type/', {'query': 'вмп'})
+        self.assertEqual(len(response.json()), 10)
+
+    def test_case_folding_and_yo(self):
+        SurgeryName.objects.create(surgery_name='Удаление жёлчного пузыря')
+        names = [item['surgery_name'] for item in self.client.get('/search_surgery_name/', {'query': 'ЖЕЛЧ'}).json()]
+        self.assertEqual(names, ['Удаление жёлчного пузыря'])
+
+    def test_signals_update_loaded_index(self):
+        surgery_name_index.search('а')
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(1):
+                created = SurgeryName.objects.create(surgery_name='Аденоидэктомия')
+            # Not in the index (nor its version bumped) until the row commits.
+            self.assertEqual(surgery_name_index.search('аден'), [])
+        with self.assertNumQueries(0):
+            self.assertEqual(surgery_name_index.search('аден')[0]['id'], created.id)
+
+        created.surgery_name = 'Тонзиллэктомия'
+        with self.captureOnCommitCallbacks(execute=True):
+            created.save()
+        created_id = created.id
+        with self.assertNumQueries(0):
+            self.assertEqual(surgery_name_index.search('аден'), [])
+            self.assertEqual(surgery_name_index.search('тонз')[0]['id'], created_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            created.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(surgery_name_index.search('тонз'), [])
+
+    def test_reloads_after_change_elsewhere(self):
+        surgery_name_index.search('а')
+        SurgeryName.objects.bulk_create([SurgeryName(surgery_name='Ампутация')])
+        cache.incr(surgery_name_index.version_key)
+        self.assertEqual(surgery_name_index.search('ампут')[0]['surgery_name'], 'Ампутация')
+
+    def test_stats_exposed_to_superuser(self):
+        self.client.get('/search_surgery_name/', {'query': 'Холец'})
+        self.client.force_login(
+            CustomUser.objects.create_superuser('admin', 'pass', first_name='A', last_name='B')
+        )
+        stats = self.client.get('/search_stats/').json()
+        self.assertEqual(stats['mode'], 'memory')
+        self.assertEqual(stats['surgery_name']['entries'], 4)
+        self.assertGreater(stats['surgery_name']['memory_bytes'], 0)
+        self.assertGreaterEqual(stats['surgery_name']['lookups'], 1)
+
+
+class UpdateSeqNumberTests(ScheduleDataMixin, TestCase):
+    def post(self, payload):
+        return self.client.post('/update_seq_number/', json.dumps(payload), content_type='application/json')
+
+    def reversed_payload(self, branch):
+        surgeries = list(Surgery.objects.filter(branch=branch, date_of_surgery=self.day).order_by('seq_number'))
+        return [{'id': s.id, 'seq_number': len(surgeries) - i} for i, s in enumerate(surgeries)]
+
+    def test_reorder_returns_authoritative_ordering(self):
+        self.add_surgeries(self.branches[0], 3, surgeons_per_surgery=0)
+        payload = self.reversed_payload(self.branches[0])
+        response = self.post(payload)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['ordering'], sorted(payload, key=lambda item: item['seq_number']))
+
+    def test_reorder_queries_constant_at_200_rows(self):
+        counts = []
+        for branch, rows in ((self.branches[0], 20), (self.branches[1], 200)):
+            self.add_surgeries(branch, rows, surgeons_per_surgery=0)
+            payload = self.reversed_payload(branch)
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.post(payload).status_code, 200)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_invalid_payload_changes_nothing(self):
+        self.add_surgeries(self.branches[0], 2, surgeons_per_surgery=0)
+        payload = self.reversed_payload(self.branches[0])
+        before = list(Surgery.objects.order_by('id').values_list('seq_number', flat=True))
+        for bad in (payload + [{'id': 999999, 'seq_number': 3}],
+                    [dict(item, seq_number=1) for item in payload],
+                    [{'id': payload[0]['id']}],
+                    {'id': 1}):
+            self.assertEqual(self.post(bad).status_code, 400)
+        self.assertEqual(list(Surgery.objects.order_by('id').values_list('seq_number', flat=True)), before)
+
+    def test_rejects_rows_from_different_branches(self):
+        self.add_surgeries(self.branches[0], 1, surgeons_per_surgery=0)
+        self.add_surgeries(self.branches[1], 1, surgeons_per_surgery=0)
+        payload = [{'id': s.id, 'seq_number': i} for i, s in enumerate(Surgery.objects.all(), start=1)]
+        self.assertEqual(self.post(payload).status_code, 400)
+
+    def test_reorder_invalidates_schedule_cache(self):
+        self.add_surgeries(self.branches[0], 2, surgeons_per_surgery=0)
+        get_day_schedule(self.day)
+        payload = self.reversed_payload(self.branches[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post(payload)
+        first = get_day_schedule(self.day)[0]['surgeries'][0]
+        self.assertEqual(first['id'], payload[-1]['id'])
+
+
+class MoveSurgeryTests(ScheduleDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(
+            CustomUser.objects.create_superuser('admin', 'pass', first_name='A', last_name='B')
+        )
+        for branch in self.branches[:2]:
+            self.add_surgeries(branch, 3, surgeons_per_surgery=0)
+
+    def move(self, surgery, branch, seq_number):
+        return self.client.post('/update_surgery_seq/', json.dumps({
+            'surgery_id': surgery.id,
+            'new_seq_number': seq_number,
+            'new_branch_number': branch.branch_number,
+        }), content_type='application/json').json()
+
+    def ordering(self, branch, day=None):
+        return list(Surgery.objects.filter(branch=branch, date_of_surgery=day or self.day).order_by(
+            'seq_number').values_list('id', 'seq_number'))
+
+    def test_cross_branch_move_renumbers_both_branches(self):
+        old = [pk for pk, _ in self.ordering(self.branches[0])]
+        new = [pk for pk, _ in self.ordering(self.branches[1])]
+        surgery = Surgery.objects.get(id=old[0])
+        self.assertTrue(self.move(surgery, self.branches[1], 2)['success'])
+        self.assertEqual(self.ordering(self.branches[0]), [(old[1], 1), (old[2], 2)])
+        self.assertEqual(self.ordering(self.branches[1]), [(new[0], 1), (old[0], 2), (new[1], 3), (new[2], 4)])
+
+    def test_move_within_branch(self):
+        ids = [pk for pk, _ in self.ordering(self.branches[0])]
+        self.move(Surgery.objects.get(id=ids[2]), self.branches[0], 1)
+        self.assertEqual(self.ordering(self.branches[0]), [(ids[2], 1), (ids[0], 2), (ids[1], 3)])
+
+    def test_other_days_untouched(self):
+        other_day = SurgeryDay.objects.create(date=date(2025, 3, 5))
+        self.add_surgeries(self.branches[0], 2, surgeons_per_surgery=0, day=other_day)
+        Surgery.objects.filter(date_of_surgery=other_day).update(seq_number=7)
+        before = self.ordering(self.branches[0], other_day)
+        surgery = Surgery.objects.filter(branch=self.branches[0], date_of_surgery=self.day).first()
+        self.move(surgery, self.branches[1], 1)
+        self.assertEqual(self.ordering(self.branches[0], other_day), before)
+
+    def test_query_count_independent_of_history(self):
+        from .sequence import lock_sequence
+        surgery = Surgery.objects.filter(branch=self.branches[0], date_of_surgery=self.day).first()
+        # Sequence counters are created on first use; count steady-state moves.
+        for branch in self.branches[:2]:
+            lock_sequence(branch.id, self.day.pk)
+        with CaptureQueriesContext(connection) as small:
+            self.move(surgery, self.branches[1], 1)
+        for offset in range(5):
+            day = SurgeryDay.objects.create(date=date(2024, 1, 1 + offset))
+            self.add_surgeries(self.branches[1], 5, surgeons_per_surgery=0, day=day)
+        with CaptureQueriesContext(connection) as large:
+            self.move(surgery, self.branches[0], 1)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+
+class SurgeryIndexPlanTests(ScheduleDataMixin, TestCase):
+    # PostgreSQL gets the full 1M-row dataset; SQLite test runs use a smaller
+    # one, which is enough for its planner to pick the composite index.
+    def seed_history(self):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "INSERT INTO backend_surgeryday (date, editable) "
+                    "SELECT DATE '2000-01-01' + n, false FROM generate_series(0, 4999) AS n"
+                )
+                cursor.execute(
+                    "INSERT INTO backend_surgery (seq_number, branch_id, own_branch_id, full_name, age, diagnost, "
+                    "surgery_name_id, surgery_type_id, date_of_surgery_id) "
+                    "SELECT n / 5000 + 1, %s, %s, 'Пациент', 40, 'Диагноз', %s, %s, d.id "
+                    "FROM generate_series(0, 999999) AS n "
+                    "JOIN backend_surgeryday d ON d.date = DATE '2000-01-01' + (n %% 5000)",
+                    [self.branches[0].id, self.branches[0].id, self.surgery_name.id, self.surgery_type.id],
+                )
+                cursor.execute("ANALYZE backend_surgery")
+        else:
+            days = SurgeryDay.objects.bulk_create(
+                [SurgeryDay(date=date(2000, 1, 1) + timedelta(days=n), editable=False) for n in range(500)]
+            )
+            Surgery.objects.bulk_create([
+                Surgery(seq_number=n // 500 + 1, branch=self.branches[n % 3], own_branch=self.branches[n % 3],
+                        full_name='Пациент', diagnost='Диагноз', surgery_name=self.surgery_name,
+                        date_of_surgery=days[n % 500])
+                for n in range(20000)
+            ], batch_size=2000)
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+
+    def test_day_branch_query_uses_composite_index(self):
+        self.seed_history()
+        plan = Surgery.objects.filter(date_of_surgery=self.day, branch=self.branches[0]).order_by(
+            'seq_number').explain()
+        self.assertRegex(plan, 'surgery_day_branch_seq_idx|unique_surgery_day_branch_seq')
+
+    @skipUnless(connection.vendor == 'postgresql', 'Deferrable unique constraints need PostgreSQL.')
+    def test_duplicate_positions_rejected_at_commit(self):
+        from django.db import IntegrityError, transaction
+        self.add_surgeries(self.branches[0], 2, surgeons_per_surgery=0)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic(), connection.cursor() as cursor:
+                Surgery.objects.filter(branch=self.branches[0], date_of_surgery=self.day).update(seq_number=1)
+                # TestCase never really commits, so force the deferred check.
+                cursor.execute('SET CONSTRAINTS unique_surgery_day_branch_seq IMMEDIATE')
+
+
+class SeedLoadTests(TestCase):
+    def test_seed_load_bulk_creates_consistent_history(self):
+        call_command('seed_load', days=14, surgeries_per_day=20, branches=3, surgeons_per_branch=4,
+                     catalog_size=50, end_date=date(2025, 3, 7), seed=1, stdout=io.StringIO())
+        self.assertEqual(SurgeryDay.objects.count(), 12)
+        self.assertEqual(Surgery.objects.count(), 10 * 20 + 2 * 5)
+        self.assertFalse(Surgery.objects.filter(surgeons=None).exists())
+        positions = Surgery.objects.values_list('date_of_surgery', 'branch', 'seq_number')
+        self.assertEqual(len(set(positions)), len(positions))
+
+        call_command('seed_load', days=14, surgeries_per_day=20, branches=3, surgeons_per_branch=4,
+                     catalog_size=50, end_date=date(2025, 3, 7), seed=2, stdout=io.StringIO())
+        positions = Surgery.objects.values_list('date_of_surgery', 'branch', 'seq_number')
+        self.assertEqual(len(set(positions)), len(positions))
+
+
+class RequestMetricsMiddlewareTests(ScheduleDataMixin, TestCase):
+    def test_server_timing_and_log_line(self):
+        self.add_surgeries(self.branches[0], 2)
+        with self.assertLogs('core.requests', 'INFO') as logs:
+            response = self.client.get('/', {'date': self.day_date.isoformat()})
+        self.assertRegex(response['Server-Timing'], r'app;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries"')
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['view'], 'home')
+        self.assertGreater(line['sql_queries'], 0)
+        self.assertEqual(line['duplicate_queries'], 0)
+
+    def test_duplicate_queries_detected(self):
+        from core.middleware import RequestMetrics
+        metrics = RequestMetrics()
+        for surgery_id in (1, 2, 3):
+            metrics.record_query(f'SELECT * FROM backend_surgery WHERE id = {surgery_id}', 0.001)
+        metrics.record_query('SELECT * FROM backend_branch WHERE id IN (%s, %s, %s)', 0.001)
+        self.assertEqual(metrics.duplicates(), [('SELECT * FROM backend_surgery WHERE id = ?', 3)])
+
+    @override_settings(PDF_RENDER_WORKERS=0)
+    def test_pdf_render_time_reported(self):
+        self.client.force_login(
+            CustomUser.objects.create_superuser('admin', 'pass', first_name='A', last_name='B')
+        )
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root), \
+                mock.patch('backend.pdf_worker.HTML') as html, self.assertLogs('core.requests'):
+            html.return_value.write_pdf.return_value = b'%PDF-1.7 test'
+            response = self.client.get('/download-pdf/', {'date': self.day_date.isoformat()})
+        self.assertIn('pdf;dur=', response['Server-Timing'])
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=0)
+    def test_unsampled_requests_untouched(self):
+        response = self.client.get('/', {'date': self.day_date.isoformat()})
+        self.assertNotIn('Server-Timing', response)
+
+
+class MetricsEndpointTests(ScheduleDataMixin, TestCase):
+    def scrape(self):
+        response = self.client.get('/metrics', REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_requests_pdf_search_and_cache_exposed(self):
+        self.client.get('/', {'date': self.day_date.isoformat()})
+        self.client.get('/', {'date': self.day_date.isoformat()})
+        self.client.get('/search_surgery_name/', {'query': 'Апп'})
+        body = self.scrape()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertRegex(body, r'http_request_duration_seconds_count\{view="home",method="GET",status="200"\} \d+')
+        self.assertIn('http_request_duration_seconds_bucket{view="home",method="GET",status="200",le="+Inf"}', body)
+        self.assertRegex(body, r'cache_requests_total\{cache="schedule",result="hit"\} \d+')
+        self.assertRegex(body, r'typeahead_requests_total\{catalog="surgery_name",mode="database"\} \d+')
+        self.assertIn('# TYPE pdf_render_queue_depth gauge', body)
+
+    def test_scheduler_failures_counted(self):
+        from core.metrics import SCHEDULER_JOB_FAILURES
+        from .schedulers import tracked_job
+
+        @tracked_job
+        def failing_job():
+            raise RuntimeError('boom')
+
+        with mock.patch('builtins.print'):
+            failing_job()
+        self.assertEqual(SCHEDULER_JOB_FAILURES._values[('failing_job',)], 1)
+        self.assertIn('scheduler_job_failures_total{job="failing_job"} 1', self.scrape())
+
+    def test_forbidden_for_other_clients(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.5').status_code, 403)
+
+    def test_scheduler_process_serves_own_metrics(self):
+        from urllib.error import HTTPError
+        from urllib.request import urlopen
+        from core.metrics import SCHEDULER_JOB_RUNS, serve_metrics
+        server = serve_metrics(0, '127.0.0.1')
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+        SCHEDULER_JOB_RUNS.inc(job='prune_pdf_cache')
+        with urlopen(url) as response:
+            self.assertRegex(response.read().decode(), r'scheduler_job_runs_total\{job="prune_pdf_cache"\} \d+')
+        with override_settings(METRICS_ALLOWED_IPS=[]), self.assertRaises(HTTPError) as error:
+            urlopen(url)
+        self.assertEqual(error.exception.code, 403)
+
+
+class SchedulerTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+
+    def start_scheduler(self):
+        from apscheduler.schedulers.base import BaseScheduler
+        from .schedulers import build_scheduler
+
+        class ManualScheduler(BaseScheduler):
+            # No wakeup thread: nothing touches the test database behind our back.
+            def wakeup(self):
+                pass
+
+            def shutdown(self, wait=True):
+                super().shutdown(wait)
+
+        scheduler = build_scheduler(ManualScheduler)
+        scheduler.start(paused=True)
+        self.addCleanup(scheduler.shutdown, wait=False)
+        return scheduler
+
+    def test_jobs_persisted_once_across_restarts(self):
+        from .models import SchedulerJob
+        self.start_scheduler()
+        self.start_scheduler()
+        self.assertEqual(
+            set(SchedulerJob.objects.values_list('id', flat=True)),
+            {'mark_surgery_days_uneditable', 'materialize_calendar', 'prerender_next_day_pdfs',
+             'rerender_changed_day_pdfs', 'cleanup_pdf_cache', 'cleanup_schedule_events'},
+        )
+
+    def test_missed_run_is_due_after_downtime(self):
+        from datetime import datetime, timezone
+        from .models import SchedulerJob
+        self.start_scheduler()
+        SchedulerJob.objects.filter(id='cleanup_pdf_cache').update(next_run_time=0)
+        # Restarting must keep the overdue run instead of rescheduling it.
+        scheduler = self.start_scheduler()
+        store = scheduler._lookup_jobstore('default')
+        due = store.get_due_jobs(datetime.now(timezone.utc))
+        self.assertEqual([job.id for job in due], ['cleanup_pdf_cache'])
+        self.assertIsNone(due[0].misfire_grace_time)
+        self.assertTrue(due[0].coalesce)
+
+    def test_lock_is_exclusive(self):
+        from .schedulers import SchedulerLock
+        with override_settings(SCHEDULER_LOCK_FILE=f'{self.tmp}/scheduler.lock'):
+            first, second = SchedulerLock(), SchedulerLock()
+            self.assertTrue(first.acquire())
+            self.assertTrue(first.is_held())
+            self.assertFalse(second.acquire())
+            first.release()
+            self.assertTrue(second.acquire())
+            second.release()
+
+    def test_prune_pdf_cache(self):
+        from .pdf import prune_pdf_cache
+        with override_settings(MEDIA_ROOT=self.tmp):
+            for name in ('2025-03-01', '2025-03-04', 'other'):
+                folder = f'{self.tmp}/pdf/{name}'
+                os.makedirs(folder)
+            self.assertEqual(prune_pdf_cache(date(2025, 3, 4)), 1)
+            self.assertFalse(os.path.exists(f'{self.tmp}/pdf/2025-03-01'))
+            self.assertTrue(os.path.exists(f'{self.tmp}/pdf/2025-03-04'))
+
+
+@override_settings(DAY_LOCK_TIME='15:00', DAY_LOCK_TIMEZONE='Asia/Tashkent')
+class DayLockTests(TestCase):
+    def setUp(self):
+        for offset in range(-5, 2):
+            SurgeryDay.objects.create(date=date(2025, 3, 10) + timedelta(days=offset))
+
+    def at(self, hour):
+        from datetime import datetime
+        from zoneinfo import ZoneInfo
+        return datetime(2025, 3, 10, hour, tzinfo=ZoneInfo('Asia/Tashkent'))
+
+    def editable_dates(self):
+        return list(SurgeryDay.objects.filter(editable=True).order_by('date').values_list('date', flat=True))
+
+    def test_catches_up_all_past_days_in_one_update(self):
+        from .functions import lock_past_days
+        with CaptureQueriesContext(connection) as ctx:
+            locked_through, days_locked = lock_past_days(self.at(16))
+        self.assertEqual((locked_through, days_locked), (date(2025, 3, 9), 5))
+        self.assertEqual(sum(q['sql'].startswith('UPDATE') for q in ctx.captured_queries), 1)
+        self.assertEqual(self.editable_dates(), [date(2025, 3, 10), date(2025, 3, 11)])
+
+    def test_catch_up_notifies_recent_days_only(self):
+        from .functions import lock_past_days
+        broker = mock.Mock()
+        with mock.patch('backend.events.get_broker', return_value=broker), \
+                self.captureOnCommitCallbacks(execute=True):
+            lock_past_days(self.at(16))
+        recent = SurgeryDay.objects.filter(date__in=[date(2025, 3, 8), date(2025, 3, 9)])
+        self.assertEqual(sorted(call.args[0] for call in broker.publish.call_args_list),
+                         sorted(recent.values_list('pk', flat=True)))
+
+    def test_cutoff_time_and_idempotence(self):
+        from .functions import lock_past_days
+        from .models import DayLockRun
+        self.assertEqual(lock_past_days(self.at(14)), (date(2025, 3, 8), 4))
+        self.assertEqual(lock_past_days(self.at(14)), (date(2025, 3, 8), 0))
+        self.assertIn(date(2025, 3, 9), self.editable_dates())
+        self.assertEqual(list(DayLockRun.objects.order_by('pk').values_list('days_locked', flat=True)), [4, 0])
+
+    def test_bumps_schedule_version(self):
+        from .functions import lock_past_days
+        from .schedule import get_schedule_version
+        day = SurgeryDay.objects.get(date=date(2025, 3, 9))
+        before = get_schedule_version(day.pk)
+        lock_past_days(self.at(16))
+        self.assertNotEqual(get_schedule_version(day.pk), before)
+
+
+class DayCalendarTests(TestCase):
+    start = date(2025, 3, 6)  # Thursday
+
+    def setUp(self):
+        cache.clear()
+
+    def test_materializes_horizon_in_one_insert(self):
+        from .calendar import materialize_days
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(materialize_days(self.start, horizon=13), 12)
+        self.assertEqual(sum(q['sql'].startswith('INSERT') for q in ctx.captured_queries), 1)
+        days = dict(SurgeryDay.objects.values_list('date', 'editable'))
+        self.assertNotIn(date(2025, 3, 9), days)
+        self.assertFalse(days[date(2025, 3, 8)])
+        self.assertTrue(days[date(2025, 3, 10)])
+        self.assertEqual(materialize_days(self.start, horizon=13), 0)
+
+    def test_lookups_served_from_memory(self):
+        from .calendar import materialize_days
+        from .functions import get_day
+        materialize_days(self.start, horizon=13)
+        get_day(self.start)
+        with self.assertNumQueries(0):
+            day = get_day(self.start)
+            self.assertEqual(get_day(date(2025, 3, 9)), False)
+            self.assertIsNone(get_day(date(2026, 1, 1)))
+        self.assertEqual(day.pk, SurgeryDay.objects.get(date=self.start).pk)
+        self.assertFalse(day._state.adding)
+
+    def test_request_path_never_writes(self):
+        from .calendar import materialize_days
+        materialize_days(self.start, horizon=13)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/', {'date': '2026-01-01'})
+            self.client.get('/', {'date': self.start.isoformat()})
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith(('INSERT', 'UPDATE'))])
+        self.assertFalse(SurgeryDay.objects.filter(date=date(2026, 1, 1)).exists())
+
+    def test_next_day_lookup_never_creates_days(self):
+        from .calendar import CalendarNotMaterialized, materialize_days
+        from .functions import get_next_surgery_day, get_next_surgery_date
+        with self.assertRaises(CalendarNotMaterialized):
+            get_next_surgery_day()
+        self.assertFalse(SurgeryDay.objects.exists())
+        materialize_days()
+        self.assertEqual(get_next_surgery_day().date, get_next_surgery_date())
+
+    def test_editable_toggle_reloads_map(self):
+        from .calendar import materialize_days
+        from .functions import get_day
+        materialize_days(self.start, horizon=0)
+        self.assertTrue(get_day(self.start).editable)
+        admin = CustomUser.objects.create_superuser('admin', 'pass', first_name='A', last_name='B')
+        self.client.force_login(admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(f'/editable/{get_day(self.start).pk}/')
+        self.assertFalse(get_day(self.start).editable)
+
+
+class HospitalCalendarTests(ScheduleDataMixin, TestCase):
+    def post_booking(self, branch):
+        surgeon, _ = Surgeon.objects.get_or_create(full_name='Хирург', branch=branch)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f'/add_surgery/{branch.id}?date={self.day_date.isoformat()}', {
+                'full_name': 'Пациент', 'diagnost': 'Диагноз', 'surgery_name': 'Аппендэктомия',
+                'surgeons': [surgeon.id],
+            })
+
+    def test_holiday_is_not_a_surgery_date(self):
+        from .calendar import materialize_days
+        from .functions import get_day
+        from .models import Holiday
+        Holiday.objects.create(date=date(2025, 3, 8), name='8 марта')
+        self.assertEqual(get_day(date(2025, 3, 8)), False)
+        materialize_days(date(2025, 3, 6), horizon=3)
+        self.assertFalse(SurgeryDay.objects.filter(date=date(2025, 3, 8)).exists())
+        self.assertEqual(self.client.get('/download-pdf/', {'date': '2025-03-08'}).status_code, 400)
+
+    def test_over_capacity_booking_rejected(self):
+        from .models import BranchCapacity
+        branch = self.branches[0]
+        BranchCapacity.objects.create(branch=branch, daily_limit=2)
+        self.add_surgeries(branch, 1)
+        self.assertEqual(self.post_booking(branch).status_code, 302)
+        response = self.post_booking(branch)
+        self.assertEqual(response.status_code, 400)
+        self.assertContains(response, 'Лимит операций', status_code=400)
+        self.assertEqual(Surgery.objects.filter(branch=branch, date_of_surgery=self.day).count(), 2)
+
+    def test_closed_theatre_rejected(self):
+        from .models import TheatreClosure
+        TheatreClosure.objects.create(start_date=self.day_date, end_date=self.day_date + timedelta(days=2))
+        response = self.post_booking(self.branches[1])
+        self.assertContains(response, 'закрыта', status_code=400)
+        self.assertFalse(Surgery.objects.filter(branch=self.branches[1]).exists())
+
+    def test_checks_add_no_queries_when_warm(self):
+        from .models import BranchCapacity
+        with self.captureOnCommitCallbacks(execute=True):
+            BranchCapacity.objects.create(branch=self.branches[0], daily_limit=5)
+        hospital_calendar.ensure_current()
+        with self.assertNumQueries(0):
+            self.assertFalse(hospital_calendar.is_closed(self.branches[0].pk, self.day_date))
+            self.assertEqual(hospital_calendar.get_capacity(self.branches[0].pk), 5)
+
+    def test_capacity_counts_bookings_missing_from_snapshot(self):
+        from .models import BranchCapacity
+        branch = self.branches[0]
+        BranchCapacity.objects.create(branch=branch, daily_limit=2)
+        get_day_schedule(self.day)
+        # Written without signals, so the cached day snapshot still shows none.
+        Surgery.objects.bulk_create([
+            Surgery(seq_number=number, branch=branch, own_branch=branch, full_name='Пациент', diagnost='Диагноз',
+                    surgery_name=self.surgery_name, date_of_surgery=self.day)
+            for number in (1, 2)
+        ])
+        response = self.post_booking(branch)
+        self.assertContains(response, 'Лимит операций', status_code=400)
+        self.assertEqual(Surgery.objects.filter(branch=branch, date_of_surgery=self.day).count(), 2)
+
+    def test_booking_locks_counter_once_and_rolls_back_catalog(self):
+        from .models import BranchCapacity
+        branch = self.branches[0]
+        surgeon = Surgeon.objects.create(full_name='Хирург', branch=branch)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.post_booking(branch).status_code, 302)
+        self.assertEqual(len([q for q in ctx.captured_queries
+                              if q['sql'].startswith('SELECT') and 'backend_surgerysequence' in q['sql']]), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            BranchCapacity.objects.create(branch=branch, daily_limit=1)
+        response = self.client.post(f'/add_surgery/{branch.id}?date={self.day_date.isoformat()}', {
+            'full_name': 'Пациент', 'diagnost': 'Диагноз', 'surgery_name': 'Новая операция',
+            'surgery_type': 'Новый тип', 'surgeons': [surgeon.id],
+        })
+        self.assertContains(response, 'Лимит операций', status_code=400)
+        self.assertFalse(SurgeryName.objects.filter(surgery_name='Новая операция').exists())
+        self.assertFalse(SurgeryType.objects.filter(type_name='Новый тип').exists())
+
+
+class OverviewTests(ScheduleDataMixin, TestCase):
+    def get_overview(self, path='/week/'):
+        return self.client.get(path, {'date': self.day_date.isoformat()})
+
+    def test_week_counts_per_branch_and_day(self):
+        other_day = SurgeryDay.objects.create(date=self.day_date + timedelta(days=1))
+        self.add_surgeries(self.branches[0], 3, surgeons_per_surgery=2)
+        self.add_surgeries(self.branches[1], 2, surgeons_per_surgery=1, day=other_day)
+        response = self.get_overview()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.context['start'], response.context['end']), (date(2025, 3, 3), date(2025, 3, 9)))
+        rows = {row['id']: row for row in response.context['branches']}
+        cell = rows[self.branches[0].id]['cells'][1]
+        self.assertEqual((cell['date'], cell['surgeries'], cell['surgeon_count'], cell['assignments']),
+                         (self.day_date, 3, 6, 6))
+        self.assertEqual(rows[self.branches[1].id]['cells'][2]['surgeries'], 2)
+        self.assertEqual(response.context['total'], 5)
+        self.assertTrue(response.context['days'][1]['editable'])
+        self.assertFalse(response.context['days'][6]['surgery_date'])
+        self.assertContains(response, f'href="/?date={self.day_date.isoformat()}"')
+
+    def test_single_aggregate_query(self):
+        self.get_overview()
+
+        def surgery_queries():
+            with CaptureQueriesContext(connection) as ctx:
+                self.get_overview('/month/')
+            return [q['sql'] for q in ctx.captured_queries if 'backend_surgery' in q['sql']]
+
+        for branch in self.branches:
+            self.add_surgeries(branch, 2)
+        baseline = surgery_queries()
+        self.assertEqual(len(baseline), 1)
+        self.assertIn('GROUP BY', baseline[0])
+        for branch in self.branches:
+            self.add_surgeries(branch, 5, surgeons_per_surgery=3)
+        self.assertEqual(len(surgery_queries()), 1)
+
+    def test_month_bounds_and_head_branches(self):
+        user = CustomUser.objects.create_user('head', 'pass', first_name='A', last_name='B')
+        user.branches.add(self.branches[2])
+        self.client.force_login(user)
+        response = self.get_overview('/month/')
+        self.assertEqual((response.context['start'], response.context['end']), (date(2025, 3, 1), date(2025, 3, 31)))
+        self.assertEqual([row['id'] for row in response.context['branches']], [self.branches[2].id])
+
+
+class ExportTests(ScheduleDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_surgeries(self.branches[0], 2)
+        self.add_surgeries(self.branches[1], 1, surgeons_per_surgery=1)
+        later = SurgeryDay.objects.create(date=date(2025, 4, 1))
+        self.add_surgeries(self.branches[0], 1, day=later)
+
+    def test_rows_joined_and_filtered(self):
+        from .export import get_export_rows
+        rows = list(get_export_rows(date(2025, 3, 1), date(2025, 3, 31)))
+        self.assertEqual([row[1] for row in rows], ['1.1', '1.2', '2.1'])
+        self.assertEqual(rows[0][:3], ['04.03.2025', '1.1', 'Отдел 1'])
+        self.assertEqual(sorted(rows[0][9].split(', ')), ['Хирург 1.0.0', 'Хирург 1.0.1'])
+        self.assertEqual(rows[0][6:8], ['Аппендэктомия', 'ВМП'])
+        only_second = list(get_export_rows(date(2025, 3, 1), date(2025, 4, 30), {self.branches[1].id}))
+        self.assertEqual([row[1] for row in only_second], ['2.1'])
+
+    def test_csv_streams_in_blocks(self):
+        import csv
+        from .export import iter_csv, get_export_rows
+        with mock.patch('backend.export.EXPORT_BLOCK_ROWS', 2):
+            blocks = list(iter_csv(get_export_rows(date(2025, 3, 1), date(2025, 4, 30))))
+        self.assertEqual(len(blocks), 3)
+        lines = list(csv.reader(io.StringIO(b''.join(blocks).decode('utf-8-sig'))))
+        self.assertEqual(lines[0][0], 'Дата')
+        self.assertEqual(len(lines), 5)
+
+    def test_xlsx_is_valid_workbook(self):
+        import zipfile
+        from xml.etree import ElementTree
+        from .export import iter_xlsx, get_export_rows
+        with mock.patch('backend.export.EXPORT_BLOCK_ROWS', 1):
+            data = b''.join(iter_xlsx(get_export_rows(date(2025, 3, 1), date(2025, 4, 30))))
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertIsNone(archive.testzip())
+            sheet = ElementTree.fromstring(archive.read('xl/worksheets/sheet1.xml'))
+        ns = {'x': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+        rows = sheet.findall('.//x:row', ns)
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[1].find('.//x:t', ns).text, '04.03.2025')
+
+    async def test_view_streams_for_heads_own_branches(self):
+        user = await sync_to_async(CustomUser.objects.create_user)('head', 'pass', first_name='A', last_name='B')
+        await sync_to_async(user.branches.add)(self.branches[1])
+        await self.async_client.aforce_login(user)
+        response = await self.async_client.get('/export/', {'start': '2025-03-01', 'end': '2025-04-30'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn('surgeries_2025-03-01_2025-04-30.csv', response['Content-Disposition'])
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode('utf-8-sig')
+        self.assertEqual(len(body.strip().splitlines()), 2)
+        self.assertIn('Отдел 2', body)
+
+    def test_view_rejects_bad_input(self):
+        self.assertEqual(self.client.get('/export/').status_code, 403)
+        admin = CustomUser.objects.create_superuser('admin', 'pass', first_name='A', last_name='B')
+        self.client.force_login(admin)
+        self.assertEqual(self.client.get('/export/', {'start': '2025-13-01'}).status_code, 400)
+        self.assertEqual(self.client.get('/export/', {'format': 'pdf'}).status_code, 400)
+
+    def test_command_writes_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'march.csv')
+            call_command('export_surgeries', start=date(2025, 3, 1), end=date(2025, 3, 31), output=path,
+                         stdout=io.StringIO())
+            with open(path, encoding='utf-8-sig') as export:
+                self.assertEqual(len(export.read().strip().splitlines()), 4)
+
+
+class ScheduleEventTests(ScheduleDataMixin, TestCase):
+    def publish(self, event, day_pk=None):
+        from .events import get_broker
+        get_broker().publish(day_pk or self.day.pk, event)
+
+    def test_signals_publish_after_commit(self):
+        self.add_surgeries(self.branches[0], 1)
+        surgery = Surgery.objects.get()
+        broker = mock.Mock()
+        with mock.patch('backend.events.get_broker', return_value=broker):
+            with self.captureOnCommitCallbacks(execute=True):
+                surgery.diagnost = 'Другой'
+                surgery.save()
+                self.assertFalse(broker.publish.called)
+            events = [call.args[1] for call in broker.publish.call_args_list]
+            self.assertIn({'type': 'row', 'action': 'edited', 'id': surgery.pk}, events)
+
+            broker.reset_mock()
+            from .signals import notify_day_changed
+            with self.captureOnCommitCallbacks(execute=True):
+                notify_day_changed(self.day.pk)
+            broker.publish.assert_called_once_with(
+                self.day.pk, {'type': 'ordering', 'branches': {self.branches[0].id: [[surgery.pk, 1]]}})
+
+            broker.reset_mock()
+            surgery_pk = surgery.pk
+            with self.captureOnCommitCallbacks(execute=True):
+                surgery.delete()
+            events = [call.args[1] for call in broker.publish.call_args_list]
+            self.assertIn({'type': 'deleted', 'id': surgery_pk}, events)
+
+            broker.reset_mock()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.day.editable = False
+                self.day.save()
+            broker.publish.assert_any_call(self.day.pk, {'type': 'day', 'editable': False})
+
+    async def test_local_broker_delivers_and_resyncs_on_overflow(self):
+        from .events import LocalBroker, RESYNC_EVENT
+        broker = LocalBroker()
+        subscription = broker.subscribe(self.day.pk)
+        broker.publish(self.day.pk, {'type': 'deleted', 'id': 1})
+        broker.publish(self.day.pk + 1, {'type': 'deleted', 'id': 2})
+        self.assertEqual(await subscription.get(1), {'type': 'deleted', 'id': 1})
+        self.assertIsNone(await subscription.get(0.01))
+
+        with override_settings(SCHEDULE_EVENTS_QUEUE_SIZE=2):
+            small = broker.subscribe(self.day.pk)
+        for i in range(3):
+            broker.publish(self.day.pk, {'type': 'deleted', 'id': i})
+        self.assertEqual(await small.get(1), RESYNC_EVENT)
+
+        subscription.close()
+        small.close()
+        self.assertEqual(broker._subscriptions, {})
+
+    async def test_cache_broker_round_trip(self):
+        from .events import CacheBroker, RESYNC_EVENT
+        broker = CacheBroker()
+        broker.poll_interval = 0.01
+        subscription = broker.subscribe(self.day.pk)
+        self.assertIsNone(await subscription.get(0.02))
+        await sync_to_async(broker.publish)(self.day.pk, {'type': 'deleted', 'id': 1})
+        await sync_to_async(broker.publish)(self.day.pk, {'type': 'deleted', 'id': 2})
+        self.assertEqual(await subscription.get(1), {'type': 'deleted', 'id': 1})
+        self.assertEqual(await subscription.get(1), {'type': 'deleted', 'id': 2})
+
+        # An evicted counter restarts below what the subscriber has seen.
+        await cache.adelete(broker.log_key(self.day.pk))
+        await sync_to_async(broker.publish)(self.day.pk, {'type': 'deleted', 'id': 3})
+        self.assertEqual(await subscription.get(1), RESYNC_EVENT)
+        await sync_to_async(broker.publish)(self.day.pk, {'type': 'deleted', 'id': 4})
+        self.assertEqual(await subscription.get(1), {'type': 'deleted', 'id': 4})
+
+    async def test_database_broker_round_trip_and_overflow(self):
+        from .events import DatabaseBroker, RESYNC_EVENT
+        broker = DatabaseBroker()
+        broker.poll_interval = 0.01
+        subscription = broker.subscribe(self.day.pk)
+        other = broker.subscribe(self.day.pk + 1)
+        self.assertIsNone(await subscription.get(0.05))
+        await sync_to_async(broker.publish)(self.day.pk, {'type': 'deleted', 'id': 1})
+        await sync_to_async(broker.publish)(self.day.pk + 1, {'type': 'deleted', 'id': 2})
+        await sync_to_async(broker.publish)(self.day.pk, {'type': 'deleted', 'id': 3})
+        self.assertEqual(await subscription.get(1), {'type': 'deleted', 'id': 1})
+        self.assertEqual(await subscription.get(1), {'type': 'deleted', 'id': 3})
+        self.assertEqual(await other.get(1), {'type': 'deleted', 'id': 2})
+        self.assertIsNone(await subscription.get(0.05))
+
+        with override_settings(SCHEDULE_EVENTS_QUEUE_SIZE=2):
+            small = broker.subscribe(self.day.pk)
+        for i in range(3):
+            await sync_to_async(broker.publish)(self.day.pk, {'type': 'deleted', 'id': i})
+        await asyncio.sleep(0.05)
+        self.assertEqual(await small.get(1), RESYNC_EVENT)
+
+        # One poller serves every subscription and stops with the last one.
+        poller = broker._poller
+        for open_subscription in (subscription, other, small):
+            open_subscription.close()
+        await asyncio.wait_for(poller, 1)
+
+    async def test_database_broker_polls_once_per_interval(self):
+        from .events import DatabaseBroker
+        broker = DatabaseBroker()
+        broker.poll_interval = 0.01
+        subscriptions = [broker.subscribe(self.day.pk + offset) for offset in range(5)]
+        # Outside the test transaction each poll hands its connection back.
+        with mock.patch('backend.events.connection', in_atomic_block=False), \
+                mock.patch('backend.events.close_old_connections') as release, \
+                mock.patch.object(broker, 'poll', wraps=broker.poll) as poll:
+            await asyncio.sleep(0.1)
+        self.assertLessEqual(poll.call_count, 11)
+        self.assertEqual(release.call_count, poll.call_count)
+        for subscription in subscriptions:
+            subscription.close()
+
+    def test_old_events_pruned(self):
+        from .events import DatabaseBroker, prune_schedule_events
+        from .models import ScheduleEvent
+        DatabaseBroker().publish(self.day.pk, {'type': 'deleted', 'id': 1})
+        DatabaseBroker().publish(self.day.pk, {'type': 'deleted', 'id': 2})
+        ScheduleEvent.objects.filter(payload__id=1).update(
+            created_at=ScheduleEvent.objects.get(payload__id=1).created_at - DatabaseBroker.retention * 2)
+        self.assertEqual(prune_schedule_events(), 1)
+        self.assertEqual(list(ScheduleEvent.objects.values_list('payload', flat=True)), [{'type': 'deleted', 'id': 2}])
+
+    async def test_stream_sends_published_events(self):
+        response = await self.async_client.get(f'/events/day/{self.day.pk}/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['X-Accel-Buffering'], 'no')
+        stream = response.streaming_content
+        self.assertEqual(await anext(stream), b'retry: 5000\n\n')
+        self.publish({'type': 'deleted', 'id': 7})
+        self.assertEqual(await anext(stream), b'data: {"type": "deleted", "id": 7}\n\n')
+        with override_settings(SCHEDULE_EVENTS_HEARTBEAT=0.01):
+            self.assertEqual(await anext(stream), b': keepalive\n\n')
+        await stream.aclose()
+
+    async def test_stream_resyncs_stale_page(self):
+        response = await self.async_client.get(f'/events/day/{self.day.pk}/', {'version': 'old'})
+        stream = response.streaming_content
+        await anext(stream)
+        self.assertEqual(await anext(stream), b'data: {"type": "resync"}\n\n')
+        await stream.aclose()
+
+    def test_row_fragment_follows_home_visibility(self):
+        self.add_surgeries(self.branches[0], 1)
+        self.add_surgeries(self.branches[1], 1)
+        first, second = Surgery.objects.order_by('branch__branch_number')
+        response = self.client.get(f'/surgery/{first.pk}/row/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, f'data-branch-id="{self.branches[0].id}"')
+        self.assertContains(response, first.full_name)
+
+        head = CustomUser.objects.create_user('head', 'pass', first_name='A', last_name='B')
+        head.branches.add(self.branches[1])
+        self.client.force_login(head)
+        self.assertEqual(self.client.get(f'/surgery/{first.pk}/row/').status_code, 404)
+        self.assertContains(self.client.get(f'/surgery/{second.pk}/row/'), 'Изменить')
+        self.assertEqual(self.client.get('/surgery/0/row/').status_code, 404)
+
+
+class DayApiTests(ScheduleDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_surgeries(self.branches[0], 2)
+        self.add_surgeries(self.branches[1], 1)
+        day_calendar.ensure_current()
+        self.url = f'/api/days/{self.day_date.isoformat()}/'
+
+    def test_full_and_projected_payload(self):
+        data = self.client.get(self.url).json()
+        self.assertEqual(data['date'], '2025-03-04')
+        self.assertTrue(data['editable'])
+        first = data['branches'][0]['surgeries'][0]
+        self.assertEqual(first['seq_number'], 1)
+        self.assertEqual(first['surgeons'], list(
+            Surgery.objects.get(pk=first['id']).surgeons.order_by('id').values_list('id', flat=True)))
+
+        data = self.client.get(self.url, {'fields': 'surgeons,id'}).json()
+        self.assertEqual(set(data['branches'][0]['surgeries'][0]), {'id', 'surgeons'})
+        self.assertEqual(self.client.get(self.url, {'fields': 'password'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/days/2025-02-30/').status_code, 400)
+        self.assertEqual(self.client.get('/api/days/2030-01-01/').status_code, 404)
+
+    def test_etag_follows_day_version(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(ctx.captured_queries), 0)
+        self.assertNotEqual(self.client.get(self.url, {'fields': 'id'})['ETag'], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Surgery.objects.filter(branch=self.branches[0]).first().save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_head_sees_own_branches(self):
+        head = CustomUser.objects.create_user('head', 'pass', first_name='A', last_name='B')
+        head.branches.add(self.branches[1])
+        all_etag = self.client.get(self.url)['ETag']
+        self.client.force_login(head)
+        response = self.client.get(self.url)
+        self.assertEqual([branch['id'] for branch in response.json()['branches']], [self.branches[1].id])
+        self.assertNotEqual(response['ETag'], all_etag)
+
+    def test_compression(self):
+        import brotli
+        import gzip
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertTrue(response['ETag'].startswith('W/'))
+        self.assertEqual(json.loads(brotli.decompress(response.content))['date'], '2025-03-04')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content))['date'], '2025-03-04')
+        self.assertFalse(self.client.get(self.url).has_header('Content-Encoding'))
+
+
+class BatchBookingTests(ScheduleDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.branch = self.branches[0]
+        self.add_surgeries(self.branch, 1)
+        self.surgeons = [Surgeon.objects.create(full_name=f'Хирург партии {i}', branch=self.branch) for i in range(2)]
+        self.other_surgeon = Surgeon.objects.create(full_name='Чужой хирург', branch=self.branches[1])
+        self.admin = CustomUser.objects.create_superuser('admin', 'pass', first_name='A', last_name='B')
+        self.client.force_login(self.admin)
+        self.url = f'/api/days/{self.day_date.isoformat()}/branches/{self.branch.id}/surgeries/'
+
+    def entry(self, i, **overrides):
+        return {
+            'full_name': f'Партия {i}', 'age': 40 + i, 'diagnost': 'Диагноз',
+            'surgery_name': f'Новая операция {i % 2}', 'surgery_type': 'ВМП' if i % 2 else '',
+            'surgeons': [surgeon.id for surgeon in self.surgeons], **overrides,
+        }
+
+    def post(self, entries):
+        return self.client.post(self.url, json.dumps(entries), content_type='application/json')
+
+    def test_books_list_with_fixed_query_count(self):
+        # Catalog names exist after the first batch, so both measured batches
+        # run the same statements.
+        self.post([self.entry(0), self.entry(1)])
+        counts = []
+        for size in (3, 12):
+            with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+                response = self.post([self.entry(i, full_name=f'Пакет {size}.{i}') for i in range(size)])
+            self.assertEqual(response.status_code, 201)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+        rows = list(Surgery.objects.filter(branch=self.branch, date_of_surgery=self.day).order_by('seq_number')
+                    .values_list('seq_number', 'full_name', 'surgery_type__type_name'))
+        self.assertEqual([row[0] for row in rows], list(range(1, 19)))
+        self.assertEqual(rows[1][1:], ('Партия 0', None))
+        self.assertEqual(SurgeryName.objects.filter(surgery_name__startswith='Новая операция').count(), 2)
+        new = Surgery.objects.get(full_name='Пакет 3.1')
+        self.assertEqual(set(new.surgeons.values_list('id', flat=True)), {surgeon.id for surgeon in self.surgeons})
+        self.assertEqual(new.surgery_type.type_name, 'ВМП')
+        self.assertEqual(len(get_day_schedule(self.day)[0]['surgeries']), 18)
+        self.assertTrue(any(item['surgery_name'] == 'Новая операция 1'
+                            for item in self.client.get('/search_surgery_name/', {'query': 'Новая'}).json()))
+
+    def test_invalid_entry_books_nothing(self):
+        response = self.post([self.entry(0), self.entry(1, surgeons=[self.other_surgeon.id]), self.entry(2, diagnost='')])
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['errors']
+        self.assertEqual(errors[0], {})
+        self.assertIn('surgeons', errors[1])
+        self.assertIn('diagnost', errors[2])
+        self.assertEqual(Surgery.objects.filter(branch=self.branch).count(), 1)
+
+    def test_capacity_and_access(self):
+        from .models import BranchCapacity
+        BranchCapacity.objects.create(branch=self.branch, daily_limit=3)
+        self.assertEqual(self.post([self.entry(i) for i in range(3)]).status_code, 400)
+        self.assertEqual(self.post([self.entry(i) for i in range(2)]).status_code, 201)
+
+        head = CustomUser.objects.create_user('head', 'pass', first_name='A', last_name='B')
+        head.branches.add(self.branches[1])
+        self.client.force_login(head)
+        self.assertEqual(self.post([self.entry(0)]).status_code, 403)
+        self.client.logout()
+        self.assertEqual(self.post([self.entry(0)]).status_code, 403)
+
+    def test_batch_page(self):
+        response = self.client.get(f'/add_surgeries/{self.branch.id}', {'date': self.day_date.isoformat()})
+        self.assertContains(response, self.url)
+        self.assertContains(response, 'Хирург партии 0')
+        self.assertNotContains(response, 'Чужой хирург')
+
+
+class SeqAllocatorTests(ScheduleDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.branch = self.branches[0]
+        self.add_surgeries(self.branch, 3, surgeons_per_surgery=0)
+        self.client.force_login(
+            CustomUser.objects.create_superuser('admin', 'pass', first_name='A', last_name='B')
+        )
+
+    def seq_numbers(self):
+        return list(Surgery.objects.filter(branch=self.branch, date_of_surgery=self.day).order_by(
+            'seq_number').values_list('seq_number', flat=True))
+
+    def test_allocates_after_existing_rows_in_two_queries(self):
+        from .models import SurgerySequence
+        from .sequence import allocate_seq_numbers
+        self.assertEqual(allocate_seq_numbers(self.branch.id, self.day.pk, 2), 4)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(allocate_seq_numbers(self.branch.id, self.day.pk), 6)
+        statements = [query['sql'] for query in ctx.captured_queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(len(statements), 2)
+        self.assertEqual(SurgerySequence.objects.get(branch=self.branch, day=self.day).last_seq_number, 6)
+        self.assertEqual(allocate_seq_numbers(self.branches[1].id, self.day.pk), 1)
+
+    def test_add_surgery_uses_counter(self):
+        from .sequence import allocate_seq_numbers
+        allocate_seq_numbers(self.branch.id, self.day.pk)
+        surgeon = Surgeon.objects.create(full_name='Хирург счётчика', branch=self.branch)
+        response = self.client.post(f'/add_surgery/{self.branch.id}?date={self.day_date.isoformat()}', {
+            'full_name': 'Новый', 'diagnost': 'Диагноз', 'surgery_name': 'Аппендэктомия',
+            'surgery_type': 'ВМП', 'surgeons': [surgeon.id],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Surgery.objects.get(full_name='Новый').seq_number, 5)
+
+    def test_delete_compacts_and_resets_counter(self):
+        from .sequence import allocate_seq_numbers
+        first = Surgery.objects.get(branch=self.branch, date_of_surgery=self.day, seq_number=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/surgery/{first.id}/delete/')
+        self.assertEqual(self.seq_numbers(), [1, 2])
+        self.assertEqual(len(get_day_schedule(self.day)[0]['surgeries']), 2)
+        self.assertEqual(get_day_schedule(self.day)[0]['surgeries'][1]['seq_number'], 2)
+        self.assertEqual(allocate_seq_numbers(self.branch.id, self.day.pk), 3)
+
+    def test_reorder_keeps_counter_ahead(self):
+        from .sequence import allocate_seq_numbers
+        ids = list(Surgery.objects.filter(branch=self.branch).order_by('seq_number').values_list('id', flat=True))
+        allocate_seq_numbers(self.branch.id, self.day.pk)
+        payload = [{'id': pk, 'seq_number': seq} for pk, seq in zip(ids, (9, 2, 1))]
+        response = self.client.post('/update_seq_number/', json.dumps(payload), content_type='application/json')
+        self.assertTrue(response.json()['success'])
+        self.assertEqual(allocate_seq_numbers(self.branch.id, self.day.pk), 10)
+
+    def test_admin_add_uses_counter_and_locks_position(self):
+        from .sequence import allocate_seq_numbers
+        allocate_seq_numbers(self.branch.id, self.day.pk)
+        surgeon = Surgeon.objects.create(full_name='Хирург админки', branch=self.branch)
+        response = self.client.post('/admin/backend/surgery/add/', {
+            'seq_number': 1, 'branch': self.branch.id, 'own_branch': self.branch.id, 'full_name': 'Из админки',
+            'diagnost': 'Диагноз', 'surgery_name': self.surgery_name.id, 'surgeons': [surgeon.id],
+            'date_of_surgery': self.day.pk,
+        })
+        self.assertEqual(response.status_code, 302)
+        surgery = Surgery.objects.get(full_name='Из админки')
+        self.assertEqual(surgery.seq_number, 5)
+
+        other_day = SurgeryDay.objects.create(date=date(2025, 3, 5))
+        response = self.client.post(f'/admin/backend/surgery/{surgery.id}/change/', {
+            'seq_number': 1, 'branch': self.branches[1].id, 'own_branch': self.branch.id, 'full_name': 'Исправлено',
+            'diagnost': 'Диагноз', 'surgery_name': self.surgery_name.id, 'surgeons': [surgeon.id],
+            'date_of_surgery': other_day.pk,
+        })
+        self.assertEqual(response.status_code, 302)
+        surgery.refresh_from_db()
+        self.assertEqual((surgery.full_name, surgery.seq_number, surgery.branch, surgery.date_of_surgery),
+                         ('Исправлено', 5, self.branch, self.day))
+
+
+class SeqAllocatorConcurrencyTests(TransactionTestCase):
+    @skipUnless(connection.vendor == 'postgresql', 'SQLite serialises writers by locking the whole database.')
+    def test_parallel_bookings_get_distinct_numbers(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from threading import Barrier
+        from django.db import connections, transaction
+        from .sequence import allocate_seq_numbers
+        day = SurgeryDay.objects.create(date=date(2025, 3, 4))
+        branch = Branch.objects.create(name='Отдел', branch_number=1)
+        surgery_name = SurgeryName.objects.create(surgery_name='Аппендэктомия')
+        workers, per_worker = 8, 5
+        barrier = Barrier(workers)
+
+        def book(worker):
+            try:
+                barrier.wait()
+                for i in range(per_worker):
+                    with transaction.atomic():
+                        Surgery.objects.create(
+                            seq_number=allocate_seq_numbers(branch.id, day.pk), branch=branch, own_branch=branch,
+                            full_name=f'Пациент {worker}.{i}', diagnost='Диагноз', surgery_name=surgery_name,
+                            date_of_surgery=day,
+                        )
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(workers) as executor:
+            list(executor.map(book, range(workers)))
+        self.assertEqual(sorted(Surgery.objects.values_list('seq_number', flat=True)),
+                         list(range(1, workers * per_worker + 1)))
+
+
+class SurgeryFormTests(ScheduleDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.branch = self.branches[0]
+        self.surgeon = Surgeon.objects.create(full_name='Хирург формы', branch=self.branch)
+        self.other_surgeon = Surgeon.objects.create(full_name='Хирург другого отдела', branch=self.branches[1])
+        self.client.force_login(
+            CustomUser.objects.create_superuser('admin', 'pass', first_name='A', last_name='B')
+        )
+        day_calendar.ensure_current()
+        hospital_calendar.ensure_current()
+        surgery_name_index.load()
+
+    def data(self, **overrides):
+        return {'full_name': 'Пациент формы', 'diagnost': 'Диагноз', 'surgery_name': 'Аппендэктомия',
+                'surgery_type': 'ВМП', 'surgeons': [self.surgeon.id], **overrides}
+
+    def test_surgeons_limited_to_branch(self):
+        from .forms import SurgeryForm
+        form = SurgeryForm(self.data(surgeons=[self.other_surgeon.id]), day=self.day, branch=self.branch)
+        self.assertFalse(form.is_valid())
+        self.assertIn('surgeons', form.errors)
+
+    def test_save_binds_day_branch_and_catalog(self):
+        from .forms import SurgeryForm
+        form = SurgeryForm(self.data(surgery_name='Новая операция', surgery_type=''), day=self.day, branch=self.branch)
+        self.assertTrue(form.is_valid())
+        with self.captureOnCommitCallbacks(execute=True):
+            surgery, _ = form.save(commit=False)
+        self.assertEqual((surgery.date_of_surgery, surgery.branch, surgery.own_branch), (self.day, self.branch, self.branch))
+        self.assertIsNone(surgery.surgery_type_id)
+        self.assertEqual(SurgeryName.objects.get(pk=surgery.surgery_name_id).surgery_name, 'Новая операция')
+        self.assertEqual(surgery_name_index.get_pk('Новая операция'), surgery.surgery_name_id)
+        self.assertIsNone(surgery_name_index.get_pk('новая операция'))
+
+    def test_database_mode_resolves_without_index(self):
+        surgery_name_index.version = None
+        with mock.patch.object(surgery_name_index, 'load') as load:
+            pk = surgery_name_index.resolve('Аппендэктомия')
+        self.assertEqual(pk, self.surgery_name.pk)
+        load.assert_not_called()
+
+    def add(self, day_date):
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(f'/add_surgery/{self.branch.id}?date={day_date.isoformat()}', self.data())
+        self.assertEqual(response.status_code, 302)
+        return [query['sql'] for query in ctx.captured_queries if 'SAVEPOINT' not in query['sql']]
+
+    @override_settings(CATALOG_SEARCH_MODE='memory')
+    def test_booking_query_count_fixed(self):
+        from .sequence import lock_sequence
+        with self.captureOnCommitCallbacks(execute=True):
+            busy = SurgeryDay.objects.create(date=date(2025, 3, 5))
+        self.add_surgeries(self.branch, 20, day=busy)
+        day_calendar.ensure_current()
+        for day in (self.day, busy):
+            lock_sequence(self.branch.id, day.pk)
+        self.add(self.day_date)
+        self.add(busy.date)
+        quiet, crowded = self.add(self.day_date), self.add(busy.date)
+        self.assertEqual(len(quiet), len(crowded))
+        self.assertFalse([sql for sql in quiet if 'backend_surgeryname' in sql or 'backend_surgerytype' in sql])
+        self.assertEqual(Surgery.objects.filter(date_of_surgery=busy, full_name='Пациент формы').count(), 2)
+
+    def test_edit_form_handles_missing_type(self):
+        self.add_surgeries(self.branch, 1, surgeons_per_surgery=0)
+        surgery = Surgery.objects.get(branch=self.branch)
+        surgery.surgeons.set([self.surgeon])
+        response = self.client.post(f'/surgery/{surgery.id}/edit/', self.data(surgery_type=''))
+        self.assertEqual(response.status_code, 302)
+        surgery.refresh_from_db()
+        self.assertIsNone(surgery.surgery_type)
+        self.assertEqual(self.client.get(f'/surgery/{surgery.id}/edit/').status_code, 200)
+        response = self.client.post(f'/surgery/{surgery.id}/edit/', self.data(surgeons=[self.other_surgeon.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(surgery.surgeons.all()), [self.surgeon])
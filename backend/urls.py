@@ -1,29 +1,48 @@
 from django.urls import path
 from .views import (home, profile,
+                    week_overview,
+                    surgery_row,
+                    schedule_events,
+                    day_api,
+                    add_surgeries,
+                    book_surgeries_api,
+                    month_overview,
                     add_surgery,
                     search_surgery_name,
                     search_surgery_type,
+                    search_stats,
                     edit_surgery,
                     delete_surgery,
                     update_seq_number,
                     change_editable_surgeryday,
                     update_surgery_seq,
-                    generate_pdf)
+                    generate_pdf,
+                    export_surgeries)
 from django.contrib.auth.views import LoginView, LogoutView
 
 
 urlpatterns = [
     path('', home, name='home'),
+    path('week/', week_overview, name='week_overview'),
+    path('month/', month_overview, name='month_overview'),
     path('login/', LoginView.as_view(template_name='login.html', next_page='/'), name='login'),
     path('logout/', LogoutView.as_view(next_page='/'), name='logout'),
     path('download-pdf/', generate_pdf, name='download_pdf'),
+    path('export/', export_surgeries, name='export_surgeries'),
     path('profile/', profile, name='profile'),
 
     path('add_surgery/<int:branch_id>', add_surgery, name='add_surgery'),
+    path('add_surgeries/<int:branch_id>', add_surgeries, name='add_surgeries'),
     path('search_surgery_name/', search_surgery_name, name='search_surgery_name'),
     path('search_surgery_type/', search_surgery_type, name='search_surgery_type'),
+    path('search_stats/', search_stats, name='search_stats'),
     path('surgery/<int:surgery_id>/edit/', edit_surgery, name='edit_surgery'),
     path('surgery/<int:surgery_id>/delete/', delete_surgery, name='delete_surgery'),
+    path('surgery/<int:surgery_id>/row/', surgery_row, name='surgery_row'),
+    path('events/day/<int:day_id>/', schedule_events, name='schedule_events'),
+    path('api/days/<str:date_param>/', day_api, name='day_api'),
+    path('api/days/<str:date_param>/branches/<int:branch_id>/surgeries/', book_surgeries_api,
+         name='book_surgeries_api'),
 
     path('update_seq_number/', update_seq_number, name='update_seq_number'),
 
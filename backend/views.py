@@ -1,19 +1,33 @@
-import os
 import json
+import hashlib
 from django.conf import settings
 from django.shortcuts import render, HttpResponse, get_object_or_404, redirect
 from django.http.request import HttpRequest, UnreadablePostError
 from .models import Branch
-from django.http import HttpResponseRedirect, JsonResponse
-from .models import Surgery, Branch, SurgeryName, SurgeryType, Surgeon, SurgeryDay
-from .forms import SurgeryForm, SurgeryEditForm
-from .functions import get_next_surgery_day, get_day, get_next_30_days, get_or_create_surgery_day
-from django.db.models.functions import Lower
+from django.http import Http404, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from .models import Surgery, Branch, Surgeon, SurgeryDay
+from .forms import SurgeryForm, SurgeryEditForm, SurgeryBatchEntryForm
+from .booking import book_surgeries, check_capacity, BookingError
+from .sequence import allocate_seq_numbers, lock_sequence, set_last_seq_number, delete_and_compact
+from .functions import get_next_surgery_day, get_day
+from .schedule import get_day_schedule, get_head_branch_ids, get_schedule_version
+from .events import get_broker, format_sse, RESYNC_EVENT
+from .signals import notify_day_changed
+from .overview import get_period, build_overview
+from .export import EXPORT_FORMATS, stream_export, aiter_blocks
+from .api import DAY_API_FIELDS, parse_fields, build_day_payload
+from .search import search_surgery_names, search_surgery_types, get_search_stats
+from .pdf import (build_pdf_content, get_pdf_digest, get_cached_pdf_path, get_cached_pdf_mtime, write_cached_pdf,
+                  arender_pdf, RendererBusy, RenderTimeout)
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import Prefetch, Q
+from django.utils.decorators import decorator_from_middleware
+from django.db import IntegrityError, transaction
 from datetime import date, timedelta, datetime
-from django.template.loader import render_to_string
-from weasyprint import HTML
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.http import http_date
+from asgiref.sync import sync_to_async
+from core.metrics import CACHE_REQUESTS
+from core.middleware import CompressionMiddleware
 
 
 dir_ = 'staticfiles/fonts/'
@@ -31,30 +45,174 @@ def home(request: HttpRequest):
 
     if selected_date:
         day = get_day(selected_date)
-        if not day:
-            branches = []
-        else:
-            branches = Branch.objects.prefetch_related(
-                Prefetch('surgeries', queryset=Surgery.objects.filter(date_of_surgery=day).order_by('seq_number'))
-            ).order_by('branch_number')
     else:
         day = get_next_surgery_day()
-        print(day)
-        branches = Branch.objects.prefetch_related(
-            Prefetch('surgeries', queryset=Surgery.objects.filter(date_of_surgery=day).order_by('seq_number'))
-        ).order_by('branch_number')
-
-        queryset=Surgery.objects.filter(date_of_surgery=day)
-        print(len(queryset))
-    
-    if branches and request.user.is_authenticated:
-        qs = branches.filter(heads=request.user)
-        if request.user.is_superuser:
-            pass
-        elif qs:
-            branches = qs
 
-    return render(request, 'index.html', {'branches': branches, 'day': day})
+    branches, editable_branch_ids = get_visible_schedule(request, day)
+    return render(request, 'index.html', {
+        'branches': branches,
+        'day': day,
+        'editable_branch_ids': editable_branch_ids,
+        'schedule_version': get_schedule_version(day.pk) if day else '',
+    })
+
+
+def get_visible_schedule(request: HttpRequest, day):
+    head_branch_ids = get_head_branch_ids(request.user)
+    if not day:
+        branches = []
+    elif request.user.is_superuser or not head_branch_ids:
+        branches = get_day_schedule(day)
+    else:
+        branches = get_day_schedule(day, branch_ids=head_branch_ids)
+
+    if request.user.is_superuser:
+        editable_branch_ids = {branch['id'] for branch in branches}
+    else:
+        editable_branch_ids = head_branch_ids
+    return branches, editable_branch_ids
+
+
+def surgery_row(request: HttpRequest, surgery_id: int):
+    # One table row, rendered like the day view, for clients patching the page
+    # after a schedule event.
+    surgery = get_object_or_404(Surgery.objects.only('branch_id', 'date_of_surgery_id'), id=surgery_id)
+    day = get_object_or_404(SurgeryDay, pk=surgery.date_of_surgery_id)
+    branches, editable_branch_ids = get_visible_schedule(request, day)
+    for branch in branches:
+        if branch['id'] == surgery.branch_id:
+            for row in branch['surgeries']:
+                if row['id'] == surgery_id:
+                    return render(request, 'surgery_row.html', {
+                        'surgery': row,
+                        'branch': branch,
+                        'day': day,
+                        'editable_branch_ids': editable_branch_ids,
+                    })
+    raise Http404
+
+
+async def schedule_events(request: HttpRequest, day_id: int):
+    subscription = get_broker().subscribe(day_id)
+    # The page was rendered at ?version=; anything committed since then and
+    # before this connection would be missed, so ask the client to reload.
+    version = request.GET.get('version')
+    stale = bool(version) and version != await sync_to_async(get_schedule_version)(day_id)
+
+    async def stream():
+        try:
+            yield f'retry: {settings.SCHEDULE_EVENTS_RETRY_MS}\n\n'
+            if stale:
+                yield format_sse(RESYNC_EVENT)
+            while True:
+                event = await subscription.get(settings.SCHEDULE_EVENTS_HEARTBEAT)
+                yield format_sse(event) if event else ': keepalive\n\n'
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop reverse proxies from buffering the stream.
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@decorator_from_middleware(CompressionMiddleware)
+def day_api(request: HttpRequest, date_param: str):
+    try:
+        selected_date = date.fromisoformat(date_param)
+    except ValueError:
+        return HttpResponse("Invalid date format.", status=400)
+    fields = parse_fields(request.GET.get('fields'))
+    if fields is None:
+        return JsonResponse({'success': False, 'error': f"Unknown field, allowed: {', '.join(DAY_API_FIELDS)}"}, status=400)
+    day = get_day(selected_date)
+    if not day:
+        return JsonResponse({'success': False, 'error': 'Surgery day not found.'}, status=404)
+
+    head_branch_ids = get_head_branch_ids(request.user)
+    branch_ids = None if request.user.is_superuser or not head_branch_ids else head_branch_ids
+    # The per-day version changes with every write to the day, so a poll
+    # that has nothing new costs a calendar lookup, a cache read and a 304.
+    scope = ','.join(map(str, sorted(branch_ids))) if branch_ids is not None else 'all'
+    etag = quote_etag(hashlib.md5(
+        f"{get_schedule_version(day.pk)}:{scope}:{','.join(fields)}".encode()
+    ).hexdigest())
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        payload = build_day_payload(day, get_day_schedule(day, branch_ids=branch_ids), fields)
+        response = JsonResponse(payload, json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def overview(request: HttpRequest, period: str):
+    try:
+        anchor = date.fromisoformat(request.GET.get('date', ''))
+    except ValueError:
+        anchor = date.today()
+    start, end = get_period(anchor, period)
+
+    head_branch_ids = get_head_branch_ids(request.user)
+    if request.user.is_superuser or not head_branch_ids:
+        data = build_overview(start, end)
+    else:
+        data = build_overview(start, end, branch_ids=head_branch_ids)
+
+    return render(request, 'overview.html', {
+        **data,
+        'period': period,
+        'previous': start - timedelta(days=1),
+        'next': end + timedelta(days=1),
+    })
+
+
+def week_overview(request: HttpRequest):
+    return overview(request, 'week')
+
+
+def month_overview(request: HttpRequest):
+    return overview(request, 'month')
+
+
+def move_surgery(surgery_id: int, new_branch: Branch, new_seq_number: int):
+    # Only the (branch, day) rows touched by the move are locked and rewritten.
+    # The group is locked in id order before anything else so concurrent moves
+    # serialise instead of deadlocking or interleaving sequences.
+    with transaction.atomic():
+        current = Surgery.objects.only('branch_id', 'date_of_surgery_id').get(id=surgery_id)
+        day_id = current.date_of_surgery_id
+        # Counters first, in branch order, like every other writer.
+        for branch_id in sorted({current.branch_id, new_branch.pk}):
+            lock_sequence(branch_id, day_id)
+        rows = list(Surgery.objects.select_for_update().filter(
+            date_of_surgery=day_id, branch_id__in={current.branch_id, new_branch.pk}
+        ).order_by('id').only('id', 'seq_number', 'branch_id', 'date_of_surgery_id'))
+        surgery = next((row for row in rows if row.id == surgery_id), None)
+        if surgery is None or surgery.branch_id != current.branch_id:
+            raise Surgery.DoesNotExist
+        rows.sort(key=lambda row: (row.seq_number, row.id))
+        before = {row.id: (row.branch_id, row.seq_number) for row in rows}
+
+        old_rows = [row for row in rows if row.branch_id == surgery.branch_id and row.id != surgery.id]
+        new_rows = [row for row in rows if row.branch_id == new_branch.pk and row.id != surgery.id]
+        position = min(max(new_seq_number, 1), len(new_rows) + 1)
+        new_rows.insert(position - 1, surgery)
+        surgery.branch_id = new_branch.pk
+
+        for index, row in enumerate(new_rows, start=1):
+            row.seq_number = index
+        if new_branch.pk != current.branch_id:
+            for index, row in enumerate(old_rows, start=1):
+                row.seq_number = index
+
+        changed = [row for row in rows if before[row.id] != (row.branch_id, row.seq_number)]
+        Surgery.objects.bulk_update(changed, ['branch', 'seq_number'])
+        set_last_seq_number(new_branch.pk, day_id, len(new_rows))
+        if new_branch.pk != current.branch_id:
+            set_last_seq_number(current.branch_id, day_id, len(old_rows))
+        transaction.on_commit(lambda: notify_day_changed(day_id))
 
 
 @csrf_exempt
@@ -64,32 +222,10 @@ def update_surgery_seq(request: HttpRequest):
         surgery_id = data.get('surgery_id')
         new_seq_number = data.get('new_seq_number')
         new_branch_number = data.get('new_branch_number')
-        branch_id = data.get('branch_id')
 
         try:
-            surgery = Surgery.objects.get(id=surgery_id)
-            old_branch = surgery.branch
             new_branch = Branch.objects.get(branch_number=int(new_branch_number))
-
-            if old_branch.pk != new_branch.pk:
-                surgery.branch_id = new_branch.pk
-
-            surgery.seq_number = int(new_seq_number)
-            surgery.save()
-
-            surgeries = Surgery.objects.filter(branch_id=old_branch.id).exclude(id=surgery.id).order_by('seq_number')
-            for index, item in enumerate(surgeries, start=1):
-                item.seq_number = index
-                item.save()
-                print(item.seq_number, 'old')
-
-            surgeries_in_new_branch = Surgery.objects.filter(branch_id=new_branch.pk).exclude(id=surgery.id).order_by('seq_number')
-            for index, item in enumerate(surgeries_in_new_branch, start=1):
-                if index >= int(new_seq_number):
-                    item.seq_number = index + 1
-                    item.save()
-                    print(item.seq_number, 'new')
-
+            move_surgery(int(surgery_id), new_branch, int(new_seq_number))
             return JsonResponse({'success': True})
         except Surgery.DoesNotExist:
             return JsonResponse({'success': False, 'error': 'Surgery not found.'})
@@ -109,71 +245,131 @@ def add_surgery(request: HttpRequest, branch_id):
     if date_str:
         try:
             date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
-            day = get_or_create_surgery_day(date=date_obj)
+            day = get_day(date_obj)
             if not day:
                 raise ValueError
         except ValueError:
             return HttpResponse("Invalid date format.", status=400)
     else:
         day = get_next_surgery_day()
-    
+
     branch = get_object_or_404(Branch, id=branch_id)
 
-    surgery_names = SurgeryName.objects.all()
-    surgery_types = SurgeryType.objects.all()
     surgeons = Surgeon.objects.filter(branch=branch).order_by('full_name')
 
     if request.method == 'POST':
-        form = SurgeryForm(request.POST)
+        form = SurgeryForm(request.POST, day=day, branch=branch)
 
         if form.is_valid():
-            surgery, surgeons = form.save(commit=False)
-            surgery.branch = branch
-            surgery.own_branch = branch
-            surgery.seq_number = Surgery.objects.filter(branch__id=branch_id).filter(date_of_surgery=day).count() + 1
-            surgery.save()
-            surgery.surgeons.set(surgeons)
-            return HttpResponseRedirect('/')
-        else:
+            try:
+                # A rejected booking also rolls back catalog names the form created.
+                with transaction.atomic():
+                    surgery, surgeons = form.save(commit=False)
+                    counter = lock_sequence(branch.pk, day.pk)
+                    check_capacity(branch.pk, day.pk)
+                    surgery.seq_number = allocate_seq_numbers(branch.pk, day.pk, counter=counter)
+                    surgery.save()
+                    surgery.surgeons.set(surgeons)
+                return HttpResponseRedirect('/')
+            except BookingError as err:
+                form.add_error(None, str(err))
+        elif not form.non_field_errors():
             print(form.errors)
             raise UnreadablePostError("Form is not valid!")
     else:
-        form = SurgeryForm()
+        form = SurgeryForm(day=day, branch=branch)
 
     context = {
         'form': form,
         'branch': branch,
-        'surgery_names': surgery_names,
-        'surgery_types': surgery_types,
         'surgeons': surgeons,
     }
-    return render(request, 'add_surgery.html', context)
+    # Closed theatre or full day: show the form again with the reason.
+    status = 400 if form.is_bound else 200
+    return render(request, 'add_surgery.html', context, status=status)
 
 
-def search_surgery_name(request: HttpRequest):
-    query = request.GET.get('query', '').lower()
+def add_surgeries(request: HttpRequest, branch_id: int):
+    # Batch entry page; the rows are posted as one JSON list to book_surgeries_api.
+    date_str = request.GET.get('date')
+    try:
+        day = get_day(date.fromisoformat(date_str)) if date_str else get_next_surgery_day()
+    except ValueError:
+        day = None
+    if not day:
+        return HttpResponse("Invalid date format.", status=400)
+    branch = get_object_or_404(Branch, id=branch_id)
+    return render(request, 'add_surgeries.html', {
+        'branch': branch,
+        'day': day,
+        'surgeons': Surgeon.objects.filter(branch=branch).order_by('full_name'),
+        'batch_limit': settings.BOOKING_BATCH_LIMIT,
+    })
+
+
+def book_surgeries_api(request: HttpRequest, date_param: str, branch_id: int):
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Invalid request.'}, status=405)
+    if not request.user.is_authenticated:
+        return JsonResponse({'success': False, 'error': 'Forbidden'}, status=403)
+    if not request.user.is_superuser and branch_id not in get_head_branch_ids(request.user):
+        return JsonResponse({'success': False, 'error': 'Forbidden'}, status=403)
+    try:
+        day = get_day(date.fromisoformat(date_param))
+    except ValueError:
+        return HttpResponse("Invalid date format.", status=400)
+    if not day:
+        return JsonResponse({'success': False, 'error': 'Surgery day not found.'}, status=404)
+    if not day.editable:
+        return JsonResponse({'success': False, 'error': 'Surgery day is not editable.'}, status=400)
+    branch = get_object_or_404(Branch, id=branch_id)
 
+    try:
+        entries = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'error': 'Invalid JSON.'}, status=400)
+    if not isinstance(entries, list) or not entries or not all(isinstance(entry, dict) for entry in entries):
+        return JsonResponse({'success': False, 'error': 'Expected a non-empty list of surgeries.'}, status=400)
+    if len(entries) > settings.BOOKING_BATCH_LIMIT:
+        return JsonResponse({'success': False, 'error': f'At most {settings.BOOKING_BATCH_LIMIT} surgeries per request.'},
+                            status=400)
+
+    surgeon_choices = list(Surgeon.objects.filter(branch=branch).values_list('id', 'full_name'))
+    entry_forms = [SurgeryBatchEntryForm(entry, surgeon_choices=surgeon_choices) for entry in entries]
+    if not all([form.is_valid() for form in entry_forms]):
+        return JsonResponse({'success': False, 'error': 'Invalid surgeries.',
+                             'errors': [form.errors.get_json_data() for form in entry_forms]}, status=400)
+
+    try:
+        ids = book_surgeries(day, branch, [form.cleaned_data for form in entry_forms])
+    except BookingError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    return JsonResponse({'success': True, 'ids': ids}, status=201)
+
+
+def search_surgery_name(request: HttpRequest):
+    query = request.GET.get('query', '').strip()
     if query:
-        results = SurgeryName.objects.all()
-        results = [i for i in results if query in i.surgery_name.lower()][:10]
-        data = [{'id': item.id, 'surgery_name': item.surgery_name} for item in results]
-        return JsonResponse(data, safe=False)
+        return JsonResponse(search_surgery_names(query), safe=False)
     return JsonResponse([], safe=False)
 
 
 def search_surgery_type(request: HttpRequest):
-    query = request.GET.get('query', '').lower()
+    query = request.GET.get('query', '').strip()
     if query:
-        results = SurgeryType.objects.filter()
-        results = [i for i in results if query in i.type_name.lower()][:10]
-        data = [{'id': item.id, 'type_name': item.type_name} for item in results]
-        return JsonResponse(data, safe=False)
+        return JsonResponse(search_surgery_types(query), safe=False)
     return JsonResponse([], safe=False)
 
 
+def search_stats(request: HttpRequest):
+    if not request.user.is_superuser:
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    return JsonResponse(get_search_stats())
+
+
 def edit_surgery(request: HttpRequest, surgery_id: int):
-    surgery = get_object_or_404(Surgery, id=surgery_id)
-    branch = Branch.objects.get(pk=surgery.branch.pk)
+    surgery = get_object_or_404(Surgery.objects.select_related('branch', 'surgery_name', 'surgery_type'), id=surgery_id)
+    branch = surgery.branch
 
     if request.method == 'POST':
         form = SurgeryEditForm(request.POST, instance=surgery)
@@ -195,22 +391,68 @@ def edit_surgery(request: HttpRequest, surgery_id: int):
 def delete_surgery(request: HttpRequest, surgery_id: int):
     surgery = get_object_or_404(Surgery, id=surgery_id)
     if request.method == 'POST':
-        surgery.delete()
+        delete_and_compact(surgery)
     return redirect('home')
 
 
+def parse_seq_payload(data) -> dict:
+    if not isinstance(data, list) or not data:
+        raise ValueError("Expected a non-empty list of {id, seq_number}.")
+    seq_numbers = {}
+    for item in data:
+        if not isinstance(item, dict):
+            raise ValueError("Expected a non-empty list of {id, seq_number}.")
+        try:
+            surgery_id, seq_number = int(item['id']), int(item['seq_number'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Invalid item: {item}")
+        if seq_number < 1:
+            raise ValueError(f"Invalid seq_number for surgery {surgery_id}.")
+        if surgery_id in seq_numbers:
+            raise ValueError(f"Duplicate surgery {surgery_id}.")
+        seq_numbers[surgery_id] = seq_number
+    if len(set(seq_numbers.values())) != len(seq_numbers):
+        raise ValueError("Duplicate seq_number in payload.")
+    return seq_numbers
+
+
 @csrf_exempt
 def update_seq_number(request: HttpRequest):
     if request.method == "POST":
         try:
-            data = json.loads(request.body)
-            for item in data:
-                surgery = Surgery.objects.get(id=item['id'])
-                surgery.seq_number = item['seq_number']
-                surgery.save()
-            return JsonResponse({"success": True}, status=200)
-        except Exception as e:
+            seq_numbers = parse_seq_payload(json.loads(request.body))
+        except ValueError as e:
             return JsonResponse({"success": False, "error": str(e)}, status=400)
+
+        try:
+            with transaction.atomic():
+                # The (branch, day) counter is locked before the rows, as in move_surgery.
+                for branch_id, day_id in sorted(set(Surgery.objects.filter(id__in=seq_numbers).values_list(
+                        'branch_id', 'date_of_surgery_id'))):
+                    lock_sequence(branch_id, day_id)
+                surgeries = list(Surgery.objects.select_for_update().filter(id__in=seq_numbers).only(
+                    'id', 'seq_number', 'branch_id', 'date_of_surgery_id'
+                ))
+                if len(surgeries) != len(seq_numbers):
+                    missing = set(seq_numbers) - {surgery.id for surgery in surgeries}
+                    return JsonResponse({"success": False, "error": f"Surgeries not found: {sorted(missing)}"}, status=400)
+                groups = {(surgery.branch_id, surgery.date_of_surgery_id) for surgery in surgeries}
+                if len(groups) != 1:
+                    return JsonResponse({"success": False, "error": "Surgeries belong to different branches or days."}, status=400)
+
+                for surgery in surgeries:
+                    surgery.seq_number = seq_numbers[surgery.id]
+                Surgery.objects.bulk_update(surgeries, ['seq_number'])
+
+                branch_id, day_id = groups.pop()
+                transaction.on_commit(lambda: notify_day_changed(day_id))
+                ordering = list(Surgery.objects.filter(branch_id=branch_id, date_of_surgery_id=day_id).order_by(
+                    'seq_number', 'id'
+                ).values('id', 'seq_number'))
+                set_last_seq_number(branch_id, day_id, ordering[-1]['seq_number'])
+        except IntegrityError:
+            return JsonResponse({"success": False, "error": "seq_number already used in this branch and day."}, status=400)
+        return JsonResponse({"success": True, "ordering": ordering}, status=200)
     return JsonResponse({"success": False, "error": "Invalid method"}, status=405)
 
 
@@ -222,12 +464,12 @@ def change_editable_surgeryday(request: HttpRequest, surgeryday_id: int):
     return redirect('/')
 
 
-def generate_pdf(request: HttpRequest):
+def resolve_pdf_request(request: HttpRequest):
     date_str = request.GET.get('date')
     if date_str:
         try:
             date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
-            day = get_or_create_surgery_day(date=date_obj)
+            day = get_day(date_obj)
             if not day:
                 raise ValueError
         except ValueError:
@@ -236,57 +478,80 @@ def generate_pdf(request: HttpRequest):
         day = get_next_surgery_day()
 
     if request.user.is_authenticated:
-        try:
-            if request.user.is_superuser:
-                branches = Branch.objects.prefetch_related('surgeries').order_by('branch_number')
-            else:
-                branches = Branch.objects.prefetch_related('surgeries'
-                                                            ).filter(heads=request.user
-                                                                ).order_by('branch_number')
-        except Exception as err:
-            branches = Branch.objects.prefetch_related('surgeries').all().order_by('branch_number')
-            print(err)
+        if request.user.is_superuser:
+            branches = get_day_schedule(day)
+        else:
+            branches = get_day_schedule(day, branch_ids=get_head_branch_ids(request.user))
     else:
         return HttpResponse('Not found')
 
-    WEEKDAYS_RU = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
-    date_str = day.date.strftime('%d.%m.%Y')
-    weekday_str = WEEKDAYS_RU[day.date.weekday()]
-
-    branches_data = []
-    for branch in branches:
-        surgeries = branch.surgeries.filter(date_of_surgery=day).order_by('seq_number')
-        surgeries_data = []
-        for surgery in surgeries:
-            surgeons = [surgeon.full_name for surgeon in surgery.surgeons.all()]
-            surgeries_data.append({
-                "number": f"{branch.branch_number}.{surgery.seq_number}",
-                "notes": surgery.surgery_type.type_name if surgery.surgery_type else "-",
-                "department": surgery.own_branch.name,
-                "patient_name": surgery.full_name,
-                "age": str(surgery.age) if surgery.age else "-",
-                "diagnosis": surgery.diagnost,
-                "operation_name": surgery.surgery_name.surgery_name,
-                "surgeons": surgeons,
-            })
-        branches_data.append({
-            "branch_number": branch.branch_number,
-            "surgeries": surgeries_data,
-        })
-
-    content = {
-        "date": date_str,
-        "weekday": weekday_str,
-        "branches": branches_data,
-    }
-    html_content = render_to_string("pdf_template.html", content)
-
-    # return render(request, 'pdf_template.html', context=content)
+    content = build_pdf_content(day, branches)
+    digest = get_pdf_digest(content)
+    path = get_cached_pdf_path(day, [branch['id'] for branch in branches], digest)
+    return {'day': day, 'content': content, 'etag': quote_etag(digest), 'path': path}
+
+
+async def generate_pdf(request: HttpRequest):
+    pdf = await sync_to_async(resolve_pdf_request)(request)
+    if isinstance(pdf, HttpResponse):
+        return pdf
+
+    path = pdf['path']
+    # File system calls run off the event loop, like the render itself.
+    last_modified = await sync_to_async(get_cached_pdf_mtime, thread_sensitive=False)(path)
+    response = get_conditional_response(request, etag=pdf['etag'], last_modified=last_modified)
+    CACHE_REQUESTS.inc(cache='pdf', result='miss' if response is None and last_modified is None else 'hit')
+    if response is None:
+        if last_modified is None:
+            try:
+                data = await arender_pdf(pdf['content'], base_url=request.build_absolute_uri())
+            except (RendererBusy, RenderTimeout):
+                response = HttpResponse("PDF generation is busy, try again shortly.", status=503)
+                response["Retry-After"] = str(settings.PDF_RENDER_RETRY_AFTER)
+                return response
+            await sync_to_async(write_cached_pdf, thread_sensitive=False)(path, data)
+            last_modified = await sync_to_async(get_cached_pdf_mtime, thread_sensitive=False)(path)
+        else:
+            data = await sync_to_async(path.read_bytes, thread_sensitive=False)()
+        response = HttpResponse(data, content_type="application/pdf")
+        response["Content-Disposition"] = f'inline; filename="operations_{pdf["day"].date}.pdf"'
+
+    response["ETag"] = pdf['etag']
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
-    response = HttpResponse(content_type="application/pdf")
-    response["Content-Disposition"] = f'inline; filename="operations_{day.date}.pdf"'
 
-    base_url = settings.STATIC_URL if settings.DEBUG else settings.STATIC_ROOT
-    HTML(string=html_content, base_url=request.build_absolute_uri()).write_pdf(response)
+def resolve_export_request(request: HttpRequest):
+    if not request.user.is_authenticated:
+        return HttpResponse('Not found', status=403)
+
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponse("Unknown export format.", status=400)
+    try:
+        start = date.fromisoformat(request.GET['start']) if request.GET.get('start') else date.today().replace(day=1)
+        end = date.fromisoformat(request.GET['end']) if request.GET.get('end') else get_period(start, 'month')[1]
+        branch_ids = {int(branch_id) for branch_id in request.GET.getlist('branch')} or None
+    except ValueError:
+        return HttpResponse("Invalid date format.", status=400)
+    if end < start:
+        return HttpResponse("Invalid date range.", status=400)
+
+    if not request.user.is_superuser:
+        head_branch_ids = get_head_branch_ids(request.user)
+        branch_ids = head_branch_ids & branch_ids if branch_ids else head_branch_ids
+    return {'format': export_format, 'start': start, 'end': end, 'branch_ids': branch_ids}
+
+
+async def export_surgeries(request: HttpRequest):
+    export = await sync_to_async(resolve_export_request)(request)
+    if isinstance(export, HttpResponse):
+        return export
+
+    blocks = stream_export(export['format'], export['start'], export['end'], export['branch_ids'])
+    response = StreamingHttpResponse(aiter_blocks(blocks), content_type=EXPORT_FORMATS[export['format']][1])
+    filename = f"surgeries_{export['start']:%Y-%m-%d}_{export['end']:%Y-%m-%d}.{export['format']}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
     return response
-
@@ -0,0 +1,196 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.conf import settings
+from django.db import connection
+from django.http import HttpRequest, HttpResponse
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REGISTRY = []
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for name, labels, value in self.samples():
+            lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), function=None):
+        # function() returns {label tuple: value} and is evaluated at scrape time.
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self.key(labels)] = value
+
+    def samples(self):
+        if self.function is None:
+            yield from super().samples()
+            return
+        try:
+            values = self.function()
+        except Exception:
+            return
+        for key, value in values.items():
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(counts), total)) for key, (counts, total) in self._values.items()]
+        for key, (counts, total) in items:
+            labels = dict(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, counts):
+                yield f'{self.name}_bucket', {**labels, 'le': format_value(bound)}, count
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, counts[-1]
+
+
+def database_connections() -> dict:
+    if connection.vendor != 'postgresql':
+        return {}
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COALESCE(state, 'unknown'), COUNT(*) FROM pg_stat_activity "
+            "WHERE datname = current_database() GROUP BY 1"
+        )
+        return {(state,): count for state, count in cursor.fetchall()}
+
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Request latency by URL name.', ('view', 'method', 'status'))
+PDF_RENDER_DURATION = Histogram(
+    'pdf_render_duration_seconds', 'WeasyPrint render time.', ('source',))
+PDF_RENDER_QUEUE_DEPTH = Gauge(
+    'pdf_render_queue_depth', 'PDF renders queued or running in this process.')
+TYPEAHEAD_REQUESTS = Counter(
+    'typeahead_requests_total', 'Typeahead lookups; use rate() for QPS.', ('catalog', 'mode'))
+CACHE_REQUESTS = Counter(
+    'cache_requests_total', 'Cache lookups by cache and result (hit/miss).', ('cache', 'result'))
+SCHEDULER_JOB_RUNS = Counter(
+    'scheduler_job_runs_total', 'Scheduler job executions.', ('job',))
+SCHEDULER_JOB_FAILURES = Counter(
+    'scheduler_job_failures_total', 'Scheduler job executions that raised.', ('job',))
+DB_CONNECTIONS = Gauge(
+    'db_connections', 'Connections to this database by state (PostgreSQL only).', ('state',),
+    function=database_connections)
+
+
+def metrics_allowed(request: HttpRequest) -> bool:
+    if request.user.is_authenticated and request.user.is_superuser:
+        return True
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request: HttpRequest):
+    if not metrics_allowed(request):
+        return HttpResponse('Forbidden', status=403)
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    # Same allow-list as /metrics; there are no sessions outside the web process.
+
+    def do_GET(self):
+        try:
+            if self.client_address[0] in settings.METRICS_ALLOWED_IPS:
+                status, content_type, body = 200, CONTENT_TYPE, render_metrics().encode()
+            else:
+                status, content_type, body = 403, 'text/plain; charset=utf-8', b'Forbidden'
+        finally:
+            # DB_CONNECTIONS opens a connection in this handler thread.
+            connection.close()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port: int, host: str = '') -> ThreadingHTTPServer:
+    """
+    Serve this process's metrics on a background thread, for processes
+    without the web app (manage.py run_scheduler) whose counters would
+    otherwise never be scraped.
+    """
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
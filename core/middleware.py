@@ -0,0 +1,180 @@
+import re
+import json
+import random
+import logging
+import contextvars
+import brotli
+from time import perf_counter
+from collections import Counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from .metrics import REQUEST_DURATION
+
+
+logger = logging.getLogger('core.requests')
+
+_request_metrics = contextvars.ContextVar('request_metrics', default=None)
+
+IN_LIST_RE = re.compile(r'\((?:%s, )+%s\)')
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+ACCEPTS_BROTLI_RE = re.compile(r'\bbr\b')
+
+
+def fingerprint(sql: str) -> str:
+    return LITERAL_RE.sub('?', IN_LIST_RE.sub('(...)', sql))
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.fingerprints = Counter()
+        self.timings = {}
+
+    def record_query(self, sql: str, seconds: float):
+        self.queries += 1
+        self.sql_seconds += seconds
+        self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self) -> list:
+        return [(sql, count) for sql, count in self.fingerprints.most_common() if count > 1]
+
+
+def record_timing(name: str, seconds: float):
+    metrics = _request_metrics.get()
+    if metrics is not None:
+        metrics.timings[name] = metrics.timings.get(name, 0.0) + seconds
+
+
+def sql_timer(execute, sql, params, many, context):
+    metrics = _request_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.record_query(sql, perf_counter() - started)
+
+
+def install_sql_timer(connection, **kwargs):
+    if sql_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_timer)
+
+
+connection_created.connect(install_sql_timer)
+
+
+class RequestMetricsMiddleware:
+    # Every request feeds the latency histogram behind /metrics. A sampled
+    # share also records SQL count/time, repeated query fingerprints (N+1
+    # suspects) and named timings such as PDF rendering, reported through a
+    # Server-Timing header and one JSON log line.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        for connection in connections.all(initialized_only=True):
+            install_sql_timer(connection)
+
+    def start(self):
+        if random.random() >= settings.REQUEST_METRICS_SAMPLE_RATE:
+            return None, None
+        metrics = RequestMetrics()
+        return metrics, _request_metrics.set(metrics)
+
+    def finish(self, request, response, started: float, metrics, token):
+        if token is not None:
+            _request_metrics.reset(token)
+        match = request.resolver_match
+        REQUEST_DURATION.observe(
+            perf_counter() - started,
+            view=match.url_name if match else 'unresolved',
+            method=request.method,
+            status=response.status_code,
+        )
+        if metrics is None:
+            return response
+        return self.report(request, response, metrics)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = perf_counter()
+        metrics, token = self.start()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            if token is not None:
+                _request_metrics.reset(token)
+            raise
+        return self.finish(request, response, started, metrics, token)
+
+    async def __acall__(self, request):
+        started = perf_counter()
+        metrics, token = self.start()
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            if token is not None:
+                _request_metrics.reset(token)
+            raise
+        return self.finish(request, response, started, metrics, token)
+
+    def report(self, request, response, metrics: RequestMetrics):
+        total_ms = (perf_counter() - metrics.started) * 1000
+        sql_ms = metrics.sql_seconds * 1000
+        duplicates = metrics.duplicates()
+        match = request.resolver_match
+
+        server_timing = [
+            f'app;dur={total_ms:.1f}',
+            f'db;dur={sql_ms:.1f};desc="{metrics.queries} queries"',
+        ]
+        server_timing += [f'{name};dur={seconds * 1000:.1f}' for name, seconds in metrics.timings.items()]
+        response['Server-Timing'] = ', '.join(server_timing)
+
+        logger.info(json.dumps({
+            'view': match.view_name if match else None,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(total_ms, 2),
+            'sql_queries': metrics.queries,
+            'sql_ms': round(sql_ms, 2),
+            'duplicate_queries': sum(count - 1 for _, count in duplicates),
+            'duplicate_fingerprints': [{'sql': sql, 'count': count} for sql, count in duplicates[:3]],
+            'timings_ms': {name: round(seconds * 1000, 2) for name, seconds in metrics.timings.items()},
+        }, ensure_ascii=False))
+        return response
+
+
+class CompressionMiddleware(GZipMiddleware):
+    # GZipMiddleware that prefers brotli when the client accepts it. Brotli is
+    # only used for whole responses; streams keep gzip.
+
+    def process_response(self, request, response):
+        if (response.streaming or len(response.content) < 200 or response.has_header('Content-Encoding')
+                or not ACCEPTS_BROTLI_RE.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        compressed_content = brotli.compress(response.content, quality=settings.BROTLI_QUALITY)
+        if len(compressed_content) >= len(response.content):
+            return response
+        response.content = compressed_content
+        response.headers['Content-Length'] = str(len(response.content))
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -56,6 +57,7 @@ JAZZMIN_SETTINGS = {
 }
 
 MIDDLEWARE = [
+    'core.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -107,6 +109,62 @@ DATABASES = {
     }
 }
 
+if os.getenv('DATABASE_ENGINE') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Local memory is per process; point CACHE_BACKEND at the file-based backend
+# when running several workers (or the separate run_scheduler process) so
+# schedule invalidation and PDF re-render markers are shared between them.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'orderingsurgery'),
+    }
+}
+
+SCHEDULE_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Typeahead backend: 'database' (trigram-indexed SQL) or 'memory' (in-process
+# index kept current by model signals, see backend/search.py).
+CATALOG_SEARCH_MODE = os.getenv('CATALOG_SEARCH_MODE', 'database')
+
+# Share of requests timed by core.middleware.RequestMetricsMiddleware
+# (Server-Timing header plus a JSON line on the core.requests logger).
+REQUEST_METRICS_SAMPLE_RATE = float(os.getenv('REQUEST_METRICS_SAMPLE_RATE', 1.0))
+
+# manage.py test keeps the per-request JSON lines out of its output; tests
+# that check them use assertLogs.
+TESTING = sys.argv[1:2] == ['test']
+
+# Clients allowed to scrape /metrics without a superuser session.
+METRICS_ALLOWED_IPS = os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1').split(',')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '{message}', 'style': '{'},
+    },
+    'handlers': {
+        'requests': {'class': 'logging.StreamHandler', 'formatter': 'message'},
+    },
+    'loggers': {
+        'core.requests': {
+            'handlers': ['requests'],
+            'level': os.getenv('REQUEST_METRICS_LOG_LEVEL', 'WARNING' if TESTING else 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -150,6 +208,58 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Rendered operation plans are kept under MEDIA_ROOT / PDF_CACHE_DIR / <date>/.
+PDF_CACHE_DIR = 'pdf'
+
+# WeasyPrint runs in a dedicated process pool. Requests beyond the queue size
+# get a 503 with Retry-After; 0 workers renders inline (tests, debugging).
+PDF_RENDER_WORKERS = int(os.getenv('PDF_RENDER_WORKERS', 2))
+PDF_RENDER_QUEUE_SIZE = int(os.getenv('PDF_RENDER_QUEUE_SIZE', 8))
+PDF_RENDER_TIMEOUT = int(os.getenv('PDF_RENDER_TIMEOUT', 60))
+PDF_RENDER_RETRY_AFTER = 10
+
+# Tomorrow's plan is rendered ahead of time for every visible branch set and
+# re-rendered once edits to that day have been quiet for the debounce period.
+# Background renders have no request, so logo URLs resolve against this.
+PDF_BASE_URL = os.getenv('PDF_BASE_URL', 'http://localhost:8000/')
+PDF_PRERENDER_CRON = {'hour': 15, 'minute': 5}
+PDF_PRERENDER_DEBOUNCE = 60
+
+# Day folders under PDF_CACHE_DIR older than this are removed nightly.
+PDF_CACHE_RETENTION_DAYS = 30
+
+# SurgeryDay rows are created ahead of time for this many days (daily job);
+# requests only look days up.
+CALENDAR_HORIZON_DAYS = 90
+
+# Most surgeries one batch booking request may insert.
+BOOKING_BATCH_LIMIT = 50
+
+# /api/days/ responses are small and hot: a mid brotli level keeps the
+# per-request CPU low.
+BROTLI_QUALITY = 5
+
+# Live day-view updates (server-sent events). LocalBroker only reaches clients
+# of the same process; use backend.events.DatabaseBroker (or CacheBroker with
+# Redis/Memcached) for several workers or to see the scheduler's day locking.
+SCHEDULE_EVENTS_BACKEND = os.getenv('SCHEDULE_EVENTS_BACKEND', 'backend.events.LocalBroker')
+SCHEDULE_EVENTS_QUEUE_SIZE = 100
+SCHEDULE_EVENTS_HEARTBEAT = 15
+SCHEDULE_EVENTS_POLL_INTERVAL = 1.0
+SCHEDULE_EVENTS_RETRY_MS = 5000
+
+# A surgery day stops being editable at DAY_LOCK_TIME on the following day.
+DAY_LOCK_TIME = os.getenv('DAY_LOCK_TIME', '15:00')
+DAY_LOCK_TIMEZONE = os.getenv('DAY_LOCK_TIMEZONE', TIME_ZONE)
+
+# manage.py run_scheduler holds a PostgreSQL advisory lock; on other databases
+# (SQLite in development) this file is locked instead.
+SCHEDULER_LOCK_FILE = os.getenv('SCHEDULER_LOCK_FILE', str(BASE_DIR / 'scheduler.lock'))
+
+# Port on which run_scheduler serves its own metrics (the web /metrics only
+# sees the web process); 0 turns it off. Scrapers need METRICS_ALLOWED_IPS.
+SCHEDULER_METRICS_PORT = int(os.getenv('SCHEDULER_METRICS_PORT', 0))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
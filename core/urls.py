@@ -16,9 +16,11 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from .metrics import metrics_view
 
 
 urlpatterns = [
     path('admin/', admin.site.urls, name='admin'),
+    path('metrics', metrics_view, name='metrics'),
     path('', include('backend.urls')),
 ]